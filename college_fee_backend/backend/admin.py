@@ -1,8 +1,10 @@
+from django import forms
 from django.contrib import admin
+from .money import to_paise, to_rupees
 from .models import (
     User, StudentProfile, FeeComponent, FeeTemplate, FeeTemplateComponent, 
     FeeAssignment, Invoice, InvoiceComponent, Payment, PaymentComponent, 
-    Notification, CustomFeeStructure, Receipt
+    Notification, CustomFeeStructure, CustomFeeComponent, FeeAssignmentOverride, Receipt
 )
 
 class FeeTemplateComponentInline(admin.TabularInline):
@@ -176,12 +178,36 @@ class FeeTemplateComponentAdmin(admin.ModelAdmin):
     list_filter = ('template__admission_mode', 'template__dept', 'template__fee_type')
     search_fields = ('template__name', 'component__name')
 
+class RupeeAmountForm(forms.ModelForm):
+    """Edits a row's paise `amount` in rupees: 5000 is stored as 500000 paise"""
+    amount = forms.DecimalField(label='Amount (₹)', max_digits=12, decimal_places=2, min_value=0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.amount is not None:
+            self.initial['amount'] = to_rupees(self.instance.amount)
+
+    def clean_amount(self):
+        return to_paise(self.cleaned_data['amount'])
+
+class FeeAssignmentOverrideInline(admin.TabularInline):
+    model = FeeAssignmentOverride
+    form = RupeeAmountForm
+    extra = 0
+    fields = ('component', 'amount')
+
 @admin.register(FeeAssignment)
 class FeeAssignmentAdmin(admin.ModelAdmin):
     list_display = ('student', 'template', 'assignment_type', 'academic_year', 'assigned_at', 'is_active')
     list_filter = ('assignment_type', 'academic_year', 'template__admission_mode', 'template__dept', 'is_active')
     search_fields = ('student__name', 'student__usn', 'template__name')
     ordering = ('-assigned_at',)
+    inlines = [FeeAssignmentOverrideInline]
+    readonly_fields = ('overrides',)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_overrides()
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
@@ -218,12 +244,31 @@ class NotificationAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'message')
     ordering = ('-created_at',)
 
+class CustomFeeComponentInline(admin.TabularInline):
+    model = CustomFeeComponent
+    form = RupeeAmountForm
+    extra = 1
+    fields = ('component_name', 'amount')
+
 @admin.register(CustomFeeStructure)
 class CustomFeeStructureAdmin(admin.ModelAdmin):
     list_display = ('student', 'total_amount', 'created_at', 'updated_at')
     list_filter = ('student__dept', 'student__semester')
     search_fields = ('student__name', 'student__usn')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('components', 'total_amount', 'created_at', 'updated_at')
+    inlines = [CustomFeeComponentInline]
+
+    def save_formset(self, request, form, formset, change):
+        # Rows carry the structure's student, for per-department aggregates
+        for row in formset.save(commit=False):
+            row.student_id = form.instance.student_id
+            row.save()
+        for row in formset.deleted_objects:
+            row.delete()
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_components()
 
 @admin.register(Receipt)
 class ReceiptAdmin(admin.ModelAdmin):
@@ -0,0 +1,323 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .models import Invoice, Payment, StudentProfile
+from .money import PAISE_PER_RUPEE, to_paise
+
+# Column kinds and their array dtypes. Categorical strings are stored as codes
+# into a per-column dictionary, money as integer paise, dates as datetime64.
+COLUMN_DTYPES = {
+    'id': np.int32,
+    'int': np.int16,
+    'bool': np.bool_,
+    'category': np.int16,
+    'money': np.int64,
+    'date': 'datetime64[D]',
+    'datetime': 'datetime64[s]',
+}
+NUMERIC_KINDS = ('id', 'int', 'money')
+GROUPABLE_KINDS = ('int', 'bool', 'category')
+
+# Snapshot tables: column name -> (ORM path, kind). Student dimensions are
+# copied onto invoices and payments so queries never need a join.
+TABLES = {
+    'students': (StudentProfile, {
+        'id': ('id', 'id'),
+        'dept': ('dept', 'category'),
+        'semester': ('semester', 'int'),
+        'batch': ('batch', 'category'),
+        'admission_mode': ('admission_mode', 'category'),
+        'status': ('status', 'category'),
+        'is_active': ('is_active', 'bool'),
+    }),
+    'invoices': (Invoice, {
+        'id': ('id', 'id'),
+        'student_id': ('student_id', 'id'),
+        'dept': ('student__dept', 'category'),
+        'semester': ('student__semester', 'int'),
+        'batch': ('student__batch', 'category'),
+        'admission_mode': ('student__admission_mode', 'category'),
+        'academic_year': ('academic_year', 'category'),
+        'invoice_semester': ('semester', 'int'),
+        'status': ('status', 'category'),
+        'total_amount': ('total_amount', 'money'),
+        'paid_amount': ('paid_amount', 'money'),
+        'balance_amount': ('balance_amount', 'money'),
+        'due_date': ('due_date', 'date'),
+        'created_at': ('created_at', 'datetime'),
+    }),
+    'payments': (Payment, {
+        'id': ('id', 'id'),
+        'invoice_id': ('invoice_id', 'id'),
+        'student_id': ('invoice__student_id', 'id'),
+        'dept': ('invoice__student__dept', 'category'),
+        'semester': ('invoice__student__semester', 'int'),
+        'admission_mode': ('invoice__student__admission_mode', 'category'),
+        'invoice_semester': ('invoice__semester', 'int'),
+        'mode': ('mode', 'category'),
+        'status': ('status', 'category'),
+        'amount': ('amount', 'money'),
+        'timestamp': ('timestamp', 'datetime'),
+    }),
+}
+
+SNAPSHOT_POINTER = 'CURRENT'
+BUILD_CHUNK_SIZE = 10000
+
+
+# Building
+
+def _to_array(values, kind, categories):
+    if kind == 'category':
+        codes = [categories.setdefault(value or '', len(categories)) for value in values]
+        return np.array(codes, dtype=COLUMN_DTYPES[kind])
+    if kind == 'money':
+        return np.array([to_paise(value) if value is not None else 0 for value in values], dtype=np.int64)
+    if kind == 'datetime':
+        seconds = [int(value.timestamp()) for value in values]
+        return np.array(seconds, dtype=np.int64).astype(COLUMN_DTYPES[kind])
+    if kind == 'date':
+        return np.array(values, dtype=COLUMN_DTYPES[kind])
+    return np.array([value or 0 for value in values], dtype=COLUMN_DTYPES[kind])
+
+
+def _build_table(name, directory):
+    model, columns = TABLES[name]
+    paths = [path for path, kind in columns.values()]
+    categories = {column: {} for column, (path, kind) in columns.items() if kind == 'category'}
+    chunks = {column: [] for column in columns}
+
+    rows = model.objects.order_by('id').values_list(*paths).iterator(chunk_size=BUILD_CHUNK_SIZE)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BUILD_CHUNK_SIZE:
+            _append_chunk(columns, batch, chunks, categories)
+            batch = []
+    if batch:
+        _append_chunk(columns, batch, chunks, categories)
+
+    for column, (path, kind) in columns.items():
+        array = np.concatenate(chunks[column]) if chunks[column] else np.array([], dtype=COLUMN_DTYPES[kind])
+        np.save(os.path.join(directory, f'{name}.{column}.npy'), array)
+
+    return {
+        'rows': sum(len(chunk) for chunk in chunks['id']),
+        'columns': {column: kind for column, (path, kind) in columns.items()},
+        'categories': {column: list(values) for column, values in categories.items()},
+    }
+
+
+def _append_chunk(columns, batch, chunks, categories):
+    values = list(zip(*batch))
+    for index, (column, (path, kind)) in enumerate(columns.items()):
+        chunks[column].append(_to_array(values[index], kind, categories.get(column)))
+
+
+def build_snapshot():
+    """
+    Write a new snapshot of every table and make it current
+
+    The snapshot is written to its own directory and published by atomically
+    replacing the CURRENT pointer, so readers never see a half-written one.
+    Older snapshots beyond ANALYTICS_SNAPSHOTS_KEPT are removed.
+    """
+    root = settings.ANALYTICS_SNAPSHOT_DIR
+    os.makedirs(root, exist_ok=True)
+    created_at = timezone.now()
+    name = created_at.strftime('%Y%m%dT%H%M%S%f')
+    building = os.path.join(root, f'.{name}')
+    os.makedirs(building)
+
+    meta = {'created_at': created_at.isoformat(), 'tables': {}}
+    for table in TABLES:
+        meta['tables'][table] = _build_table(table, building)
+    with open(os.path.join(building, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    os.rename(building, os.path.join(root, name))
+
+    pointer = os.path.join(root, f'.{SNAPSHOT_POINTER}.{name}')
+    with open(pointer, 'w') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(root, SNAPSHOT_POINTER))
+
+    snapshots = sorted(entry for entry in os.listdir(root) if not entry.startswith('.') and entry != SNAPSHOT_POINTER)
+    for old in snapshots[:-settings.ANALYTICS_SNAPSHOTS_KEPT]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return name, meta
+
+
+# Querying
+
+class Table:
+    """Memory-mapped columns of one snapshot table"""
+
+    def __init__(self, name, directory, meta):
+        self.name = name
+        self.rows = meta['rows']
+        self.kinds = meta['columns']
+        self.categories = meta['categories']
+        self.codes = {
+            column: {value: code for code, value in enumerate(values)}
+            for column, values in self.categories.items()
+        }
+        self.columns = {
+            column: np.load(os.path.join(directory, f'{name}.{column}.npy'), mmap_mode='r')
+            for column in self.kinds
+        }
+
+    def _value(self, column, raw):
+        kind = self.kinds[column]
+        if kind == 'category':
+            return self.codes[column].get(raw, -1)
+        if kind == 'money':
+            return to_paise(raw)
+        if kind == 'bool':
+            return raw.lower() in ('1', 'true', 'yes')
+        if kind in ('date', 'datetime'):
+            return np.datetime64(raw, 'D' if kind == 'date' else 's')
+        return int(raw)
+
+    def mask(self, filters):
+        """
+        Boolean mask for `filters`, a mapping of lookups to raw query values
+
+        `column=a,b` matches any listed value; `column__gt`, `__gte`, `__lt` and
+        `__lte` compare numeric and date columns. Raises ValueError for unknown
+        columns and malformed values.
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for lookup, raw in filters.items():
+            column, _, operator = lookup.partition('__')
+            if column not in self.kinds:
+                raise ValueError(f"Unknown column '{column}' for {self.name}. Available columns: {', '.join(self.kinds)}")
+            data = self.columns[column]
+            try:
+                if not operator:
+                    mask &= np.isin(data, [self._value(column, value) for value in raw.split(',')])
+                elif operator in ('gt', 'gte', 'lt', 'lte') and self.kinds[column] not in ('category', 'bool'):
+                    value = self._value(column, raw)
+                    mask &= {'gt': data > value, 'gte': data >= value, 'lt': data < value, 'lte': data <= value}[operator]
+                else:
+                    raise ValueError(f"Unsupported lookup '{lookup}'")
+            except (ArithmeticError, TypeError) as e:
+                raise ValueError(f"Invalid value for {lookup}: {raw}") from e
+        return mask
+
+    def _decode(self, column, code):
+        kind = self.kinds[column]
+        if kind == 'category':
+            return self.categories[column][code]
+        if kind == 'bool':
+            return bool(code)
+        return int(code)
+
+    def aggregate(self, group_by=(), metrics=('count',), mask=None):
+        """
+        Group the masked rows and compute `metrics` per group
+
+        Metrics are 'count' or '<op>:<column>' where op is sum, mean, min, max,
+        median or pNN (a percentile, e.g. p90). Money is returned in rupees.
+        """
+        for column in group_by:
+            if self.kinds.get(column) not in GROUPABLE_KINDS:
+                raise ValueError(f"Cannot group {self.name} by '{column}'")
+        parsed = [self._parse_metric(metric) for metric in metrics]
+        if mask is None:
+            mask = np.ones(self.rows, dtype=bool)
+        selected = int(mask.sum())
+
+        if group_by:
+            keys = np.stack([np.asarray(self.columns[column])[mask].astype(np.int64) for column in group_by], axis=1)
+            groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            groups = np.zeros((1, 0), dtype=np.int64)
+            inverse = np.zeros(selected, dtype=np.intp)
+        counts = np.bincount(inverse, minlength=len(groups))
+
+        results = {}
+        for metric, operator, column in parsed:
+            if operator == 'count':
+                results[metric] = counts.tolist()
+                continue
+            values = np.asarray(self.columns[column])[mask].astype(np.float64)
+            if self.kinds[column] == 'money':
+                values /= PAISE_PER_RUPEE
+            results[metric] = self._compute(operator, values, inverse, counts)
+
+        rows = []
+        for index, key in enumerate(groups):
+            row = {column: self._decode(column, code) for column, code in zip(group_by, key)}
+            row.update({metric: values[index] for metric, values in results.items()})
+            rows.append(row)
+        return selected, rows
+
+    def _parse_metric(self, metric):
+        if metric == 'count':
+            return metric, 'count', None
+        operator, _, column = metric.partition(':')
+        if self.kinds.get(column) not in NUMERIC_KINDS:
+            raise ValueError(f"'{metric}' needs a numeric column of {self.name}")
+        if operator not in ('sum', 'mean', 'min', 'max', 'median') and not (
+            operator.startswith('p') and operator[1:].isdigit() and 0 <= int(operator[1:]) <= 100
+        ):
+            raise ValueError(f"Unknown metric '{metric}'. Use count, sum, mean, min, max, median or pNN")
+        return metric, operator, column
+
+    def _compute(self, operator, values, inverse, counts):
+        groups = len(counts)
+        if operator in ('sum', 'mean'):
+            sums = np.bincount(inverse, weights=values, minlength=groups)
+            if operator == 'sum':
+                return [round(value, 2) for value in sums.tolist()]
+            return [round(total / count, 2) if count else None for total, count in zip(sums.tolist(), counts.tolist())]
+        if operator in ('min', 'max'):
+            ufunc = np.minimum if operator == 'min' else np.maximum
+            extremes = np.full(groups, np.inf if operator == 'min' else -np.inf)
+            ufunc.at(extremes, inverse, values)
+            return [value if count else None for value, count in zip(extremes.tolist(), counts.tolist())]
+
+        # Percentiles: sort by group then value, and read each group's slice
+        percentile = 50 if operator == 'median' else int(operator[1:])
+        ordered = values[np.lexsort((values, inverse))]
+        ends = np.cumsum(counts)
+        return [
+            round(float(np.percentile(ordered[end - count:end], percentile)), 2) if count else None
+            for end, count in zip(ends.tolist(), counts.tolist())
+        ]
+
+
+class Snapshot:
+    def __init__(self, name, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.name = name
+        self.created_at = meta['created_at']
+        self.tables = {table: Table(table, directory, info) for table, info in meta['tables'].items()}
+
+
+_current = None
+_current_lock = threading.Lock()
+
+
+def get_snapshot():
+    """The current snapshot, memory-mapped once per process, or None before the first refresh"""
+    global _current
+    root = settings.ANALYTICS_SNAPSHOT_DIR
+    try:
+        with open(os.path.join(root, SNAPSHOT_POINTER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    snapshot = _current
+    if snapshot is not None and snapshot.name == name:
+        return snapshot
+    with _current_lock:
+        if _current is None or _current.name != name:
+            _current = Snapshot(name, os.path.join(root, name))
+        return _current
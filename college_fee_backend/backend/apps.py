@@ -8,3 +8,4 @@ class BackendConfig(AppConfig):
     def ready(self):
         # Import signals when the app is ready
         import backend.models  # noqa
+        import backend.signals  # noqa
@@ -0,0 +1,245 @@
+import csv
+import re
+from contextlib import nullcontext
+from decimal import InvalidOperation
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from .caching import invalidate_student_dashboards
+from .ledger import post_payments
+from .models import Invoice, InvoiceComponent, Payment, PaymentComponent
+from .money import to_paise, to_rupees
+from .rollups import add_collections, add_component_collections, tracking_invoice_cube
+from .settlement import allocate_in_order
+
+# Rows matched and posted per transaction
+IMPORT_CHUNK_SIZE = 500
+OFFLINE_MODES = ('neft', 'dd', 'cash')
+
+# Accepted header names of each column, compared case-insensitively
+IMPORT_COLUMNS = {
+    'date': ('date', 'value_date', 'txn_date', 'transaction_date'),
+    'amount': ('amount', 'credit', 'credit_amount', 'deposit'),
+    'usn': ('usn',),
+    'invoice_number': ('invoice_number', 'invoice', 'reference'),
+    'narration': ('narration', 'description', 'remarks', 'particulars'),
+    'transaction_id': ('transaction_id', 'utr', 'reference_no', 'ref_no', 'cheque_no'),
+    'mode': ('mode',),
+}
+
+_MONEY_NOISE = re.compile(r'[,\s₹]|INR|Rs\.?', re.IGNORECASE)
+_TOKEN = re.compile(r'[A-Za-z0-9]+')
+
+
+def _column_map(fieldnames):
+    normalized = {name.strip().lower().replace(' ', '_'): name for name in fieldnames or []}
+    return {
+        column: next((normalized[alias] for alias in aliases if alias in normalized), None)
+        for column, aliases in IMPORT_COLUMNS.items()
+    }
+
+
+def read_statement(file):
+    """Yield (line, row) pairs of a bank statement CSV with the columns renamed to IMPORT_COLUMNS"""
+    reader = csv.DictReader(file)
+    columns = _column_map(reader.fieldnames)
+    if not columns['amount']:
+        raise ValueError(f"The file needs an amount column ({', '.join(IMPORT_COLUMNS['amount'])})")
+    for line, raw in enumerate(reader, start=2):
+        yield line, {column: (raw.get(header) or '').strip() for column, header in columns.items() if header}
+
+
+def read_records(records):
+    """Yield (number, row) pairs of JSON payment records keyed by IMPORT_COLUMNS names"""
+    for number, record in enumerate(records, start=1):
+        record = record if isinstance(record, dict) else {}
+        yield number, {column: str(record.get(column) or '').strip() for column in IMPORT_COLUMNS}
+
+
+class InvoiceIndex:
+    """
+    In-memory lookup of open invoices by invoice number and by student USN
+
+    Built with one query before the import, so matching a row costs no
+    database work. Balances are not kept here; they are read with the rows
+    locked when a chunk is posted.
+    """
+
+    def __init__(self):
+        self.by_number = {}
+        self.by_usn = {}
+        self.user_of = {}
+        rows = Invoice.objects.filter(balance_amount__gt=0).order_by('due_date', 'id').values_list(
+            'id', 'invoice_number', 'student__usn', 'student__user_id'
+        )
+        for invoice_id, number, usn, user_id in rows.iterator():
+            self.by_number[number.upper()] = invoice_id
+            if usn:
+                self.by_usn.setdefault(usn.upper(), []).append(invoice_id)
+            self.user_of[invoice_id] = user_id
+
+    def match(self, row):
+        """Candidate invoice ids of a row, oldest due first, and how they were found"""
+        if row.get('invoice_number'):
+            invoice_id = self.by_number.get(row['invoice_number'].upper())
+            return ([invoice_id], 'invoice_number') if invoice_id else ([], None)
+        if row.get('usn'):
+            return self.by_usn.get(row['usn'].upper(), []), 'usn'
+        tokens = [token.upper() for token in _TOKEN.findall(row.get('narration', ''))]
+        for token in tokens:
+            if token in self.by_number:
+                return [self.by_number[token]], 'narration'
+        for token in tokens:
+            if token in self.by_usn:
+                return self.by_usn[token], 'narration'
+        return [], None
+
+
+def _parse_paise(value):
+    try:
+        return to_paise(_MONEY_NOISE.sub('', value or ''))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def import_offline_payments(rows, default_mode='neft', dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Post offline payments from (line, row) pairs and report what could not be matched
+
+    Each row is matched to an invoice through the InvoiceIndex, by invoice
+    number, USN or either found in the narration. A USN match is spread over
+    the student's open invoices, oldest due first. Rows whose transaction id
+    was already posted are reported as duplicates; rows with an amount above
+    the outstanding balance are left unmatched rather than overpaying.
+    Matched rows are posted per chunk in one transaction, with set-based
+    invoice updates and bulk component allocations. With `dry_run` every
+    write is rolled back.
+    """
+    index = InvoiceIndex()
+    result = {
+        'rows': 0, 'posted': 0, 'payments': 0, 'amount': 0, 'skipped': 0,
+        'matched_by': dict.fromkeys(('invoice_number', 'usn', 'narration'), 0),
+        'unmatched': [], 'duplicates': [], 'dry_run': dry_run,
+    }
+    seen_transactions = set()
+
+    # Chunks commit one by one; a dry run wraps them all in a transaction to roll back
+    with transaction.atomic() if dry_run else nullcontext():
+        chunk = []
+        for line, row in rows:
+            result['rows'] += 1
+            amount = _parse_paise(row.get('amount'))
+            if amount is None or amount <= 0:
+                # Debits and blank lines of a statement carry no credit
+                result['skipped'] += 1
+                continue
+            mode = (row.get('mode') or default_mode).lower()
+            if mode not in OFFLINE_MODES:
+                result['unmatched'].append({'line': line, 'row': row, 'reason': f'Unknown mode {mode}'})
+                continue
+            transaction_id = row.get('transaction_id', '')
+            if transaction_id and transaction_id in seen_transactions:
+                result['duplicates'].append({'line': line, 'row': row, 'reason': 'Repeated in this file'})
+                continue
+            seen_transactions.add(transaction_id)
+            invoice_ids, matched_by = index.match(row)
+            if not invoice_ids:
+                result['unmatched'].append({'line': line, 'row': row, 'reason': 'No open invoice matches the USN or reference'})
+                continue
+            chunk.append({
+                'line': line, 'row': row, 'amount': amount, 'mode': mode,
+                'transaction_id': transaction_id, 'invoice_ids': invoice_ids, 'matched_by': matched_by,
+            })
+            if len(chunk) >= chunk_size:
+                _post_chunk(chunk, index, result)
+                chunk = []
+        if chunk:
+            _post_chunk(chunk, index, result)
+        if dry_run:
+            transaction.set_rollback(True)
+    result['amount'] = to_rupees(result['amount'])
+    return result
+
+
+def _post_chunk(entries, index, result):
+    with transaction.atomic():
+        posted_transactions = set(
+            Payment.objects.filter(
+                transaction_id__in=[entry['transaction_id'] for entry in entries if entry['transaction_id']],
+                status='success'
+            ).values_list('transaction_id', flat=True)
+        )
+        invoice_ids = {invoice_id for entry in entries for invoice_id in entry['invoice_ids']}
+        balances = {
+            invoice_id: to_paise(balance) for invoice_id, balance in
+            Invoice.objects.select_for_update().filter(pk__in=invoice_ids).values_list('id', 'balance_amount')
+        }
+
+        # Decide each row against the locked balances, oldest invoice first, in paise
+        payments = []
+        for entry in entries:
+            if entry['transaction_id'] in posted_transactions:
+                result['duplicates'].append({'line': entry['line'], 'row': entry['row'], 'reason': 'Already posted'})
+                continue
+            open_ids = [invoice_id for invoice_id in entry['invoice_ids'] if balances.get(invoice_id, 0) > 0]
+            if sum(balances[invoice_id] for invoice_id in open_ids) < entry['amount']:
+                result['unmatched'].append({
+                    'line': entry['line'], 'row': entry['row'], 'reason': 'Amount exceeds the outstanding balance'
+                })
+                continue
+            remaining = entry['amount']
+            for invoice_id in open_ids:
+                if remaining <= 0:
+                    break
+                applied = min(remaining, balances[invoice_id])
+                balances[invoice_id] -= applied
+                remaining -= applied
+                payments.append(Payment(
+                    invoice_id=invoice_id, amount=to_rupees(applied), mode=entry['mode'],
+                    transaction_id=entry['transaction_id'], status='success'
+                ))
+            result['posted'] += 1
+            result['amount'] += entry['amount']
+            result['matched_by'][entry['matched_by']] += 1
+        if not payments:
+            return
+
+        # Numbered from the same locked counter as Payment.save, held until the chunk commits
+        for payment, reference in zip(payments, Payment.reserve_references(len(payments))):
+            payment.payment_reference = reference
+        Payment.objects.bulk_create(payments)
+
+        components = {}
+        for component in InvoiceComponent.objects.select_for_update().filter(
+            invoice_id__in={payment.invoice_id for payment in payments}
+        ).order_by('id'):
+            components.setdefault(component.invoice_id, []).append(component)
+        allocations = []
+        for payment in payments:
+            allocations += allocate_in_order(payment, components.get(payment.invoice_id, []), to_paise(payment.amount))[0]
+        InvoiceComponent.objects.bulk_update(
+            [component for rows in components.values() for component in rows], ['paid_amount', 'balance_amount']
+        )
+        PaymentComponent.objects.bulk_create(allocations)
+
+        totals = {}
+        for payment in payments:
+            totals[payment.invoice_id] = totals.get(payment.invoice_id, 0) + to_paise(payment.amount)
+        paid = Case(
+            *[When(pk=invoice_id, then=Value(to_rupees(amount))) for invoice_id, amount in totals.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        )
+        with tracking_invoice_cube(totals):
+            Invoice.objects.filter(pk__in=totals).update(
+                paid_amount=F('paid_amount') + paid,
+                balance_amount=F('balance_amount') - paid,
+                updated_at=timezone.now()
+            )
+            Invoice.objects.filter(pk__in=totals).update(status=Case(
+                When(balance_amount__lte=0, then=Value('paid')), default=Value('partial')
+            ))
+        add_collections(payments)
+        add_component_collections(allocations)
+        post_payments(payments)
+        invalidate_student_dashboards({index.user_of[invoice_id] for invoice_id in totals})
+        result['payments'] += len(payments)
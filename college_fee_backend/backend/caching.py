@@ -0,0 +1,200 @@
+import time
+import logging
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Fee catalog cache
+#
+# Fee components and templates change a few times a year but are read on almost
+# every request. Entries are stored under a catalog version (Django's cache key
+# versioning), so invalidation is a single counter bump instead of a key scan.
+FEE_CATALOG_CACHE_ALIAS = 'fee_catalog'
+CATALOG_VERSION_KEY = 'fee_catalog:version'
+
+
+def get_catalog_cache():
+    return caches[FEE_CATALOG_CACHE_ALIAS]
+
+
+def get_catalog_version():
+    """Return the current catalog version, initialising it if missing"""
+    cache = get_catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a version key that was evicted never falls back
+        # to a number that older (stale) entries were stored under.
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY) or int(time.time() * 1000)
+    return version
+
+
+def bump_catalog_version():
+    cache = get_catalog_cache()
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+    logger.info(f"Fee catalog cache invalidated, now at version {version}")
+    # Template-based fee breakdowns on cached dashboards come from the catalog
+    invalidate_all_student_dashboards()
+    return version
+
+
+def invalidate_fee_catalog():
+    """Invalidate all catalog entries once the current transaction commits"""
+    transaction.on_commit(bump_catalog_version)
+
+
+def _catalog_read_through(key, builder):
+    cache = get_catalog_cache()
+    version = get_catalog_version()
+    value = cache.get(key, version=version)
+    if value is None:
+        value = builder()
+        cache.set(key, value, version=version)
+    return value
+
+
+def _build_fee_components():
+    from .models import FeeComponent
+    return list(FeeComponent.objects.order_by('id').values('id', 'name', 'amount'))
+
+
+def _build_fee_templates():
+    from .models import FeeTemplate, FeeTemplateComponent
+
+    templates = {
+        t['id']: dict(t, components=[])
+        for t in FeeTemplate.objects.order_by('id').values(
+            'id', 'name', 'admission_mode', 'dept', 'fee_type', 'academic_year',
+            'semester', 'total_amount', 'is_active'
+        )
+    }
+    rows = FeeTemplateComponent.objects.order_by('id').values(
+        'template_id', 'component_id', 'component__name', 'component__amount', 'amount_override'
+    )
+    for row in rows:
+        amount = row['amount_override'] if row['amount_override'] is not None else row['component__amount']
+        templates[row['template_id']]['components'].append({
+            'component_id': row['component_id'],
+            'name': row['component__name'],
+            'amount': amount,
+        })
+    return templates
+
+
+def _build_serialized_fee_templates():
+    from .models import FeeTemplate
+    from .serializers import FeeTemplateSerializer
+
+    queryset = FeeTemplate.objects.prefetch_related('feetemplatecomponent_set__component')
+    return [dict(item) for item in FeeTemplateSerializer(queryset, many=True).data]
+
+
+def get_fee_components():
+    """All fee components as dicts with id, name and amount"""
+    return _catalog_read_through('components', _build_fee_components)
+
+
+def get_fee_templates():
+    """All fee templates keyed by id, each with its effective component amounts"""
+    return _catalog_read_through('templates', _build_fee_templates)
+
+
+def get_fee_template(template_id):
+    return get_fee_templates().get(template_id)
+
+
+def get_serialized_fee_templates():
+    """FeeTemplateSerializer output for the template list endpoint"""
+    return _catalog_read_through('templates:serialized', _build_serialized_fee_templates)
+
+
+# Student dashboard cache
+#
+# Each student's dashboard payload is cached under their user id together with
+# the generation stamps that were current when it was built. Writes that affect a
+# dashboard replace the student's generation (or the global one), so a payload
+# built concurrently with a write is never served afterwards. A hit is a single
+# get_many() round trip. The cache must be shared by every worker for a write
+# in one worker to expire the dashboards the others serve; its TIMEOUT bounds
+# how long an entry is kept.
+DASHBOARD_CACHE_ALIAS = 'dashboards'
+DASHBOARD_LOCK_TIMEOUT = 10
+DASHBOARD_WAIT_INTERVAL = 0.05
+DASHBOARD_WAIT_ATTEMPTS = 40
+DASHBOARD_GLOBAL_GENERATION_KEY = 'student_dashboard:generation'
+
+
+def get_dashboard_cache():
+    return caches[DASHBOARD_CACHE_ALIAS]
+
+
+def _dashboard_keys(user_id):
+    base = f'student_dashboard:{user_id}'
+    return base, f'{base}:generation', f'{base}:lock'
+
+
+def _read_dashboard(cache, user_id):
+    data_key, generation_key, _ = _dashboard_keys(user_id)
+    values = cache.get_many([data_key, generation_key, DASHBOARD_GLOBAL_GENERATION_KEY])
+    generations = (values.get(generation_key), values.get(DASHBOARD_GLOBAL_GENERATION_KEY))
+    payload = values.get(data_key)
+    if payload is not None and payload['generations'] == generations:
+        return payload['data'], generations
+    return None, generations
+
+
+def get_student_dashboard(user_id, builder):
+    """
+    Return the cached dashboard for a student user, building it on a miss
+
+    Concurrent misses for the same student are coalesced: one request builds the
+    payload while the others wait briefly for it to appear in the cache.
+    """
+    cache = get_dashboard_cache()
+    data_key, _, lock_key = _dashboard_keys(user_id)
+
+    data, generations = _read_dashboard(cache, user_id)
+    if data is not None:
+        return data
+
+    if cache.add(lock_key, 1, timeout=DASHBOARD_LOCK_TIMEOUT):
+        try:
+            data = builder()
+            cache.set(data_key, {'generations': generations, 'data': data})
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    # Another request is already building this dashboard
+    for _ in range(DASHBOARD_WAIT_ATTEMPTS):
+        time.sleep(DASHBOARD_WAIT_INTERVAL)
+        data, _ = _read_dashboard(cache, user_id)
+        if data is not None:
+            return data
+    return builder()
+
+
+def _expire_student_dashboards(user_ids):
+    cache = get_dashboard_cache()
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    generation = time.time_ns()
+    keys = [_dashboard_keys(user_id) for user_id in user_ids]
+    cache.set_many({generation_key: generation for _, generation_key, _ in keys}, timeout=None)
+    cache.delete_many([data_key for data_key, _, _ in keys])
+
+
+def invalidate_student_dashboards(user_ids):
+    """Expire the cached dashboards of the given student users once the transaction commits"""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: _expire_student_dashboards(user_ids))
+
+
+def invalidate_all_student_dashboards():
+    get_dashboard_cache().set(DASHBOARD_GLOBAL_GENERATION_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _upload_digest(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def request_fingerprint(request):
+    """
+    Hash of the method, path and body, to tell a retry from a different request reusing a key
+
+    Uploaded files count by their content rather than their name, so a
+    different statement uploaded under the same file name is a different
+    request.
+    """
+    data = request.data
+    if request.FILES:
+        data = {
+            'fields': {key: data.getlist(key) for key in data if key not in request.FILES},
+            'files': {key: [_upload_digest(upload) for upload in uploads] for key, uploads in request.FILES.lists()},
+        }
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.response_body), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(handler):
+    """
+    Make a POST handler safe to retry with an Idempotency-Key header
+
+    The first request with a key claims it and its response is stored for
+    IDEMPOTENCY_KEY_TTL_HOURS; retries with the same key and body get that
+    response back without running the handler, so no second Payment, Stripe
+    session or refund is created. A retry while the first request is still
+    running gets 409, and reusing a key for a different request 422. Server
+    errors release the key so the client can retry. Requests without the
+    header run as before. The handler must return a rendered HttpResponse
+    such as JsonResponse.
+    """
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > 255:
+            return JsonResponse({'error': f'{IDEMPOTENCY_HEADER} must be at most 255 characters'}, status=400)
+
+        now = timezone.now()
+        fingerprint = request_fingerprint(request)
+        IdempotencyKey.objects.filter(user=request.user, key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    request_path=request.path,
+                    fingerprint=fingerprint,
+                    expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if record is None:
+                return JsonResponse({'error': 'Request with this Idempotency-Key was interrupted. Please retry.'}, status=409)
+            if record.request_path != request.path or record.fingerprint != fingerprint:
+                return JsonResponse({
+                    'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'
+                }, status=422)
+            if record.status_code is None:
+                return JsonResponse({
+                    'error': 'A request with this Idempotency-Key is still being processed'
+                }, status=409)
+            return _replay(record)
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500 or getattr(response, 'streaming', False):
+            record.delete()
+            return response
+
+        record.status_code = response.status_code
+        record.content_type = response.get('Content-Type', '')
+        record.response_body = response.content
+        record.save(update_fields=['status_code', 'content_type', 'response_body'])
+        return response
+    return wrapper
@@ -0,0 +1,221 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Invoice, LedgerEntry, LedgerSnapshot
+from .money import to_paise, to_rupees
+
+# Debit and credit account of each kind of entry; a negative amount swaps them
+POSTINGS = {
+    'charge': ('receivable', 'fee_income'),
+    'adjustment': ('receivable', 'fee_income'),
+    'payment': ('collections', 'receivable'),
+    'refund': ('receivable', 'collections'),
+    'concession': ('concessions', 'receivable'),
+}
+MEASURES = ('billed', 'collected', 'conceded', 'balance')
+
+
+def entry(kind, invoice, amount, payment=None, memo='', user=None):
+    """Unsaved entry of `amount` paise against an invoice; a negative amount reverses the posting"""
+    debit, credit = POSTINGS[kind]
+    if amount < 0:
+        debit, credit, amount = credit, debit, -amount
+    return LedgerEntry(
+        invoice_id=invoice.pk, student_id=invoice.student_id, payment=payment, kind=kind,
+        debit_account=debit, credit_account=credit, amount=amount, memo=memo[:255], posted_by=user
+    )
+
+
+def post(kind, invoice, amount, payment=None, memo='', user=None):
+    """Post an entry of `amount` paise against an invoice; zero amounts post nothing"""
+    if not amount:
+        return None
+    posted = entry(kind, invoice, amount, payment, memo, user)
+    posted.save()
+    return posted
+
+
+def receivable_amount(kind, change):
+    """Amount of a `kind` entry changing the invoice's receivable by `change`"""
+    return change if POSTINGS[kind][0] == 'receivable' else -change
+
+
+def post_charges(invoices):
+    """
+    Post the charges of bulk-created invoices
+
+    bulk_create skips the signal that posts a new invoice's charge; the
+    entries are inserted in one statement instead.
+    """
+    LedgerEntry.objects.bulk_create(
+        entry('charge', invoice, to_paise(invoice.total_amount), memo=f"Invoice {invoice.invoice_number}")
+        for invoice in invoices if invoice.total_amount
+    )
+
+
+def post_payments(payments):
+    """
+    Post bulk-created successful payments
+
+    bulk_create skips the signals that post payments to the ledger; the
+    entries are inserted in one statement instead.
+    """
+    students = dict(
+        Invoice.objects.filter(pk__in={payment.invoice_id for payment in payments}).values_list('id', 'student_id')
+    )
+    LedgerEntry.objects.bulk_create(
+        entry('payment', Invoice(pk=payment.invoice_id, student_id=students[payment.invoice_id]),
+              to_paise(payment.amount), payment, f"Payment {payment.payment_reference}")
+        for payment in payments if payment.status == 'success' and payment.invoice_id in students
+    )
+
+
+def sync_invoice_ledger(old, new):
+    """
+    Post the charge of a new invoice, or the change of a saved invoice's total
+
+    `old` is the invoice as stored before the save (None when it was just
+    created). A total change is posted as an adjustment unless the saving
+    code tagged the invoice with `_ledger_kind` (and optionally
+    `_ledger_memo` and `_ledger_user`), as the concession endpoint does.
+    Cancelling an invoice writes its ledger balance off with an adjustment,
+    and reopening it brings the ledger balance back to the stored balance.
+    """
+    if old is None:
+        post('charge', new, to_paise(new.total_amount), memo=f"Invoice {new.invoice_number}")
+        return
+    change = to_paise(new.total_amount) - to_paise(old.total_amount)
+    if change:
+        kind = getattr(new, '_ledger_kind', 'adjustment')
+        post(kind, new, receivable_amount(kind, change),
+             memo=getattr(new, '_ledger_memo', 'Invoice total changed'), user=getattr(new, '_ledger_user', None))
+    if (old.status == 'cancelled') != (new.status == 'cancelled'):
+        cancelled = new.status == 'cancelled'
+        target = 0 if cancelled else to_paise(new.balance_amount)
+        ledger = invoice_balances([new.pk]).get(new.pk, {}).get('balance', 0)
+        post('adjustment', new, target - ledger, user=getattr(new, '_ledger_user', None),
+             memo=f"Invoice {new.invoice_number} {'cancelled' if cancelled else 'reopened'}")
+
+
+def sync_payment_ledger(old, new):
+    """
+    Post a saved payment's change in successful amount
+
+    Refunds are left to the refund endpoint, which posts the amount actually
+    refunded; any other move out of 'success' reverses the payment.
+    """
+    if new.status == 'refunded' or new.invoice_id is None:
+        return
+    was_paid = to_paise(old.amount) if old is not None and old.status == 'success' else 0
+    is_paid = to_paise(new.amount) if new.status == 'success' else 0
+    if is_paid != was_paid:
+        post('payment', new.invoice, is_paid - was_paid, payment=new,
+             memo=f"Payment {new.payment_reference}" if is_paid else f"Payment {new.payment_reference} reversed")
+
+
+def _net(account, sign=1):
+    """Sum of the amounts debited to `account` less those credited, times `sign`"""
+    return Coalesce(Sum(Case(
+        When(debit_account=account, then=F('amount') * sign),
+        When(credit_account=account, then=F('amount') * -sign),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )), Value(0))
+
+
+def _measures():
+    return {
+        'billed': _net('fee_income', -1),
+        'collected': _net('collections'),
+        'conceded': _net('concessions'),
+        'balance': _net('receivable'),
+    }
+
+
+def end_of_day(day):
+    """The last moment of a date, as the `as_of` of a balance on that date"""
+    return timezone.make_aware(datetime.combine(day, time.max))
+
+
+def invoice_balances(invoice_ids=None, as_of=None):
+    """
+    Ledger measures of invoices in paise as of a moment (default now), keyed by invoice id
+
+    Starts from the latest snapshot taken at or before `as_of` and adds the
+    entries posted after it, so the work is one read of the snapshot rows and
+    an index range scan over the entries since. Invoices without entries are
+    left out.
+    """
+    as_of = as_of or timezone.now()
+    snapshots = LedgerSnapshot.objects.all()
+    entries = LedgerEntry.objects.filter(posted_at__lte=as_of)
+    if invoice_ids is not None:
+        snapshots = snapshots.filter(invoice_id__in=invoice_ids)
+        entries = entries.filter(invoice_id__in=invoice_ids)
+
+    totals = {}
+    taken_at = LedgerSnapshot.objects.filter(taken_at__lte=as_of).aggregate(latest=Max('taken_at'))['latest']
+    if taken_at:
+        for row in snapshots.filter(taken_at=taken_at).values('invoice_id', *MEASURES):
+            totals[row.pop('invoice_id')] = row
+        entries = entries.filter(posted_at__gt=taken_at)
+    for row in entries.values('invoice_id').annotate(**_measures()).order_by():
+        measures = totals.setdefault(row['invoice_id'], dict.fromkeys(MEASURES, 0))
+        for measure in MEASURES:
+            measures[measure] += row[measure]
+    return totals
+
+
+def take_snapshot(taken_at=None):
+    """
+    Record every invoice's cumulative measures over the entries posted up to `taken_at`
+
+    Built from the previous snapshot plus the entries posted since, so a run
+    reads only the new entries. `taken_at` defaults to
+    LEDGER_SNAPSHOT_LAG_MINUTES ago, leaving transactions that posted entries
+    just before it time to commit. Snapshots beyond the newest
+    LEDGER_SNAPSHOTS_KEPT are dropped; balances as of an earlier moment are
+    summed from the entries alone. Returns the number of rows written.
+    """
+    taken_at = taken_at or timezone.now() - timedelta(minutes=settings.LEDGER_SNAPSHOT_LAG_MINUTES)
+    with transaction.atomic():
+        if LedgerSnapshot.objects.filter(taken_at__gte=taken_at).exists():
+            # A later snapshot already covers this moment
+            return 0
+        created = LedgerSnapshot.objects.bulk_create(
+            (LedgerSnapshot(invoice_id=invoice_id, taken_at=taken_at, **measures)
+             for invoice_id, measures in invoice_balances(as_of=taken_at).items()),
+            batch_size=1000
+        )
+        kept = list(
+            LedgerSnapshot.objects.order_by('-taken_at').values_list('taken_at', flat=True).distinct()
+            [:settings.LEDGER_SNAPSHOTS_KEPT]
+        )
+        if kept:
+            LedgerSnapshot.objects.filter(taken_at__lt=kept[-1]).delete()
+    return len(created)
+
+
+def as_rupees(measures):
+    """Ledger measures in paise as rupee Decimals"""
+    return {measure: to_rupees(measures[measure]) for measure in MEASURES}
+
+
+def projection_drift(invoice_ids=None):
+    """
+    Invoices whose stored balance differs from the ledger balance, as (id, stored, ledger) tuples
+
+    A cancelled invoice's balance is written off in the ledger, so it is
+    expected to be zero there.
+    """
+    balances = invoice_balances(invoice_ids)
+    invoices = Invoice.objects.all() if invoice_ids is None else Invoice.objects.filter(pk__in=invoice_ids)
+    drift = []
+    for invoice_id, stored, status in invoices.values_list('id', 'balance_amount', 'status').iterator():
+        ledger = balances.get(invoice_id, {}).get('balance', 0)
+        if (0 if status == 'cancelled' else to_paise(stored)) != ledger:
+            drift.append((invoice_id, stored, to_rupees(ledger)))
+    return drift
@@ -0,0 +1,81 @@
+import json
+import time
+import statistics
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from backend.renderers import ORJSONRenderer
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON serialization time for a synthetic invoice list payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of invoices in the payload')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per serializer')
+
+    def handle(self, *args, **options):
+        rows = self.build_rows(options['rows'])
+
+        def per_field_stdlib():
+            # What the views did before: float()/isoformat() on every field, then stdlib json
+            return json.dumps({'invoices': [{
+                'id': row['id'],
+                'student_id': row['student_id'],
+                'semester': row['semester'],
+                'total_amount': float(row['total_amount']),
+                'paid_amount': float(row['paid_amount']),
+                'balance_amount': float(row['balance_amount']),
+                'status': row['status'],
+                'due_date': row['due_date'].isoformat() if row['due_date'] else None,
+                'created_at': row['created_at'].isoformat(),
+            } for row in rows]}, cls=DjangoJSONEncoder).encode('utf-8')
+
+        def drf_json():
+            return JSONRenderer().render({'invoices': rows})
+
+        def orjson_renderer():
+            return ORJSONRenderer().render({'invoices': rows})
+
+        self.stdout.write(f"Serializing {len(rows)} invoices, {options['repeat']} runs each")
+        for name, func in [
+            ('float()/isoformat() + json', per_field_stdlib),
+            ('DRF JSONRenderer', drf_json),
+            ('ORJSONRenderer', orjson_renderer),
+        ]:
+            timings, size = self.time(func, options['repeat'])
+            self.stdout.write(
+                f"{name:<30} median {statistics.median(timings):8.2f} ms  "
+                f"min {min(timings):8.2f} ms  {size / 1024:8.1f} KiB"
+            )
+
+    def time(self, func, repeat):
+        size = len(func())
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings, size
+
+    def build_rows(self, count):
+        now = timezone.now()
+        rows = []
+        for i in range(count):
+            total = Decimal('55000.00') + i % 7 * Decimal('1250.50')
+            paid = Decimal(i % 5) * Decimal('5000.00')
+            rows.append({
+                'id': i + 1,
+                'student_id': i // 2 + 1,
+                'semester': i % 8 + 1,
+                'total_amount': total,
+                'paid_amount': paid,
+                'balance_amount': total - paid,
+                'status': 'partial' if paid else 'pending',
+                'due_date': date(2024, 7, 1) + timedelta(days=i % 180),
+                'created_at': now - timedelta(minutes=i),
+            })
+        return rows
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from datetime import datetime, timedelta
 from backend.models import StudentProfile, FeeComponent, Invoice, CustomFeeStructure
+from backend.money import to_paise, to_rupees
 
 User = get_user_model()
 
@@ -70,16 +71,12 @@ class Command(BaseCommand):
             'Exam Fee': '3000.00'
         }
         
-        custom_fees, created = CustomFeeStructure.objects.get_or_create(
-            student=student,
-            defaults={'components': components}
-        )
-        
-        if created:
+        if not CustomFeeStructure.objects.filter(student=student).exists():
+            CustomFeeStructure(student=student).set_components(components)
             self.stdout.write(f'Created custom fee structure for {student.name}')
         
         # Create invoice
-        total_amount = sum(float(amount) for amount in components.values())
+        total_amount = to_rupees(sum(to_paise(amount) for amount in components.values()))
         due_date = datetime.now().date() + timedelta(days=30)  # 30 days from now
         
         invoice, created = Invoice.objects.get_or_create(
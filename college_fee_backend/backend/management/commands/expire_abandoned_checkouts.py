@@ -0,0 +1,39 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from backend.models import Payment
+from backend.caching import invalidate_student_dashboards
+
+
+class Command(BaseCommand):
+    help = 'Expire pending checkouts whose Stripe session has lapsed (run every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=5,
+                            help='Minutes past the Stripe session lifetime before a checkout is expired')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Payments updated per transaction')
+
+    def handle(self, *args, **options):
+        lifetime = settings.STRIPE_CHECKOUT_SESSION_MINUTES + options['grace_minutes']
+        cutoff = timezone.now() - timedelta(minutes=lifetime)
+
+        # Pending payments are never counted in the collection rollup, so the
+        # status change needs no rollup correction, only fresh dashboards
+        expired = 0
+        while True:
+            rows = list(
+                Payment.objects.filter(status='pending', timestamp__lt=cutoff)
+                .order_by('timestamp', 'id')
+                .values_list('id', 'invoice__student__user_id')[:options['chunk_size']]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                expired += Payment.objects.filter(
+                    pk__in=[row[0] for row in rows], status='pending'
+                ).update(status='expired')
+            invalidate_student_dashboards({row[1] for row in rows})
+
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} checkouts started before {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from backend.models import Invoice, Notification
+from backend.caching import invalidate_student_dashboards
+from backend.rollups import tracking_invoice_cube
+
+OPEN_STATUSES = ('pending', 'partial')
+
+
+class Command(BaseCommand):
+    help = 'Mark unpaid invoices past their due date as overdue and notify the students (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Invoices updated per transaction')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+
+        # Every open invoice due before today, read through invoice_open_due_date_idx. There
+        # is no watermark: invoices created back-dated, edited or reopened by a refund after
+        # an earlier sweep must still be caught, and marked invoices leave the open set.
+        due = Invoice.objects.filter(status__in=OPEN_STATUSES, balance_amount__gt=0, due_date__lt=today)
+
+        marked = 0
+        last = None
+        while True:
+            chunk = due.order_by('due_date', 'id')
+            if last:
+                chunk = chunk.filter(due_date__gte=last[0]).exclude(due_date=last[0], id__lte=last[1])
+            rows = list(chunk.values_list(
+                'id', 'due_date', 'invoice_number', 'balance_amount', 'student__user_id'
+            )[:options['chunk_size']])
+            if not rows:
+                break
+            marked += self.mark_overdue(rows)
+            last = (rows[-1][1], rows[-1][0])
+
+        self.stdout.write(self.style.SUCCESS(f'Marked {marked} invoices overdue (due before {today})'))
+
+    def mark_overdue(self, rows):
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            with tracking_invoice_cube(ids):
+                # Re-check the status so invoices paid since they were read are left alone
+                updated_ids = list(
+                    Invoice.objects.select_for_update().filter(pk__in=ids, status__in=OPEN_STATUSES)
+                    .values_list('id', flat=True)
+                )
+                Invoice.objects.filter(pk__in=updated_ids).update(status='overdue', updated_at=timezone.now())
+
+            updated = set(updated_ids)
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=user_id,
+                    message=f"Invoice {invoice_number} is overdue. Pending amount of ₹{balance} was due on {due_date.strftime('%d-%b-%Y')}.",
+                    is_read=False
+                )
+                for invoice_id, due_date, invoice_number, balance, user_id in rows
+                if invoice_id in updated
+            ])
+            invalidate_student_dashboards({row[4] for row in rows if row[0] in updated})
+        return len(updated_ids)
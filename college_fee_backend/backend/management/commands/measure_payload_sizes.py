@@ -0,0 +1,72 @@
+import time
+import orjson
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.test import APIRequestFactory, force_authenticate
+from backend.models import User, StudentProfile
+from backend.middleware import brotli, compress_bytes
+from backend.renderers import MessagePackRenderer, msgpack
+from backend.views import (
+    AdminReportsView, AdminStudentsView, AdminInvoicesView, AdminPaymentsView, StudentCompleteFeeDataView
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure raw, gzip, brotli and MessagePack sizes of the large API responses on the current database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usn', help='Student for the complete fee data endpoint (default: the one with most invoices)')
+
+    def handle(self, *args, **options):
+        admin = User.objects.filter(is_superuser=True).first()
+        if not admin:
+            raise CommandError('An admin user is required to call the admin endpoints')
+
+        usn = options['usn'] or (
+            StudentProfile.objects.exclude(usn__isnull=True).exclude(usn='')
+            .annotate(invoice_count=Count('invoice')).order_by('-invoice_count')
+            .values_list('usn', flat=True).first()
+        )
+
+        endpoints = [
+            ('reports/outstanding/', AdminReportsView, {}),
+            ('students/', AdminStudentsView, {}),
+            ('invoices/', AdminInvoicesView, {}),
+            ('payments/', AdminPaymentsView, {}),
+        ]
+        if usn:
+            endpoints.append((f'api/student/complete-fee-data/{usn}/', StudentCompleteFeeDataView, {'usn': usn}))
+
+        encodings = ['gzip'] + (['br'] if brotli is not None else [])
+        header = f"{'endpoint':<48} {'json':>10}" + ''.join(f" {name:>18}" for name in encodings) + f" {'msgpack':>10}"
+        self.stdout.write(header)
+
+        factory = APIRequestFactory()
+        for path, view_class, kwargs in endpoints:
+            request = factory.get('/' + path)
+            force_authenticate(request, user=admin)
+            response = view_class.as_view()(request, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            content = response.content
+
+            line = f"{path:<48} {self.format_size(len(content)):>10}"
+            for encoding in encodings:
+                start = time.perf_counter()
+                compressed = compress_bytes(content, encoding)
+                elapsed = (time.perf_counter() - start) * 1000
+                line += f" {self.format_size(len(compressed)):>9} {elapsed:6.1f} ms"
+
+            if msgpack is not None:
+                packed = MessagePackRenderer().render(orjson.loads(content))
+                line += f" {self.format_size(len(packed)):>10}"
+            else:
+                line += f" {'n/a':>10}"
+            self.stdout.write(line)
+
+    def format_size(self, size):
+        if size >= 1024 * 1024:
+            return f'{size / 1024 / 1024:.1f} MiB'
+        if size >= 1024:
+            return f'{size / 1024:.1f} KiB'
+        return f'{size} B'
@@ -0,0 +1,21 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from backend.rollups import rebuild_component_collections
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the component collections rollup from the allocations of successful payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day to rebuild (YYYY-MM-DD), default: all history')
+        parser.add_argument('--to', dest='end', help='Last day to rebuild (YYYY-MM-DD), default: today')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else None
+            end = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+
+        rows = rebuild_component_collections(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt component collections rollup: {rows} rows'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from backend.rollups import rebuild_invoice_cube
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the invoice aggregate cube from the invoices table'
+
+    def handle(self, *args, **options):
+        cells = rebuild_invoice_cube()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt invoice cube: {cells} cells'))
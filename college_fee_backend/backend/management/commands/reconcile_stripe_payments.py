@@ -0,0 +1,105 @@
+from datetime import datetime, time, timedelta
+from itertools import islice
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from backend.models import Payment, JobCheckpoint
+from backend.reports import parse_date
+from backend.settlement import SETTLEABLE_STATUSES
+from backend.stripe_service import iter_checkout_sessions
+from backend.views import StripeWebhookView
+
+CHECKPOINT = 'reconcile_stripe_payments'
+
+
+class Command(BaseCommand):
+    help = 'Settle or expire Stripe payments whose webhook was lost, by comparing checkout sessions with local payments (run hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='Reconcile sessions created from this date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Reconcile sessions created before the end of this date (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Sessions compared per database query')
+        parser.add_argument('--dry-run', action='store_true', help='Report discrepancies without fixing them')
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT)
+        try:
+            start = options['start'] and parse_date(options['start'], '--from')
+            end = options['end'] and parse_date(options['end'], '--to')
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if start:
+            created_from = timezone.make_aware(datetime.combine(start, time.min))
+        elif checkpoint.watermark:
+            # Sessions still open at the last run may have completed or expired since
+            created_from = checkpoint.watermark - timedelta(minutes=settings.STRIPE_CHECKOUT_SESSION_MINUTES + 5)
+        else:
+            created_from = started - timedelta(days=1)
+        created_to = (
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+            if end else None
+        )
+
+        webhook = StripeWebhookView()
+        counts = dict.fromkeys(('sessions', 'settled', 'failed', 'expired', 'missing', 'mismatched'), 0)
+        try:
+            sessions = iter_checkout_sessions(created_from, created_to)
+            while True:
+                batch = list(islice(sessions, options['batch_size']))
+                if not batch:
+                    break
+                counts['sessions'] += len(batch)
+                self.reconcile(batch, webhook, counts, options['dry_run'])
+        except Exception as e:
+            # A later page can fail too; report what was reconciled and leave the watermark for the next run
+            self.stdout.write(self.summary(counts, created_from, options['dry_run']))
+            raise CommandError(f"Stopped after {counts['sessions']} sessions: {e}")
+
+        if not options['dry_run'] and not start and not end:
+            checkpoint.watermark = started
+            checkpoint.save()
+        self.stdout.write(self.style.SUCCESS(self.summary(counts, created_from, options['dry_run'])))
+
+    def summary(self, counts, created_from, dry_run):
+        return (
+            f"Compared {counts['sessions']} sessions created since {created_from:%Y-%m-%d %H:%M}: "
+            f"{counts['settled']} settled, {counts['failed']} failed to settle, {counts['expired']} expired, "
+            f"{counts['missing']} without a local payment, {counts['mismatched']} with conflicting statuses"
+            + (' (dry run)' if dry_run else '')
+        )
+
+    def reconcile(self, sessions, webhook, counts, dry_run):
+        # Local statuses of the whole batch in one query; a cart session has one payment per invoice
+        statuses = {}
+        for transaction_id, status in Payment.objects.filter(
+            transaction_id__in=[session['id'] for session in sessions]
+        ).values_list('transaction_id', 'status'):
+            statuses.setdefault(transaction_id, set()).add(status)
+
+        for session in sessions:
+            local = statuses.get(session['id'])
+            paid = session['status'] == 'complete' and session['payment_status'] == 'paid'
+            if local is None:
+                if paid:
+                    counts['missing'] += 1
+                    self.stderr.write(f"Paid session {session['id']} has no local payment")
+                continue
+            if paid and local & set(SETTLEABLE_STATUSES):
+                # Includes payments the checkout reaper expired before the lost webhook
+                if dry_run or webhook.handle_checkout_session_completed(session):
+                    counts['settled'] += 1
+                else:
+                    counts['failed'] += 1
+                    self.stderr.write(f"Paid session {session['id']} was not settled")
+            elif session['status'] == 'expired' and 'pending' in local:
+                counts['expired'] += 1
+                if not dry_run:
+                    webhook.handle_checkout_session_expired(session)
+            elif paid != bool(local & {'success', 'refunded'}):
+                counts['mismatched'] += 1
+                self.stderr.write(
+                    f"Session {session['id']} is {session['status']}/{session['payment_status']} in Stripe "
+                    f"but {', '.join(sorted(local))} locally"
+                )
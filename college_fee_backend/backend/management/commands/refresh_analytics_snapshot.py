@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from backend.analytics import build_snapshot, get_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the columnar analytics snapshot of students, invoices and payments (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=0,
+            help='Only rebuild when the current snapshot is older than this many minutes'
+        )
+
+    def handle(self, *args, **options):
+        current = get_snapshot()
+        if current and options['max_age']:
+            age = timezone.now() - parse_datetime(current.created_at)
+            if age < timedelta(minutes=options['max_age']):
+                self.stdout.write(f'Snapshot {current.name} is {int(age.total_seconds() // 60)} minutes old, nothing to do')
+                return
+
+        start = time.perf_counter()
+        name, meta = build_snapshot()
+        rows = ', '.join(f"{table}: {info['rows']}" for table, info in meta['tables'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Built analytics snapshot {name} in {time.perf_counter() - start:.2f}s ({rows})'
+        ))
@@ -0,0 +1,36 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from backend.rollover import ROLLOVER_CHUNK_SIZE, TERMS, rollover_students
+
+
+class Command(BaseCommand):
+    help = 'Promote active students into the next term and issue its invoices (resumable; safe to rerun)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('academic_year', help='Academic year of the term, e.g. 2025-26')
+        parser.add_argument('term', choices=TERMS, help='The term students move into')
+        parser.add_argument('--due-date', help='Due date of the new invoices (YYYY-MM-DD), default: ROLLOVER_DUE_DAYS from today')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be done without writing anything')
+        parser.add_argument('--force', action='store_true', help='Run again although this rollover already completed')
+        parser.add_argument('--chunk-size', type=int, default=ROLLOVER_CHUNK_SIZE, help='Students promoted per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            due_date = datetime.strptime(options['due_date'], '%Y-%m-%d').date() if options['due_date'] else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+
+        summary = rollover_students(
+            options['academic_year'], options['term'], due_date, options['dry_run'], options['force'], options['chunk_size']
+        )
+        if summary['already_completed']:
+            self.stdout.write(f"Rollover into {options['academic_year']} {options['term']} already completed at "
+                              f"{summary['completed_at']}; use --force to run it again")
+            return
+        skipped = ', '.join(f'{count} {reason}' for reason, count in summary['skipped'].items() if count) or 'none'
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would promote' if options['dry_run'] else 'Promoted'} {summary['promoted']} students and issue "
+            f"{summary['invoices_created']} invoices totalling ₹{summary['amount']} "
+            f"({summary['assignments_created']} new assignments, {summary['already_invoiced']} already invoiced, "
+            f"{summary['without_template']} without a template); skipped: {skipped}"
+        ))
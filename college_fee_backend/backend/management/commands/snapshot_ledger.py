@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from backend.ledger import projection_drift, take_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the cumulative fee ledger of every invoice (run periodically, e.g. nightly from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Also list invoices whose stored balance differs from the ledger balance'
+        )
+
+    def handle(self, *args, **options):
+        rows = take_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'Ledger snapshot taken: {rows} invoices'))
+        if options['check']:
+            drift = projection_drift()
+            for invoice_id, stored, ledger in drift:
+                self.stdout.write(self.style.WARNING(f'Invoice {invoice_id}: stored balance {stored}, ledger {ledger}'))
+            self.stdout.write(f'{len(drift)} invoices differ from the ledger')
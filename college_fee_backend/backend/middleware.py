@@ -0,0 +1,114 @@
+import re
+import zlib
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/json',
+    'application/msgpack',
+    'application/javascript',
+    'text/',
+)
+
+_accept_encoding_re = re.compile(r'\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*', re.IGNORECASE)
+
+
+def choose_encoding(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or None"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        match = _accept_encoding_re.fullmatch(part)
+        if not match:
+            continue
+        try:
+            quality = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+        accepted[match.group(1).lower()] = quality
+
+    def quality_of(encoding):
+        return accepted.get(encoding, accepted.get('*', 0))
+
+    if brotli is not None and quality_of('br') > 0 and quality_of('br') >= quality_of('gzip'):
+        return 'br'
+    if quality_of('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def _gzip_compressor():
+    return zlib.compressobj(settings.RESPONSE_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress_bytes(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+    compressor = _gzip_compressor()
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of byte chunks, flushing after each so bytes keep flowing"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = _gzip_compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli or gzip, negotiated from Accept-Encoding
+
+    Regular responses are only compressed above RESPONSE_COMPRESSION_MIN_SIZE
+    bytes; streaming responses are always compressed chunk by chunk.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if getattr(response, 'is_async', False):
+                return response
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress_bytes(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(response.content))
+
+        # The body changed, so a strong ETag no longer matches it byte for byte
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        response['Content-Encoding'] = encoding
+        return response
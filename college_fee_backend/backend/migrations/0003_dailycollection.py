@@ -0,0 +1,53 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:17
+
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def build_daily_collections(apps, schema_editor):
+    Payment = apps.get_model('backend', 'Payment')
+    DailyCollection = apps.get_model('backend', 'DailyCollection')
+    totals = Payment.objects.filter(status='success', invoice__isnull=False).values(
+        'mode',
+        day=TruncDate('timestamp'),
+        dept=F('invoice__student__dept'),
+        term=Coalesce('invoice__semester', Value(0), output_field=IntegerField()),
+    ).annotate(total=Sum('amount'), count=Count('id')).order_by()
+    DailyCollection.objects.bulk_create(
+        DailyCollection(
+            date=row['day'], mode=row['mode'], dept=row['dept'], semester=row['term'],
+            amount=row['total'], payment_count=row['count'],
+        )
+        for row in totals.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_studentprofile_batch_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('mode', models.CharField(choices=[('stripe', 'Stripe'), ('cash', 'Cash'), ('dd', 'DD'), ('neft', 'NEFT')], max_length=10)),
+                ('dept', models.CharField(max_length=100)),
+                ('semester', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payment_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailycollection',
+            constraint=models.UniqueConstraint(fields=('date', 'mode', 'dept', 'semester'), name='unique_daily_collection'),
+        ),
+        migrations.RunPython(build_daily_collections, migrations.RunPython.noop),
+    ]
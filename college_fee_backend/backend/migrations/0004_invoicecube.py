@@ -0,0 +1,60 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:19
+
+from django.db import migrations, models
+from django.db.models import CharField, Count, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def build_invoice_cube(apps, schema_editor):
+    Invoice = apps.get_model('backend', 'Invoice')
+    InvoiceCube = apps.get_model('backend', 'InvoiceCube')
+    cells = Invoice.objects.values(
+        cube_dept=F('student__dept'),
+        cube_semester=F('student__semester'),
+        cube_batch=Coalesce('student__batch', Value(''), output_field=CharField()),
+        cube_admission_mode=Coalesce('student__admission_mode', Value(''), output_field=CharField()),
+        cube_academic_year=F('academic_year'),
+        cube_invoice_semester=Coalesce('semester', Value(0), output_field=IntegerField()),
+        cube_status=F('status'),
+    ).annotate(
+        cube_invoice_count=Count('id'),
+        cube_total_amount=Sum('total_amount'),
+        cube_paid_amount=Sum('paid_amount'),
+        cube_balance_amount=Sum('balance_amount'),
+    ).order_by()
+    InvoiceCube.objects.bulk_create(
+        InvoiceCube(**{name[len('cube_'):]: value for name, value in row.items()})
+        for row in cells.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_dailycollection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceCube',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dept', models.CharField(max_length=100)),
+                ('semester', models.IntegerField()),
+                ('batch', models.CharField(blank=True, default='', max_length=50)),
+                ('admission_mode', models.CharField(blank=True, default='', max_length=20)),
+                ('academic_year', models.CharField(max_length=20)),
+                ('invoice_semester', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('partial', 'Partial'), ('paid', 'Paid'), ('overdue', 'Overdue'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('balance_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='invoicecube',
+            constraint=models.UniqueConstraint(fields=('dept', 'semester', 'status', 'academic_year', 'invoice_semester', 'batch', 'admission_mode'), name='unique_invoice_cube_cell'),
+        ),
+        migrations.RunPython(build_invoice_cube, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_invoicecube'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('balance_amount__gt', 0)), fields=['due_date'], name='invoice_open_due_date_idx'),
+        ),
+    ]
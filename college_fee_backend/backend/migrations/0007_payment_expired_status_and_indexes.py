@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_jobcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('success', 'Success'), ('failed', 'Failed'), ('pending', 'Pending'), ('expired', 'Expired'), ('refunded', 'Refunded')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['invoice', 'status', 'timestamp'], name='payment_invoice_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['timestamp'], name='payment_pending_time_idx'),
+        ),
+    ]
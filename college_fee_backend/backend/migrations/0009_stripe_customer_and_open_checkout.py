@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_url',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='studentprofile',
+            name='stripe_customer_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def _opening_entry(LedgerEntry, invoice, kind, debit, credit, amount, posted_at, memo, payment=None):
+    if amount < 0:
+        debit, credit, amount = credit, debit, -amount
+    return LedgerEntry(
+        invoice_id=invoice.id, student_id=invoice.student_id, payment=payment, kind=kind,
+        debit_account=debit, credit_account=credit, amount=amount, memo=memo, posted_at=posted_at
+    )
+
+
+def backfill_ledger(apps, schema_editor):
+    # Opening entries from the current tables: each invoice's charge, its
+    # successful and refunded payments, and an adjustment for whatever of the
+    # stored balance those do not explain (manual edits, partial refunds)
+    Invoice = apps.get_model('backend', 'Invoice')
+    Payment = apps.get_model('backend', 'Payment')
+    LedgerEntry = apps.get_model('backend', 'LedgerEntry')
+    payments = {}
+    for payment in Payment.objects.filter(status__in=['success', 'refunded']).order_by('id').iterator():
+        payments.setdefault(payment.invoice_id, []).append(payment)
+
+    entries = []
+    for invoice in Invoice.objects.order_by('id').iterator():
+        entries.append(_opening_entry(
+            LedgerEntry, invoice, 'charge', 'receivable', 'fee_income', invoice.total_amount, invoice.created_at,
+            f"Invoice {invoice.invoice_number}"
+        ))
+        balance = invoice.total_amount
+        for payment in payments.get(invoice.id, []):
+            entries.append(_opening_entry(
+                LedgerEntry, invoice, 'payment', 'collections', 'receivable', payment.amount, payment.timestamp,
+                f"Payment {payment.payment_reference}", payment
+            ))
+            if payment.status == 'refunded':
+                entries.append(_opening_entry(
+                    LedgerEntry, invoice, 'refund', 'receivable', 'collections', payment.amount, payment.timestamp,
+                    f"Payment {payment.payment_reference} refunded", payment
+                ))
+            else:
+                balance -= payment.amount
+        entries.append(_opening_entry(
+            LedgerEntry, invoice, 'adjustment', 'receivable', 'fee_income', invoice.balance_amount - balance,
+            invoice.updated_at, 'Opening balance correction'
+        ))
+        if len(entries) >= 1000:
+            LedgerEntry.objects.bulk_create([entry for entry in entries if entry.amount])
+            entries = []
+    LedgerEntry.objects.bulk_create([entry for entry in entries if entry.amount])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_studentinvite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('billed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('collected', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('conceded', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_snapshots', to='backend.invoice')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('charge', 'Charge'), ('payment', 'Payment'), ('refund', 'Refund'), ('adjustment', 'Adjustment'), ('concession', 'Concession')], max_length=12)),
+                ('debit_account', models.CharField(choices=[('receivable', 'Student receivable'), ('fee_income', 'Fee income'), ('collections', 'Collections'), ('concessions', 'Concessions')], max_length=12)),
+                ('credit_account', models.CharField(choices=[('receivable', 'Student receivable'), ('fee_income', 'Fee income'), ('collections', 'Collections'), ('concessions', 'Concessions')], max_length=12)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('memo', models.CharField(blank=True, max_length=255)),
+                ('posted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='backend.invoice')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='backend.payment')),
+                ('posted_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='backend.studentprofile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ledgersnapshot',
+            constraint=models.UniqueConstraint(fields=('taken_at', 'invoice'), name='unique_ledger_snapshot'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['posted_at'], name='ledger_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['invoice', 'posted_at'], name='ledger_invoice_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['student', 'posted_at'], name='ledger_student_posted_idx'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:45
+
+import backend.money
+from django.db import migrations
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+def clear_snapshots(apps, schema_editor):
+    # Snapshots are derived; the next snapshot_ledger run rebuilds them in paise
+    apps.get_model('backend', 'LedgerSnapshot').objects.all().delete()
+
+
+def entry_amounts_to_paise(apps, schema_editor):
+    LedgerEntry = apps.get_model('backend', 'LedgerEntry')
+    LedgerEntry.objects.update(amount_paise=Round(F('amount') * 100))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_fee_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_snapshots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ledgersnapshot',
+            name='balance',
+            field=backend.money.PaiseField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ledgersnapshot',
+            name='billed',
+            field=backend.money.PaiseField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ledgersnapshot',
+            name='collected',
+            field=backend.money.PaiseField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ledgersnapshot',
+            name='conceded',
+            field=backend.money.PaiseField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='amount_paise',
+            field=backend.money.PaiseField(default=0),
+        ),
+        migrations.RunPython(entry_amounts_to_paise, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='ledgerentry',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='ledgerentry',
+            old_name='amount_paise',
+            new_name='amount',
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='amount',
+            field=backend.money.PaiseField(),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:49
+
+from decimal import InvalidOperation
+import backend.money
+from backend.money import to_paise, to_rupees
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _paise_amounts(mapping):
+    # Entries whose amount is not a number are dropped rather than failing the migration
+    amounts = {}
+    for key, amount in (mapping or {}).items():
+        try:
+            amounts[key] = to_paise(amount)
+        except (InvalidOperation, TypeError, ValueError):
+            continue
+    return amounts
+
+
+def split_fee_json(apps, schema_editor):
+    # Rows from the JSON of every custom fee structure and assignment override,
+    # and the JSON rewritten as their mirror
+    CustomFeeStructure = apps.get_model('backend', 'CustomFeeStructure')
+    CustomFeeComponent = apps.get_model('backend', 'CustomFeeComponent')
+    FeeAssignment = apps.get_model('backend', 'FeeAssignment')
+    FeeAssignmentOverride = apps.get_model('backend', 'FeeAssignmentOverride')
+    FeeComponent = apps.get_model('backend', 'FeeComponent')
+
+    rows = []
+    for structure in CustomFeeStructure.objects.order_by('id').iterator():
+        amounts = {name[:100]: amount for name, amount in _paise_amounts(structure.components).items()}
+        rows.extend(
+            CustomFeeComponent(structure_id=structure.id, student_id=structure.student_id, component_name=name, amount=amount)
+            for name, amount in amounts.items()
+        )
+        structure.components = {name: float(to_rupees(amount)) for name, amount in amounts.items()}
+        structure.total_amount = to_rupees(sum(amounts.values()))
+        structure.save(update_fields=['components', 'total_amount'])
+    CustomFeeComponent.objects.bulk_create(rows, batch_size=1000)
+
+    known = set(FeeComponent.objects.values_list('id', flat=True))
+    rows = []
+    for assignment in FeeAssignment.objects.order_by('id').iterator():
+        if not assignment.overrides:
+            continue
+        amounts = {
+            int(component_id): amount for component_id, amount in _paise_amounts(assignment.overrides).items()
+            if str(component_id).isdigit() and int(component_id) in known
+        }
+        rows.extend(
+            FeeAssignmentOverride(assignment_id=assignment.id, component_id=component_id, amount=amount)
+            for component_id, amount in amounts.items()
+        )
+        assignment.overrides = {str(component_id): float(to_rupees(amount)) for component_id, amount in amounts.items()}
+        assignment.save(update_fields=['overrides'])
+    FeeAssignmentOverride.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_ledger_amounts_in_paise'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customfeestructure',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='CustomFeeComponent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('component_name', models.CharField(max_length=100)),
+                ('amount', backend.money.PaiseField()),
+                ('structure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='component_rows', to='backend.customfeestructure')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custom_fee_components', to='backend.studentprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeeAssignmentOverride',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', backend.money.PaiseField()),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='override_rows', to='backend.feeassignment')),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignment_overrides', to='backend.feecomponent')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['component', 'id'], name='fee_override_component_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feeassignmentoverride',
+            constraint=models.UniqueConstraint(fields=('assignment', 'component'), name='unique_fee_assignment_override'),
+        ),
+        migrations.AddIndex(
+            model_name='customfeecomponent',
+            index=models.Index(fields=['component_name', 'id'], name='custom_fee_component_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='customfeecomponent',
+            constraint=models.UniqueConstraint(fields=('structure', 'component_name'), name='unique_custom_fee_component'),
+        ),
+        migrations.RunPython(split_fee_json, migrations.RunPython.noop),
+    ]
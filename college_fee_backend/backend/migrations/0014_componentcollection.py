@@ -0,0 +1,55 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:51
+
+import backend.money
+from backend.money import to_paise
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def build_component_collections(apps, schema_editor):
+    PaymentComponent = apps.get_model('backend', 'PaymentComponent')
+    ComponentCollection = apps.get_model('backend', 'ComponentCollection')
+    totals = PaymentComponent.objects.filter(payment__status='success', payment__invoice__isnull=False).values(
+        mode=F('payment__mode'),
+        day=TruncDate('payment__timestamp'),
+        dept=F('payment__invoice__student__dept'),
+        component=F('invoice_component__component_name'),
+    ).annotate(total=Sum('amount_allocated'), count=Count('id')).order_by()
+    ComponentCollection.objects.bulk_create(
+        ComponentCollection(
+            date=row['day'], mode=row['mode'], dept=row['dept'], component_name=row['component'],
+            amount=to_paise(row['total']), allocation_count=row['count'],
+        )
+        for row in totals.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_normalized_fee_components'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComponentCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('mode', models.CharField(choices=[('stripe', 'Stripe'), ('cash', 'Cash'), ('dd', 'DD'), ('neft', 'NEFT')], max_length=10)),
+                ('dept', models.CharField(max_length=100)),
+                ('component_name', models.CharField(max_length=100)),
+                ('amount', backend.money.PaiseField(default=0)),
+                ('allocation_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='componentcollection',
+            constraint=models.UniqueConstraint(fields=('date', 'mode', 'dept', 'component_name'), name='unique_component_collection'),
+        ),
+        migrations.RunPython(build_component_collections, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_componentcollection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='refunded_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_payment_refunded_amount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='invoice',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='backend.invoice'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='backend.studentprofile'),
+        ),
+        migrations.AlterField(
+            model_name='ledgersnapshot',
+            name='invoice',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_snapshots', to='backend.invoice'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_protect_ledger_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobcheckpoint',
+            name='position',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
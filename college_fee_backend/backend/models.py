@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from .money import PaiseField, to_paise, to_rupees
 
 class UserManager(BaseUserManager):
         def create_user(self, email, password=None, **extra_fields):
@@ -81,6 +83,7 @@ class StudentProfile(models.Model):
          is_active = models.BooleanField(default=True)
          admission_mode = models.CharField(max_length=20, choices=ADMISSION_MODE_CHOICES, default='kcet')
          status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+         stripe_customer_id = models.CharField(max_length=255, blank=True, null=True)  # Reused for every checkout
 
          def __str__(self):
              return self.name
@@ -140,7 +143,7 @@ class FeeAssignment(models.Model):
     template = models.ForeignKey(FeeTemplate, on_delete=models.CASCADE)
     assignment_type = models.CharField(max_length=20, choices=ASSIGNMENT_TYPE_CHOICES, default='individual')
     academic_year = models.CharField(max_length=20, default='2024-25')
-    overrides = models.JSONField(default=dict)
+    overrides = models.JSONField(default=dict)  # Mirror of the override rows, {component id: amount}
     assigned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     assigned_at = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
@@ -151,6 +154,37 @@ class FeeAssignment(models.Model):
     def __str__(self):
         return f"{self.student.name} - {self.template.name} ({self.academic_year})"
 
+    def set_overrides(self, overrides):
+        """
+        Replace the component overrides with a {component id: rupee amount} mapping
+
+        The rows in FeeAssignmentOverride are the record; `overrides` is kept
+        as their JSON mirror for API responses. Ids of components that do not
+        exist are dropped.
+        """
+        amounts = {}
+        for component_id, amount in (overrides or {}).items():
+            if str(component_id).isdigit():
+                amounts[int(component_id)] = to_paise(amount)
+        known = set(FeeComponent.objects.filter(pk__in=amounts).values_list('pk', flat=True))
+        rows = [
+            FeeAssignmentOverride(assignment=self, component_id=component_id, amount=amount)
+            for component_id, amount in amounts.items() if component_id in known
+        ]
+        with transaction.atomic():
+            self.overrides = {str(row.component_id): float(to_rupees(row.amount)) for row in rows}
+            self.save()
+            self.override_rows.all().delete()
+            FeeAssignmentOverride.objects.bulk_create(rows)
+
+    def refresh_overrides(self):
+        """Re-derive `overrides` after the override rows were edited directly"""
+        self.overrides = {
+            str(component_id): float(to_rupees(amount))
+            for component_id, amount in self.override_rows.order_by('id').values_list('component_id', 'amount')
+        }
+        self.save(update_fields=['overrides'])
+
 class Invoice(models.Model):
     INVOICE_TYPE_CHOICES = (
         ('annual', 'Annual Fee'),
@@ -180,16 +214,39 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # JobCheckpoint row locked while invoices are numbered
+    NUMBER_LOCK = 'invoice_number'
+
+    @classmethod
+    def reserve_numbers(cls, count=1):
+        """
+        The next `count` invoice numbers; call inside the transaction that creates the invoices
+
+        The NUMBER_LOCK row is locked until that transaction ends, so concurrent
+        transactions numbering invoices wait for each other instead of reading
+        the same last number.
+        """
+        JobCheckpoint.objects.get_or_create(name=cls.NUMBER_LOCK)
+        JobCheckpoint.objects.select_for_update().filter(name=cls.NUMBER_LOCK).first()
+        last_number = cls.objects.filter(invoice_number__isnull=False).order_by('-id').values_list(
+            'invoice_number', flat=True
+        ).first()
+        last_num = int(last_number.replace('INV', '')) if last_number else 0
+        return [f"INV{number:06d}" for number in range(last_num + 1, last_num + count + 1)]
+
     def save(self, *args, **kwargs):
-        if not self.invoice_number:
-            # Generate invoice number if not provided
-            last_invoice = Invoice.objects.order_by('-id').first()
-            if last_invoice:
-                last_num = int(last_invoice.invoice_number.replace('INV', '')) if last_invoice.invoice_number else 0
-                self.invoice_number = f"INV{(last_num + 1):06d}"
-            else:
-                self.invoice_number = "INV000001"
-        super().save(*args, **kwargs)
+        if self.invoice_number:
+            return super().save(*args, **kwargs)
+        # Generate invoice number if not provided
+        with transaction.atomic():
+            self.invoice_number = Invoice.reserve_numbers()[0]
+            super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # Open invoices by due date, for aging and overdue scans
+            models.Index(fields=['due_date'], name='invoice_open_due_date_idx', condition=Q(balance_amount__gt=0)),
+        ]
 
 class InvoiceComponent(models.Model):
     """Track individual fee component payments within an invoice"""
@@ -218,6 +275,8 @@ class Payment(models.Model):
              ('success', 'Success'),
              ('failed', 'Failed'),
              ('pending', 'Pending'),
+             ('expired', 'Expired'),
+             ('refunded', 'Refunded'),
          )
 
          invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
@@ -227,17 +286,50 @@ class Payment(models.Model):
          status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
          timestamp = models.DateTimeField(auto_now_add=True)
          payment_reference = models.CharField(max_length=50, unique=True, null=True, blank=True)
+         # Refunded so far; the payment stays 'success' until all of it is refunded
+         refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+         # Open Stripe checkout, returned again to repeat clicks on Pay until it expires
+         checkout_url = models.TextField(blank=True, null=True)
+         checkout_expires_at = models.DateTimeField(blank=True, null=True)
+
+         # JobCheckpoint row whose position is the last PAY number handed out
+         REFERENCE_SEQUENCE = 'payment_reference'
+
+         @classmethod
+         def reserve_references(cls, count=1):
+             """
+             The next `count` payment references; call inside the transaction that creates the payments
+
+             The REFERENCE_SEQUENCE row is locked and advanced until that
+             transaction ends, so concurrent transactions never hand out the same
+             number. It starts from the highest PAY<digits> reference when missing.
+             """
+             sequence, created = JobCheckpoint.objects.get_or_create(name=cls.REFERENCE_SEQUENCE)
+             sequence = JobCheckpoint.objects.select_for_update().get(pk=sequence.pk)
+             if created or not sequence.position:
+                 numbers = cls.objects.filter(payment_reference__regex=r'^PAY[0-9]+$').values_list(
+                     'payment_reference', flat=True
+                 )
+                 sequence.position = max((int(number[3:]) for number in numbers), default=0)
+             start = sequence.position + 1
+             sequence.position += count
+             sequence.save(update_fields=['position', 'updated_at'])
+             return [f"PAY{number:06d}" for number in range(start, start + count)]
 
          def save(self, *args, **kwargs):
-             if not self.payment_reference:
-                 # Generate payment reference if not provided
-                 last_payment = Payment.objects.order_by('-id').first()
-                 if last_payment:
-                     last_num = int(last_payment.payment_reference.replace('PAY', '')) if last_payment.payment_reference else 0
-                     self.payment_reference = f"PAY{(last_num + 1):06d}"
-                 else:
-                     self.payment_reference = "PAY000001"
-             super().save(*args, **kwargs)
+             if self.payment_reference:
+                 return super().save(*args, **kwargs)
+             # Generate payment reference if not provided
+             with transaction.atomic():
+                 self.payment_reference = Payment.reserve_references()[0]
+                 super().save(*args, **kwargs)
+
+         class Meta:
+             indexes = [
+                 # Checkout attempts of an invoice, and abandoned checkouts for the reaper
+                 models.Index(fields=['invoice', 'status', 'timestamp'], name='payment_invoice_status_idx'),
+                 models.Index(fields=['timestamp'], name='payment_pending_time_idx', condition=Q(status='pending')),
+             ]
 
 class PaymentComponent(models.Model):
     """Track which components a payment covers"""
@@ -259,20 +351,39 @@ class Notification(models.Model):
 
 class CustomFeeStructure(models.Model):
     student = models.OneToOneField(StudentProfile, on_delete=models.CASCADE)
-    components = models.JSONField(default=dict)  # Store fee breakdown as JSON
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    components = models.JSONField(default=dict)  # Mirror of the component rows, {name: amount}
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Custom fees for {self.student.name}"
 
-    def save(self, *args, **kwargs):
-        # Auto-calculate total from components
-        if self.components:
-            total = sum(float(amount) for amount in self.components.values())
-            self.total_amount = total
-        super().save(*args, **kwargs)
+    def set_components(self, components):
+        """
+        Replace the fee breakdown with a {component name: rupee amount} mapping
+
+        The rows in CustomFeeComponent are the record; `components` and
+        `total_amount` are derived from them on write, so reads never re-sum.
+        """
+        rows = [
+            CustomFeeComponent(structure=self, student_id=self.student_id, component_name=name, amount=to_paise(amount))
+            for name, amount in components.items()
+        ]
+        with transaction.atomic():
+            self._mirror(rows)
+            self.save()
+            self.component_rows.all().delete()
+            CustomFeeComponent.objects.bulk_create(rows)
+
+    def refresh_components(self):
+        """Re-derive `components` and `total_amount` after the component rows were edited directly"""
+        self._mirror(self.component_rows.order_by('id'))
+        self.save(update_fields=['components', 'total_amount', 'updated_at'])
+
+    def _mirror(self, rows):
+        self.components = {row.component_name: float(to_rupees(row.amount)) for row in rows}
+        self.total_amount = to_rupees(sum(row.amount for row in rows))
 
 class Receipt(models.Model):
     payment = models.OneToOneField(Payment, on_delete=models.CASCADE)
@@ -284,4 +395,207 @@ class Receipt(models.Model):
         return f"Receipt {self.receipt_number} for {self.payment.amount}"
     
     class Meta:
-        ordering = ['-generated_at']
\ No newline at end of file
+        ordering = ['-generated_at']
+class DailyCollection(models.Model):
+    """Successful payments summed per day, payment mode, department and invoice semester"""
+    date = models.DateField()
+    mode = models.CharField(max_length=10, choices=Payment.MODE_CHOICES)
+    dept = models.CharField(max_length=100)
+    semester = models.IntegerField(default=0)  # 0 for invoices without a semester (annual fees)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payment_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.mode} {self.dept} sem {self.semester}: {self.amount}"
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'mode', 'dept', 'semester'], name='unique_daily_collection'),
+        ]
+
+class ComponentCollection(models.Model):
+    """Component allocations of successful payments summed, in paise, per day, payment mode, department and component"""
+    date = models.DateField()
+    mode = models.CharField(max_length=10, choices=Payment.MODE_CHOICES)
+    dept = models.CharField(max_length=100)
+    component_name = models.CharField(max_length=100)
+    amount = PaiseField(default=0)
+    allocation_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.mode} {self.dept} {self.component_name}: {self.amount}"
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'mode', 'dept', 'component_name'], name='unique_component_collection'),
+        ]
+
+class InvoiceCube(models.Model):
+    """Invoice totals per student dimension, academic year, invoice semester and status"""
+    dept = models.CharField(max_length=100)
+    semester = models.IntegerField()  # The student's current semester
+    batch = models.CharField(max_length=50, blank=True, default='')
+    admission_mode = models.CharField(max_length=20, blank=True, default='')
+    academic_year = models.CharField(max_length=20)
+    invoice_semester = models.IntegerField(default=0)  # 0 for invoices without a semester (annual fees)
+    status = models.CharField(max_length=10, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    balance_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.dept} sem {self.semester} {self.academic_year} {self.status}: {self.invoice_count} invoices"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dept', 'semester', 'status', 'academic_year', 'invoice_semester', 'batch', 'admission_mode'],
+                name='unique_invoice_cube_cell',
+            ),
+        ]
+
+class JobCheckpoint(models.Model):
+    """Progress marker of a recurring job, so reruns only pick up new rows"""
+    name = models.CharField(max_length=100, unique=True)
+    watermark = models.DateTimeField(null=True, blank=True)
+    position = models.BigIntegerField(default=0)  # Last number handed out, for sequence rows
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.watermark}"
+
+class IdempotencyKey(models.Model):
+    """Stored response of a request sent with an Idempotency-Key header, replayed on retries"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_path = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Null until the original request has finished
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    response_body = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.request_path})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+class StudentInvite(models.Model):
+    """One-time token letting a bulk-onboarded student set their first password"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='invite')
+    token_hash = models.CharField(max_length=64, unique=True)  # sha256 of the token sent to the student
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    accepted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Invite for {self.user.email}"
+
+class LedgerEntry(models.Model):
+    """
+    Append-only double-entry posting against an invoice
+
+    Every charge, payment, refund, adjustment and concession is one row moving
+    `amount` from the credit account to the debit account. Rows are never
+    updated; corrections are posted as new entries.
+    """
+    KIND_CHOICES = (
+        ('charge', 'Charge'),
+        ('payment', 'Payment'),
+        ('refund', 'Refund'),
+        ('adjustment', 'Adjustment'),
+        ('concession', 'Concession'),
+    )
+    ACCOUNT_CHOICES = (
+        ('receivable', 'Student receivable'),
+        ('fee_income', 'Fee income'),
+        ('collections', 'Collections'),
+        ('concessions', 'Concessions'),
+    )
+
+    # Protected, so deleting an invoice or student cannot erase their history
+    invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT, related_name='ledger_entries')
+    student = models.ForeignKey(StudentProfile, on_delete=models.PROTECT, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    debit_account = models.CharField(max_length=12, choices=ACCOUNT_CHOICES)
+    credit_account = models.CharField(max_length=12, choices=ACCOUNT_CHOICES)
+    amount = PaiseField()  # Always positive
+    memo = models.CharField(max_length=255, blank=True)
+    posted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    posted_at = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Ledger entries are append-only; post a correcting entry instead')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} {self.amount}: {self.debit_account} / {self.credit_account} ({self.invoice_id})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['posted_at'], name='ledger_posted_idx'),
+            models.Index(fields=['invoice', 'posted_at'], name='ledger_invoice_posted_idx'),
+            models.Index(fields=['student', 'posted_at'], name='ledger_student_posted_idx'),
+        ]
+
+class LedgerSnapshot(models.Model):
+    """Cumulative ledger measures of an invoice, in paise, over the entries posted up to `taken_at`"""
+    invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT, related_name='ledger_snapshots')
+    taken_at = models.DateTimeField()
+    billed = PaiseField(default=0)
+    collected = PaiseField(default=0)
+    conceded = PaiseField(default=0)
+    balance = PaiseField(default=0)
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id} @ {self.taken_at}: {self.balance}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['taken_at', 'invoice'], name='unique_ledger_snapshot'),
+        ]
+
+class CustomFeeComponent(models.Model):
+    """One component of a student's custom fee structure, in paise"""
+    structure = models.ForeignKey(CustomFeeStructure, on_delete=models.CASCADE, related_name='component_rows')
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='custom_fee_components')
+    component_name = models.CharField(max_length=100)
+    amount = PaiseField()
+
+    def __str__(self):
+        return f"{self.component_name} {self.amount} ({self.student_id})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['structure', 'component_name'], name='unique_custom_fee_component'),
+        ]
+        indexes = [
+            models.Index(fields=['component_name', 'id'], name='custom_fee_component_name_idx'),
+        ]
+
+class FeeAssignmentOverride(models.Model):
+    """Amount, in paise, replacing a template component's fee in one fee assignment"""
+    assignment = models.ForeignKey(FeeAssignment, on_delete=models.CASCADE, related_name='override_rows')
+    component = models.ForeignKey(FeeComponent, on_delete=models.CASCADE, related_name='assignment_overrides')
+    amount = PaiseField()
+
+    def __str__(self):
+        return f"{self.component_id} {self.amount} ({self.assignment_id})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['assignment', 'component'], name='unique_fee_assignment_override'),
+        ]
+        indexes = [
+            models.Index(fields=['component', 'id'], name='fee_override_component_idx'),
+        ]
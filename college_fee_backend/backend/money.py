@@ -0,0 +1,41 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from django.db import models
+
+# Money as a whole number of paise: sums and comparisons are plain integer
+# math, and amounts cross to Stripe (which counts in paise) without rounding.
+PAISE_PER_RUPEE = 100
+_PAISA = Decimal('0.01')
+
+
+def to_paise(amount):
+    """Paise in a rupee amount given as a Decimal, int, float or numeric string, rounded half up"""
+    if isinstance(amount, int):
+        return amount * PAISE_PER_RUPEE
+    # str() first so floats convert by their shortest repr (19.99, not 19.989999...)
+    value = Decimal(str(amount))
+    if not value.is_finite():
+        raise ValueError(f"{amount} is not an amount")
+    return int(value.quantize(_PAISA, rounding=ROUND_HALF_UP) * PAISE_PER_RUPEE)
+
+
+def to_rupees(paise):
+    """Rupee Decimal, with two places, of an amount in paise"""
+    return (Decimal(paise) / PAISE_PER_RUPEE).quantize(_PAISA)
+
+
+def parse_paise(value, name='amount'):
+    """Paise in a rupee amount sent by a client, or ValueError naming the field"""
+    try:
+        return to_paise(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"{name} must be an amount in rupees")
+
+
+class PaiseField(models.BigIntegerField):
+    """Amount of money stored as a whole number of paise"""
+    description = 'Money in paise'
+
+    def get_prep_value(self, value):
+        if isinstance(value, (Decimal, float)):
+            raise TypeError(f"{self.name} holds paise; convert rupee amounts with to_paise()")
+        return super().get_prep_value(value)
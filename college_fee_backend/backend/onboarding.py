@@ -0,0 +1,237 @@
+import csv
+import hashlib
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .models import User, StudentProfile, StudentInvite
+
+# Rows validated and inserted per transaction
+ONBOARDING_CHUNK_SIZE = 500
+STUDENT_FIELDS = (
+    'email', 'password', 'name', 'usn', 'dept', 'semester', 'batch', 'section',
+    'admission_mode', 'status', 'date_of_admission',
+)
+ADMISSION_MODES = {value for value, label in StudentProfile.ADMISSION_MODE_CHOICES}
+STUDENT_STATUSES = {value for value, label in StudentProfile.STATUS_CHOICES}
+
+
+def read_student_csv(file):
+    """Yield (line, row) pairs of an onboarding CSV, keyed by STUDENT_FIELDS"""
+    reader = csv.DictReader(file)
+    headers = {name.strip().lower().replace(' ', '_'): name for name in reader.fieldnames or []}
+    missing = [field for field in ('email', 'name', 'dept') if field not in headers]
+    if missing:
+        raise ValueError(f"The file is missing the columns: {', '.join(missing)}")
+    for line, raw in enumerate(reader, start=2):
+        yield line, {field: (raw.get(headers[field]) or '').strip() for field in STUDENT_FIELDS if field in headers}
+
+
+def read_student_records(records):
+    """Yield (number, row) pairs of JSON student records"""
+    for number, record in enumerate(records, start=1):
+        record = record if isinstance(record, dict) else {}
+        yield number, {field: str(record[field]).strip() for field in STUDENT_FIELDS if record.get(field) is not None}
+
+
+def _validate(row):
+    """Normalized user and profile values of a row, and the errors by field"""
+    errors = {}
+    email = User.objects.normalize_email(row.get('email', ''))
+    try:
+        validate_email(email)
+    except ValidationError:
+        errors['email'] = 'Enter a valid email address'
+    for field in ('name', 'dept'):
+        if not row.get(field):
+            errors[field] = 'This field is required'
+    try:
+        semester = int(row.get('semester') or 1)
+        if not 1 <= semester <= 12:
+            raise ValueError
+    except ValueError:
+        errors['semester'] = 'Semester must be a number from 1 to 12'
+        semester = None
+    admission_mode = (row.get('admission_mode') or 'kcet').lower()
+    if admission_mode not in ADMISSION_MODES:
+        errors['admission_mode'] = f"Must be one of: {', '.join(sorted(ADMISSION_MODES))}"
+    student_status = (row.get('status') or 'active').lower()
+    if student_status not in STUDENT_STATUSES:
+        errors['status'] = f"Must be one of: {', '.join(sorted(STUDENT_STATUSES))}"
+    date_of_admission = None
+    if row.get('date_of_admission'):
+        try:
+            date_of_admission = datetime.strptime(row['date_of_admission'], '%Y-%m-%d').date()
+        except ValueError:
+            errors['date_of_admission'] = 'Use the YYYY-MM-DD format'
+    if len(row.get('section') or '') > 1:
+        errors['section'] = 'Section is a single letter'
+
+    profile = {
+        'name': row.get('name', ''),
+        'usn': row.get('usn') or None,
+        'dept': row.get('dept', ''),
+        'semester': semester,
+        'batch': row.get('batch') or None,
+        'section': row.get('section') or None,
+        'admission_mode': admission_mode,
+        'status': student_status,
+        'date_of_admission': date_of_admission,
+    }
+    return email, profile, errors
+
+
+def _init_hasher_process(settings_module):
+    # Spawned workers start without Django; forked ones already have it set up
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords with the default hasher, across a process pool when there are several"""
+    workers = min(workers or settings.ONBOARDING_HASH_WORKERS, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_hasher_process,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'),),
+    ) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def _invite_token():
+    token = secrets.token_urlsafe(32)
+    return token, hashlib.sha256(token.encode()).hexdigest()
+
+
+def onboard_students(rows, invite_only=False, dry_run=False, chunk_size=ONBOARDING_CHUNK_SIZE):
+    """
+    Create student users and profiles in bulk from (line, row) pairs
+
+    Every row is validated and checked for duplicate emails and USNs against
+    the database and the rest of the file; results come back per row. Rows
+    with a password get it hashed (in a process pool, since PBKDF2 dominates
+    the cost); rows without one, or every row with `invite_only`, get an
+    unusable password and an invite token to set it. Valid rows are inserted
+    with bulk_create, one transaction per chunk. With `dry_run` nothing is
+    hashed or written.
+    """
+    summary = {'rows': 0, 'created': 0, 'invited': 0, 'failed': 0, 'dry_run': dry_run}
+    results = []
+    seen_emails, seen_usns = set(), set()
+    chunk = []
+    for line, row in rows:
+        summary['rows'] += 1
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            _onboard_chunk(chunk, invite_only, dry_run, seen_emails, seen_usns, summary, results)
+            chunk = []
+    if chunk:
+        _onboard_chunk(chunk, invite_only, dry_run, seen_emails, seen_usns, summary, results)
+    return summary, results
+
+
+def _onboard_chunk(chunk, invite_only, dry_run, seen_emails, seen_usns, summary, results):
+    validated = [(line, row) + _validate(row) for line, row in chunk]
+    emails = {email.lower() for line, row, email, profile, errors in validated}
+    usns = {profile['usn'] for line, row, email, profile, errors in validated if profile['usn']}
+    taken_emails = set(
+        User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails).values_list('email_lower', flat=True)
+    )
+    taken_usns = set(StudentProfile.objects.filter(usn__in=usns).values_list('usn', flat=True))
+
+    accepted = []
+    for line, row, email, profile, errors in validated:
+        if email.lower() in taken_emails or email.lower() in seen_emails:
+            errors.setdefault('email', 'A user with this email already exists')
+        if profile['usn'] and (profile['usn'] in taken_usns or profile['usn'] in seen_usns):
+            errors.setdefault('usn', 'A student with this USN already exists')
+        seen_emails.add(email.lower())
+        if profile['usn']:
+            seen_usns.add(profile['usn'])
+        result = {'line': line, 'email': email, 'usn': profile['usn']}
+        if errors:
+            summary['failed'] += 1
+            results.append(dict(result, status='error', errors=errors))
+            continue
+        results.append(result)
+        accepted.append((result, email, row.get('password') if not invite_only else None, profile))
+    if dry_run or not accepted:
+        for result, *rest in accepted:
+            result['status'] = 'valid'
+        return
+
+    hashed = iter(hash_passwords([password for result, email, password, profile in accepted if password]))
+    expires_at = timezone.now() + timedelta(days=settings.STUDENT_INVITE_TTL_DAYS)
+    users, profiles, invites = [], [], []
+    for result, email, password, profile in accepted:
+        user = User(email=email, role='student')
+        if password:
+            user.password = next(hashed)
+        else:
+            user.set_unusable_password()
+            token, token_hash = _invite_token()
+            result['invite_token'] = token
+            invites.append(StudentInvite(user=user, token_hash=token_hash, expires_at=expires_at))
+        users.append(user)
+        profiles.append(StudentProfile(user=user, **profile))
+
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            StudentProfile.objects.bulk_create(profiles)
+            StudentInvite.objects.bulk_create(invites)
+    except IntegrityError:
+        # Someone created one of these students meanwhile; insert row by row to find out who
+        _onboard_one_by_one(accepted, users, profiles, invites, summary)
+        return
+    for (result, *rest), profile in zip(accepted, profiles):
+        result.update(status='created', student_id=profile.pk)
+    summary['created'] += len(accepted)
+    summary['invited'] += len(invites)
+
+
+def _onboard_one_by_one(accepted, users, profiles, invites, summary):
+    invite_of = {id(invite.user): invite for invite in invites}
+    for (result, *rest), user, profile in zip(accepted, users, profiles):
+        invite = invite_of.get(id(user))
+        user.pk = profile.pk = None
+        try:
+            with transaction.atomic():
+                user.save()
+                profile.user = user
+                profile.save()
+                if invite:
+                    invite.user = user
+                    invite.save()
+        except IntegrityError:
+            result.pop('invite_token', None)
+            result.update(status='error', errors={'email': 'A user with this email or USN already exists'})
+            summary['failed'] += 1
+            continue
+        result.update(status='created', student_id=profile.pk)
+        summary['created'] += 1
+        summary['invited'] += bool(invite)
+
+
+def accept_invite(token, password):
+    """Set the password of the student invited with `token`; returns the user or raises ValueError"""
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    with transaction.atomic():
+        invite = StudentInvite.objects.select_for_update().select_related('user').filter(token_hash=token_hash).first()
+        if invite is None or invite.accepted_at or invite.expires_at <= timezone.now():
+            raise ValueError('This invite link is invalid or has expired')
+        invite.user.set_password(password)
+        invite.user.save(update_fields=['password'])
+        invite.accepted_at = timezone.now()
+        invite.save(update_fields=['accepted_at'])
+    return invite.user
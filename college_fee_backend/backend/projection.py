@@ -0,0 +1,39 @@
+from django.db.models import F
+
+
+def parse_fields(request, available, default):
+    """
+    Return the output fields selected by the `?fields=a,b,c` query parameter
+
+    `available` maps output field names to ORM lookup paths. Without the
+    parameter the `default` fields are returned. Raises ValueError when an
+    unknown field is requested.
+    """
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(available)}"
+        )
+    return names
+
+
+def project(queryset, available, fields):
+    """
+    Reduce a queryset to .values() rows holding only the selected fields
+
+    Only the selected columns are fetched, related tables are joined only
+    when a selected field crosses a relation, and no model instances are built.
+    """
+    plain = []
+    aliased = {}
+    for name in fields:
+        path = available[name]
+        if path == name:
+            plain.append(name)
+        else:
+            aliased[name] = F(path)
+    return queryset.values(*plain, **aliased)
@@ -0,0 +1,82 @@
+import uuid
+import decimal
+import datetime
+import orjson
+from django.http import HttpResponse
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import msgpack
+except ImportError:  # MessagePack output is optional
+    msgpack = None
+
+# orjson serializes date, datetime, time and UUID natively (ISO 8601, matching
+# isoformat()); Decimal and lazy translation strings go through orjson_default.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def orjson_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, Promise):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """Serialize data to JSON bytes"""
+    return orjson.dumps(data, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """DRF renderer that serializes responses with orjson"""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class ORJSONResponse(HttpResponse):
+    """Drop-in replacement for JsonResponse that serializes with orjson"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+def msgpack_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (uuid.UUID, Promise)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    DRF renderer producing MessagePack for machine clients
+
+    Selected with `Accept: application/msgpack` or `?format=msgpack`. Values are
+    encoded the same way as the JSON output (Decimal as float, dates as ISO strings).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=msgpack_default, use_bin_type=True)
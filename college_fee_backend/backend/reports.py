@@ -0,0 +1,290 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+from django.db.models.functions import TruncMonth
+from .models import ComponentCollection, DailyCollection, Invoice, InvoiceCube, Payment
+from .projection import project
+from .rollups import CUBE_DIMENSIONS
+
+# Report columns mapped to their ORM paths; related columns are fetched with
+# joins in the same query, so rows never touch invoice.student one by one.
+OUTSTANDING_COLUMNS = {
+    'invoice_id': 'id',
+    'invoice_number': 'invoice_number',
+    'student_name': 'student__name',
+    'student_usn': 'student__usn',
+    'department': 'student__dept',
+    'semester': 'semester',
+    'academic_year': 'academic_year',
+    'total_amount': 'total_amount',
+    'paid_amount': 'paid_amount',
+    'balance_amount': 'balance_amount',
+    'due_date': 'due_date',
+    'status': 'status',
+}
+
+COLLECTION_COLUMNS = {
+    'payment_id': 'id',
+    'payment_reference': 'payment_reference',
+    'timestamp': 'timestamp',
+    'invoice_number': 'invoice__invoice_number',
+    'student_name': 'invoice__student__name',
+    'student_usn': 'invoice__student__usn',
+    'department': 'invoice__student__dept',
+    'semester': 'invoice__semester',
+    'mode': 'mode',
+    'amount': 'amount',
+    'transaction_id': 'transaction_id',
+}
+
+PAYMENT_COLUMNS = dict(COLLECTION_COLUMNS, status='status')
+
+
+def parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+
+
+def _filter_payment_dates(payments, params):
+    if params.get('from'):
+        payments = payments.filter(timestamp__date__gte=parse_date(params['from'], 'from'))
+    if params.get('to'):
+        payments = payments.filter(timestamp__date__lte=parse_date(params['to'], 'to'))
+    return payments
+
+
+def outstanding_invoices(params):
+    """Invoices with a balance due, filtered by `dept` and `semester`"""
+    invoices = Invoice.objects.filter(balance_amount__gt=0)
+    if params.get('dept'):
+        invoices = invoices.filter(student__dept=params['dept'])
+    if params.get('semester'):
+        invoices = invoices.filter(semester=params['semester'])
+    return invoices
+
+
+def collection_payments(params):
+    """Successful payments, filtered by `dept`, invoice `semester` (as the collections rollup is), `mode`, `from` and `to`"""
+    payments = Payment.objects.filter(status='success')
+    if params.get('dept'):
+        payments = payments.filter(invoice__student__dept=params['dept'])
+    if params.get('semester'):
+        payments = payments.filter(invoice__semester=params['semester'])
+    if params.get('mode'):
+        payments = payments.filter(mode=params['mode'])
+    return _filter_payment_dates(payments, params)
+
+
+def payment_records(params):
+    """All payments, filtered by `status`, `mode`, `student_id`, `from` and `to`"""
+    payments = Payment.objects.all()
+    if params.get('status'):
+        payments = payments.filter(status=params['status'])
+    if params.get('mode'):
+        payments = payments.filter(mode=params['mode'])
+    if params.get('student_id'):
+        payments = payments.filter(invoice__student_id=params['student_id'])
+    return _filter_payment_dates(payments, params)
+
+
+# Aging buckets by days past due as of a date: (name, first day, last day)
+AGING_BUCKETS = (
+    ('not_due', None, -1),
+    ('0_30', 0, 30),
+    ('31_60', 31, 60),
+    ('61_90', 61, 90),
+    ('90_plus', 91, None),
+)
+AGING_GROUPS = {
+    'dept': 'student__dept',
+    'semester': 'semester',
+    'academic_year': 'academic_year',
+    'admission_mode': 'student__admission_mode',
+}
+
+
+def aging_as_of(params):
+    return parse_date(params['as_of'], 'as_of') if params.get('as_of') else timezone.localdate()
+
+
+def _aging_condition(as_of, first_day, last_day):
+    condition = Q()
+    if first_day is not None:
+        condition &= Q(due_date__lte=as_of - timedelta(days=first_day))
+    if last_day is not None:
+        condition &= Q(due_date__gte=as_of - timedelta(days=last_day))
+    return condition
+
+
+def aging_invoices(params):
+    """Outstanding invoices, optionally limited to one aging `bucket` as of `as_of`"""
+    invoices = outstanding_invoices(params)
+    if params.get('bucket'):
+        limits = {name: (first_day, last_day) for name, first_day, last_day in AGING_BUCKETS}
+        if params['bucket'] not in limits:
+            raise ValueError(f"bucket must be one of: {', '.join(limits)}")
+        invoices = invoices.filter(_aging_condition(aging_as_of(params), *limits[params['bucket']]))
+    return invoices
+
+
+def aging_report(params, group_by):
+    """
+    Outstanding balance and invoice count per aging bucket, grouped by `group_by`
+
+    Every bucket is a CASE expression inside one grouped aggregate, so the
+    report is a single scan of the open invoices.
+    """
+    as_of = aging_as_of(params)
+    aggregates = {'invoice_count': Count('id'), 'total_balance': Sum('balance_amount')}
+    for name, first_day, last_day in AGING_BUCKETS:
+        condition = _aging_condition(as_of, first_day, last_day)
+        aggregates[f'amount_{name}'] = Sum(Case(
+            When(condition, then=F('balance_amount')),
+            default=Value(0), output_field=DecimalField(max_digits=14, decimal_places=2),
+        ))
+        aggregates[f'count_{name}'] = Sum(Case(
+            When(condition, then=Value(1)), default=Value(0), output_field=IntegerField(),
+        ))
+
+    plain = [name for name in group_by if AGING_GROUPS[name] == name]
+    aliased = {name: F(AGING_GROUPS[name]) for name in group_by if AGING_GROUPS[name] != name}
+    invoices = outstanding_invoices(params)
+    if group_by:
+        return as_of, list(invoices.values(*plain, **aliased).annotate(**aggregates).order_by(*group_by))
+    return as_of, [invoices.aggregate(**aggregates)]
+
+
+Report = namedtuple('Report', ['columns', 'queryset', 'ordering'])
+
+REPORTS = {
+    'outstanding': Report(OUTSTANDING_COLUMNS, outstanding_invoices, 'id'),
+    'collections': Report(COLLECTION_COLUMNS, collection_payments, 'timestamp'),
+    'payments': Report(PAYMENT_COLUMNS, payment_records, 'timestamp'),
+    'aging': Report(OUTSTANDING_COLUMNS, aging_invoices, 'due_date'),
+}
+
+
+def report_rows(name, params, fields=None):
+    """
+    Return the .values() rows of a report, ordered and limited to `fields`
+
+    Raises ValueError when a filter parameter is malformed.
+    """
+    report = REPORTS[name]
+    queryset = report.queryset(params).order_by(report.ordering, 'id')
+    return project(queryset, report.columns, fields or list(report.columns))
+
+
+# Collections served from the daily rollup, so their cost follows the number of
+# days in range rather than the number of payments.
+
+COLLECTION_INTERVALS = ('day', 'month')
+COLLECTION_GROUPS = ('mode', 'dept', 'semester')
+
+
+def _filter_collections(rows, params):
+    """Collection rollup rows filtered by `month` (YYYY-MM), `from`, `to`, `dept` and `mode`"""
+    if params.get('month'):
+        try:
+            month = datetime.strptime(params['month'], '%Y-%m')
+        except ValueError:
+            raise ValueError('month must be in YYYY-MM format')
+        rows = rows.filter(date__year=month.year, date__month=month.month)
+    if params.get('from'):
+        rows = rows.filter(date__gte=parse_date(params['from'], 'from'))
+    if params.get('to'):
+        rows = rows.filter(date__lte=parse_date(params['to'], 'to'))
+    if params.get('dept'):
+        rows = rows.filter(dept=params['dept'])
+    if params.get('mode'):
+        rows = rows.filter(mode=params['mode'])
+    return rows
+
+
+def _periods(interval):
+    if interval == 'day':
+        return {'period': F('date')}
+    if interval == 'month':
+        return {'period': TruncMonth('date')}
+    return {}
+
+
+def daily_collections(params):
+    """Daily rollup rows filtered by `month` (YYYY-MM), `from`, `to`, `dept`, `semester` and `mode`"""
+    rows = _filter_collections(DailyCollection.objects.all(), params)
+    if params.get('semester'):
+        rows = rows.filter(semester=params['semester'])
+    return rows
+
+
+def collection_breakdown(rows, *fields, interval=None):
+    """
+    Sum rollup rows per `fields` and, when given, per 'day' or 'month' `interval`
+
+    The interval start is returned as `period`. Groups whose payments were all
+    refunded or failed later are left out.
+    """
+    periods = _periods(interval)
+    return (
+        rows.values(*fields, **periods)
+        .annotate(amount=Sum('amount'), payment_count=Sum('payment_count'))
+        .filter(payment_count__gt=0)
+        .order_by(*periods, *fields)
+    )
+
+
+# Collections per fee component, from the component rollup (amounts in paise)
+
+COMPONENT_COLLECTION_GROUPS = ('dept', 'mode')
+
+
+def component_collections(params):
+    """Component rollup rows filtered by `month` (YYYY-MM), `from`, `to`, `dept`, `mode` and `component`"""
+    rows = _filter_collections(ComponentCollection.objects.all(), params)
+    if params.get('component'):
+        rows = rows.filter(component_name=params['component'])
+    return rows
+
+
+def component_breakdown(rows, *fields, interval=None):
+    """Sum component rollup rows per component, `fields` and, when given, per 'day' or 'month' `interval`"""
+    periods = _periods(interval)
+    return (
+        rows.values('component_name', *fields, **periods)
+        .annotate(amount=Sum('amount'), allocation_count=Sum('allocation_count'))
+        .filter(allocation_count__gt=0)
+        .order_by(*periods, 'component_name', *fields)
+    )
+
+
+# Invoice cube: every tile is a filtered sum over a few precomputed cells
+
+CUBE_TOTALS = {
+    'invoices': Sum('invoice_count'),
+    'total_fees': Sum('total_amount'),
+    'total_paid': Sum('paid_amount'),
+    'total_balance': Sum('balance_amount'),
+}
+
+
+def invoice_cube(params):
+    """Non-empty cube cells filtered by any dimension, each filter taking a comma-separated list"""
+    cells = InvoiceCube.objects.filter(invoice_count__gt=0)
+    for dimension in CUBE_DIMENSIONS:
+        if params.get(dimension):
+            cells = cells.filter(**{f'{dimension}__in': params[dimension].split(',')})
+    return cells
+
+
+def cube_rollup(cells, group_by=()):
+    """Roll cells up to the `group_by` dimensions"""
+    return cells.values(*group_by).annotate(**CUBE_TOTALS).order_by(*group_by)
+
+
+def cube_totals(cells):
+    """Grand totals of the cells, with zeros for an empty selection"""
+    totals = cells.aggregate(**CUBE_TOTALS)
+    return {name: value or 0 for name, value in totals.items()}
@@ -0,0 +1,232 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .caching import get_fee_components, get_fee_templates, invalidate_student_dashboards
+from .ledger import post_charges
+from .models import (
+    CustomFeeComponent, FeeAssignment, FeeAssignmentOverride, Invoice, InvoiceComponent, JobCheckpoint,
+    Notification, StudentProfile
+)
+from .money import to_paise, to_rupees
+from .rollups import tracking_student_cube
+
+# Students promoted and billed per transaction
+ROLLOVER_CHUNK_SIZE = 500
+TERMS = ('odd', 'even')
+
+
+def checkpoint_name(academic_year, term):
+    return f"semester_rollover:{academic_year}:{term}"
+
+
+def template_index(academic_year, term):
+    """
+    Active fee templates of `academic_year` billed in `term`, keyed by (admission mode, dept, semester)
+
+    Semester templates are billed every term and annual ones only in the odd
+    term that opens the year. A template without a dept or semester is keyed
+    with '' or 0; where several share a key the oldest wins.
+    """
+    fee_types = ('semester', 'annual') if term == 'odd' else ('semester',)
+    index = {}
+    for template in get_fee_templates().values():
+        if template['academic_year'] != academic_year or not template['is_active'] or template['fee_type'] not in fee_types:
+            continue
+        key = (template['admission_mode'] or '', (template['dept'] or '').lower(), template['semester'] or 0)
+        index.setdefault(key, template)
+    return index
+
+
+def resolve_template(index, admission_mode, dept, semester):
+    """The most specific template for a student: by dept and semester, dept, semester, then admission mode alone"""
+    dept = (dept or '').lower()
+    for key in ((admission_mode, dept, semester), (admission_mode, dept, 0), (admission_mode, '', semester), (admission_mode, '', 0)):
+        if key in index:
+            return index[key]
+    return None
+
+
+def _leaving_semesters(term):
+    """Semesters whose students move up into `term`, and the final semester when its students graduate instead"""
+    final = settings.ROLLOVER_FINAL_SEMESTER
+    parity = 1 if term == 'even' else 0
+    leaving = [semester for semester in range(1, final) if semester % 2 == parity]
+    return leaving, [final] if final % 2 == parity else []
+
+
+def rollover_students(academic_year, term, due_date=None, dry_run=False, force=False, chunk_size=ROLLOVER_CHUNK_SIZE):
+    """
+    Promote active students into `term` ('odd' or 'even') of `academic_year` and issue its invoices
+
+    Students in the semesters leading into the term move up one semester
+    with a bulk update, and each gets an invoice with components from their
+    custom fee structure, or else from the most specific matching template
+    (see template_index) with their assignment's overrides for the year.
+    Students with a status in ROLLOVER_SKIPPED_STATUSES, inactive ones and
+    those in ROLLOVER_FINAL_SEMESTER are left alone and counted.
+
+    Work is done in chunks of students, one transaction each. Promoted
+    students no longer sit in a leaving semester, so a rerun after a failure
+    resumes with the students still left, and students who already have an
+    invoice for the new semester are promoted without a second one. A
+    completed rollover is recorded as a JobCheckpoint and not run again
+    unless `force` is set. Raises ValueError for an unknown term.
+    """
+    if term not in TERMS:
+        raise ValueError(f"term must be one of: {', '.join(TERMS)}")
+    summary = {
+        'academic_year': academic_year, 'term': term, 'dry_run': dry_run, 'already_completed': False,
+        'promoted': 0, 'invoices_created': 0, 'assignments_created': 0, 'amount': 0,
+        'already_invoiced': 0, 'without_template': 0, 'skipped': {},
+    }
+    checkpoint = JobCheckpoint.objects.filter(name=checkpoint_name(academic_year, term)).first()
+    if checkpoint and checkpoint.watermark and not force:
+        summary.update(already_completed=True, completed_at=checkpoint.watermark)
+        return summary
+
+    due_date = due_date or timezone.localdate() + timedelta(days=settings.ROLLOVER_DUE_DAYS)
+    index = template_index(academic_year, term)
+    leaving, graduating = _leaving_semesters(term)
+    skipped_statuses = settings.ROLLOVER_SKIPPED_STATUSES
+
+    moving = StudentProfile.objects.filter(semester__in=leaving + graduating)
+    summary['skipped'] = dict(
+        moving.filter(is_active=True, status__in=skipped_statuses).values_list('status').annotate(Count('id')).order_by()
+    )
+    summary['skipped']['inactive'] = moving.filter(is_active=False).count()
+    summary['skipped']['final_semester'] = moving.filter(
+        is_active=True, semester__in=graduating
+    ).exclude(status__in=skipped_statuses).count()
+
+    eligible = StudentProfile.objects.filter(is_active=True, semester__in=leaving).exclude(status__in=skipped_statuses)
+    last_id = 0
+    while True:
+        chunk = list(eligible.filter(pk__gt=last_id).order_by('id').values(
+            'id', 'user_id', 'dept', 'semester', 'admission_mode'
+        )[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1]['id']
+        _rollover_chunk(chunk, eligible, academic_year, index, due_date, dry_run, summary)
+
+    summary['amount'] = to_rupees(summary['amount'])
+    if not dry_run:
+        JobCheckpoint.objects.update_or_create(
+            name=checkpoint_name(academic_year, term), defaults={'watermark': timezone.now()}
+        )
+    return summary
+
+
+def _plan_invoices(chunk, academic_year, index):
+    """(student, template, [(component name, paise)]) per student of the chunk, None where nothing is billed"""
+    student_ids = [student['id'] for student in chunk]
+    custom = {}
+    for student_id, name, amount in CustomFeeComponent.objects.filter(student_id__in=student_ids).order_by('id').values_list(
+        'student_id', 'component_name', 'amount'
+    ):
+        custom.setdefault(student_id, []).append((name, amount))
+    assignments = {
+        assignment.student_id: assignment
+        for assignment in FeeAssignment.objects.filter(student_id__in=student_ids, academic_year=academic_year)
+    }
+    overrides = {}
+    for assignment_id, component_id, amount in FeeAssignmentOverride.objects.filter(
+        assignment__in=list(assignments.values())
+    ).values_list('assignment_id', 'component_id', 'amount'):
+        overrides.setdefault(assignment_id, {})[component_id] = amount
+    component_names = {component['id']: component['name'] for component in get_fee_components()}
+
+    plans = {}
+    for student in chunk:
+        semester = student['semester'] + 1
+        if student['id'] in custom:
+            plans[student['id']] = (student, None, custom[student['id']])
+            continue
+        template = resolve_template(index, student['admission_mode'], student['dept'], semester)
+        if template is None:
+            plans[student['id']] = None
+            continue
+        fees = {component['component_id']: to_paise(component['amount']) for component in template['components']}
+        assignment = assignments.get(student['id'])
+        if assignment is not None:
+            fees.update(overrides.get(assignment.pk, {}))
+        plans[student['id']] = (student, template, [
+            (component_names.get(component_id, 'Fee'), amount) for component_id, amount in fees.items()
+        ])
+    return plans, assignments
+
+
+def _rollover_chunk(chunk, eligible, academic_year, index, due_date, dry_run, summary):
+    plans, assignments = _plan_invoices(chunk, academic_year, index)
+    student_ids = list(plans)
+
+    with transaction.atomic():
+        # Students promoted or moved out of the rollover since the chunk was read are left alone
+        student_ids = list(eligible.select_for_update().filter(pk__in=student_ids).values_list('id', flat=True))
+        invoiced = set(Invoice.objects.filter(
+            student_id__in=student_ids, academic_year=academic_year
+        ).values_list('student_id', 'semester'))
+
+        bills = []
+        for student_id in student_ids:
+            plan = plans[student_id]
+            if plan is None or not sum(amount for name, amount in plan[2]):
+                summary['without_template'] += 1
+            elif (student_id, plan[0]['semester'] + 1) in invoiced:
+                summary['already_invoiced'] += 1
+            else:
+                bills.append(plan)
+        summary['promoted'] += len(student_ids)
+        summary['invoices_created'] += len(bills)
+        summary['amount'] += sum(amount for student, template, components in bills for name, amount in components)
+        if dry_run:
+            summary['assignments_created'] += sum(
+                1 for student, template, components in bills if template and student['id'] not in assignments
+            )
+            return
+
+        with tracking_student_cube(student_ids):
+            StudentProfile.objects.filter(pk__in=student_ids).update(semester=F('semester') + 1)
+            new_assignments = FeeAssignment.objects.bulk_create([
+                FeeAssignment(
+                    student_id=student['id'], template_id=template['id'], assignment_type='auto',
+                    academic_year=academic_year, is_active=True
+                )
+                for student, template, components in bills if template and student['id'] not in assignments
+            ])
+            assignments.update((assignment.student_id, assignment) for assignment in new_assignments)
+            summary['assignments_created'] += len(new_assignments)
+
+            # Numbered under the invoice number lock, held until the chunk commits
+            invoices = []
+            for number, (student, template, components) in zip(Invoice.reserve_numbers(len(bills)), bills):
+                total = to_rupees(sum(amount for name, amount in components))
+                invoices.append(Invoice(
+                    student_id=student['id'], assignment=assignments.get(student['id']),
+                    invoice_type=template['fee_type'] if template else 'semester', academic_year=academic_year,
+                    semester=student['semester'] + 1, total_amount=total, paid_amount=0, balance_amount=total,
+                    due_date=due_date, status='pending', invoice_number=number
+                ))
+            Invoice.objects.bulk_create(invoices)
+            InvoiceComponent.objects.bulk_create(
+                InvoiceComponent(
+                    invoice=invoice, component_name=name, component_amount=to_rupees(amount),
+                    paid_amount=0, balance_amount=to_rupees(amount)
+                )
+                for invoice, (student, template, components) in zip(invoices, bills)
+                for name, amount in components
+            )
+        post_charges(invoices)
+        Notification.objects.bulk_create(
+            Notification(
+                user_id=student['user_id'],
+                message=f"Invoice {invoice.invoice_number} of ₹{invoice.total_amount} for semester {invoice.semester} "
+                        f"is due on {due_date.strftime('%d-%b-%Y')}.",
+                is_read=False
+            )
+            for invoice, (student, template, components) in zip(invoices, bills)
+        )
+        user_of = {student['id']: student['user_id'] for student in chunk}
+        invalidate_student_dashboards({user_of[student_id] for student_id in student_ids})
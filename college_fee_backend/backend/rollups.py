@@ -0,0 +1,398 @@
+from decimal import Decimal
+from contextlib import contextmanager
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import ComponentCollection, DailyCollection, Invoice, InvoiceCube, Payment, PaymentComponent, StudentProfile
+from .money import to_paise
+
+
+def _upsert(model, key, **deltas):
+    """Add `deltas` to the row identified by `key`, creating it when missing"""
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**key).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Created concurrently between the update and the insert
+        model.objects.filter(**key).update(**increments)
+
+
+# Daily collections
+
+def collection_key(payment):
+    """Rollup dimensions of a payment, or None when its invoice no longer exists"""
+    invoice = Invoice.objects.filter(pk=payment.invoice_id).values('semester', 'student__dept').first()
+    if invoice is None:
+        return None
+    return {
+        'date': timezone.localdate(payment.timestamp),
+        'mode': payment.mode,
+        'dept': invoice['student__dept'],
+        'semester': invoice['semester'] or 0,
+    }
+
+
+def net_amount(payment):
+    """A payment's amount less what has been refunded of it"""
+    return Decimal(payment.amount) - Decimal(payment.refunded_amount or 0)
+
+
+def add_collection(payment, sign=1):
+    """Count a successful payment, less its partial refunds, in the daily rollup, or take it out with sign=-1"""
+    key = collection_key(payment)
+    if key is None:
+        return
+    _upsert(DailyCollection, key, amount=net_amount(payment) * sign, payment_count=sign)
+
+
+def add_collections(payments):
+    """
+    Count bulk-created successful payments in the daily rollup
+
+    bulk_create skips the signals that maintain the rollup; the payments are
+    grouped per rollup row so each row is written once.
+    """
+    invoices = {
+        row['id']: row for row in
+        Invoice.objects.filter(pk__in={payment.invoice_id for payment in payments}).values('id', 'semester', 'student__dept')
+    }
+    totals = {}
+    for payment in payments:
+        invoice = invoices.get(payment.invoice_id)
+        if invoice is None or payment.status != 'success':
+            continue
+        key = (timezone.localdate(payment.timestamp), payment.mode, invoice['student__dept'], invoice['semester'] or 0)
+        amount, count = totals.get(key, (Decimal(0), 0))
+        totals[key] = (amount + net_amount(payment), count + 1)
+    for (day, mode, dept, semester), (amount, count) in totals.items():
+        _upsert(DailyCollection, {'date': day, 'mode': mode, 'dept': dept, 'semester': semester},
+                amount=amount, payment_count=count)
+
+
+def sync_payment_collection(old, new):
+    """
+    Keep the daily and component rollups in step with a saved or deleted payment
+
+    `old` is the payment as stored before the save (None when it was just
+    created) and `new` the saved payment (None when it was deleted). Only
+    payments whose status is or was 'success' touch the rollups, counted less
+    their partial refunds. A deleted
+    payment's allocations are gone by post_delete, so they are taken out of
+    the component rollup on pre_delete instead.
+    """
+    was_counted = old is not None and old.status == 'success'
+    is_counted = new is not None and new.status == 'success'
+    if was_counted and is_counted and (old.amount, old.refunded_amount, old.mode, old.invoice_id) == (
+        new.amount, new.refunded_amount, new.mode, new.invoice_id
+    ):
+        return
+    if was_counted:
+        add_collection(old, -1)
+        if new is not None:
+            add_component_collection(old, -1)
+    if is_counted:
+        add_collection(new)
+        add_component_collection(new)
+
+
+def rebuild_daily_collections(start=None, end=None):
+    """Recompute the daily rollup from the payments table, optionally for a date range"""
+    payments = Payment.objects.filter(status='success', invoice__isnull=False)
+    rows = DailyCollection.objects.all()
+    if start:
+        payments = payments.filter(timestamp__date__gte=start)
+        rows = rows.filter(date__gte=start)
+    if end:
+        payments = payments.filter(timestamp__date__lte=end)
+        rows = rows.filter(date__lte=end)
+
+    totals = payments.values(
+        'mode',
+        day=TruncDate('timestamp'),
+        dept=F('invoice__student__dept'),
+        term=Coalesce('invoice__semester', Value(0), output_field=IntegerField()),
+    ).annotate(total=Sum(F('amount') - F('refunded_amount')), count=Count('id')).order_by()
+
+    with transaction.atomic():
+        rows.delete()
+        created = DailyCollection.objects.bulk_create(
+            DailyCollection(
+                date=row['day'], mode=row['mode'], dept=row['dept'], semester=row['term'],
+                amount=row['total'], payment_count=row['count'],
+            )
+            for row in totals.iterator()
+        )
+    return len(created)
+
+
+# Component collections
+
+def net_allocations(allocations):
+    """
+    (allocation, paise) of each allocation, less its share of its payment's partial refunds
+
+    A refund is not tied to components, so it is spread over the payment's
+    allocations in proportion to their amounts, in paise rounded down, with
+    the paise left over taken one each from the allocations in id order.
+    """
+    by_payment = {}
+    for allocation in allocations:
+        by_payment.setdefault(id(allocation.payment), []).append(allocation)
+    for payment_allocations in by_payment.values():
+        payment = payment_allocations[0].payment
+        refunded = to_paise(payment.refunded_amount or 0)
+        amounts = [to_paise(allocation.amount_allocated) for allocation in payment_allocations]
+        if not refunded:
+            yield from zip(payment_allocations, amounts)
+            continue
+        payment_allocations, amounts = zip(*sorted(zip(payment_allocations, amounts), key=lambda pair: pair[0].pk))
+        refunded = min(refunded, sum(amounts))
+        paid = to_paise(payment.amount) or 1
+        shares = [amount * refunded // paid for amount in amounts]
+        left = refunded - sum(shares)
+        for index, (allocation, amount) in enumerate(zip(payment_allocations, amounts)):
+            extra = min(left, amount - shares[index])
+            left -= extra
+            yield allocation, amount - shares[index] - extra
+
+
+def add_component_collections(allocations, sign=1):
+    """
+    Count the component allocations of successful payments in the component rollup, or take them out with sign=-1
+
+    Each allocation is counted under its `payment` as given, less its share
+    of the payment's partial refunds (see net_allocations), so callers
+    taking a payment out pass it as it was stored. bulk_create skips the
+    signals that maintain the rollup; bulk paths call this with the
+    allocations they created. Allocations are grouped per rollup row so each
+    row is written once.
+    """
+    allocations = [allocation for allocation in allocations if allocation.payment.status == 'success']
+    depts = dict(
+        Invoice.objects.filter(pk__in={allocation.payment.invoice_id for allocation in allocations})
+        .values_list('id', 'student__dept')
+    )
+    totals = {}
+    for allocation, paise in net_allocations(allocations):
+        payment = allocation.payment
+        if payment.invoice_id not in depts:
+            continue
+        key = (timezone.localdate(payment.timestamp), payment.mode, depts[payment.invoice_id],
+               allocation.invoice_component.component_name)
+        amount, count = totals.get(key, (0, 0))
+        totals[key] = (amount + paise, count + 1)
+    for (day, mode, dept, component_name), (amount, count) in totals.items():
+        _upsert(ComponentCollection, {'date': day, 'mode': mode, 'dept': dept, 'component_name': component_name},
+                amount=amount * sign, allocation_count=count * sign)
+
+
+def add_component_collection(payment, sign=1):
+    """Count a successful payment's stored allocations in the component rollup, or take them out with sign=-1"""
+    allocations = list(PaymentComponent.objects.filter(payment_id=payment.pk).select_related('invoice_component'))
+    for allocation in allocations:
+        allocation.payment = payment
+    add_component_collections(allocations, sign)
+
+
+def rebuild_component_collections(start=None, end=None):
+    """Recompute the component rollup from the allocations of successful payments, optionally for a date range"""
+    allocations = PaymentComponent.objects.filter(payment__status='success', payment__invoice__isnull=False)
+    rows = ComponentCollection.objects.all()
+    if start:
+        allocations = allocations.filter(payment__timestamp__date__gte=start)
+        rows = rows.filter(date__gte=start)
+    if end:
+        allocations = allocations.filter(payment__timestamp__date__lte=end)
+        rows = rows.filter(date__lte=end)
+
+    totals = {}
+    for row in allocations.filter(payment__refunded_amount=0).values(
+        mode=F('payment__mode'),
+        day=TruncDate('payment__timestamp'),
+        dept=F('payment__invoice__student__dept'),
+        component=F('invoice_component__component_name'),
+    ).annotate(total=Sum('amount_allocated'), count=Count('id')).order_by().iterator():
+        totals[row['day'], row['mode'], row['dept'], row['component']] = (to_paise(row['total']), row['count'])
+
+    # Partially refunded payments are few; their refunds are spread over allocations as add_component_collections does
+    refunded = list(allocations.exclude(payment__refunded_amount=0).select_related(
+        'payment__invoice__student', 'invoice_component'
+    ))
+    payments = {}
+    for allocation in refunded:
+        allocation.payment = payments.setdefault(allocation.payment_id, allocation.payment)
+    for allocation, paise in net_allocations(refunded):
+        payment = allocation.payment
+        key = (timezone.localdate(payment.timestamp), payment.mode, payment.invoice.student.dept,
+               allocation.invoice_component.component_name)
+        amount, count = totals.get(key, (0, 0))
+        totals[key] = (amount + paise, count + 1)
+
+    with transaction.atomic():
+        rows.delete()
+        created = ComponentCollection.objects.bulk_create(
+            ComponentCollection(
+                date=day, mode=mode, dept=dept, component_name=component_name, amount=amount, allocation_count=count,
+            )
+            for (day, mode, dept, component_name), (amount, count) in totals.items()
+        )
+    return len(created)
+
+
+# Invoice cube
+
+STUDENT_DIMENSIONS = ('dept', 'semester', 'batch', 'admission_mode')
+INVOICE_DIMENSIONS = ('academic_year', 'invoice_semester', 'status')
+CUBE_DIMENSIONS = STUDENT_DIMENSIONS + INVOICE_DIMENSIONS
+CUBE_MEASURES = ('invoice_count', 'total_amount', 'paid_amount', 'balance_amount')
+
+# Cube dimensions read from an invoice queryset; aliases must not clash with Invoice fields
+_CUBE_SOURCES = {
+    'cube_dept': F('student__dept'),
+    'cube_semester': F('student__semester'),
+    'cube_batch': Coalesce('student__batch', Value(''), output_field=CharField()),
+    'cube_admission_mode': Coalesce('student__admission_mode', Value(''), output_field=CharField()),
+    'cube_academic_year': F('academic_year'),
+    'cube_invoice_semester': Coalesce('semester', Value(0), output_field=IntegerField()),
+    'cube_status': F('status'),
+}
+
+
+def cube_cells(invoices):
+    """Group an invoice queryset into (cell, measures) pairs"""
+    rows = invoices.values(**_CUBE_SOURCES).annotate(
+        cube_invoice_count=Count('id'),
+        cube_total_amount=Sum('total_amount'),
+        cube_paid_amount=Sum('paid_amount'),
+        cube_balance_amount=Sum('balance_amount'),
+    ).order_by()
+    return [
+        ({dim: row[f'cube_{dim}'] for dim in CUBE_DIMENSIONS},
+         {measure: row[f'cube_{measure}'] for measure in CUBE_MEASURES})
+        for row in rows
+    ]
+
+
+def _add_cells(cells, sign=1, **dimensions):
+    """Add (or with sign=-1 subtract) cells, optionally overriding some dimensions"""
+    for cell, measures in cells:
+        if not any(measures.values()):
+            continue
+        _upsert(InvoiceCube, dict(cell, **dimensions), **{
+            measure: value * sign for measure, value in measures.items()
+        })
+
+
+def student_cube_dimensions(values):
+    """Normalize a student's dept, semester, batch and admission mode to cube dimensions"""
+    return {
+        'dept': values['dept'],
+        'semester': int(values['semester']),
+        'batch': values['batch'] or '',
+        'admission_mode': values['admission_mode'] or '',
+    }
+
+
+def _student_dimensions(student_id):
+    row = StudentProfile.objects.filter(pk=student_id).values(*STUDENT_DIMENSIONS).first()
+    return student_cube_dimensions(row) if row else None
+
+
+def _invoice_state(invoice):
+    return (
+        invoice.student_id, invoice.academic_year, invoice.semester or 0, invoice.status,
+        Decimal(str(invoice.total_amount)), Decimal(str(invoice.paid_amount)), Decimal(str(invoice.balance_amount)),
+    )
+
+
+def sync_invoice_cube(old, new):
+    """
+    Keep the cube in step with a saved or deleted invoice
+
+    `old` is the invoice as stored before the save (None when it was just
+    created) and `new` the saved invoice (None when it was deleted).
+    """
+    old_state = _invoice_state(old) if old is not None else None
+    new_state = _invoice_state(new) if new is not None else None
+    if old_state == new_state:
+        return
+    dimensions = {}
+    for state, sign in ((old_state, -1), (new_state, 1)):
+        if state is None:
+            continue
+        student_id, academic_year, invoice_semester, status, total, paid, balance = state
+        if student_id not in dimensions:
+            dimensions[student_id] = _student_dimensions(student_id)
+        if dimensions[student_id] is None:
+            continue
+        cell = dict(dimensions[student_id], academic_year=academic_year, invoice_semester=invoice_semester, status=status)
+        _add_cells([(cell, {
+            'invoice_count': 1, 'total_amount': total, 'paid_amount': paid, 'balance_amount': balance,
+        })], sign)
+
+
+def move_student_in_cube(student_id, old_dimensions, new_dimensions):
+    """Move a student's invoices to new cube cells after their dept, semester, batch or admission mode changed"""
+    if old_dimensions == new_dimensions:
+        return
+    cells = cube_cells(Invoice.objects.filter(student_id=student_id))
+    _add_cells(cells, -1, **old_dimensions)
+    _add_cells(cells, 1, **new_dimensions)
+
+
+@contextmanager
+def tracking_invoice_cube(invoice_ids):
+    """
+    Apply the cube delta of a bulk update that bypasses signals
+
+        with tracking_invoice_cube(ids):
+            Invoice.objects.filter(pk__in=ids).update(status='overdue')
+
+    The invoices' cells are summed before and after the block and only the
+    difference is written to the cube.
+    """
+    with _tracking_cube(Invoice.objects.filter(pk__in=list(invoice_ids))):
+        yield
+
+
+@contextmanager
+def tracking_student_cube(student_ids):
+    """
+    Apply the cube delta of bulk writes to students and their invoices
+
+    Like tracking_invoice_cube, but over every invoice of the students, so
+    invoices bulk-created in the block and students whose dept, semester,
+    batch or admission mode was updated in bulk are both accounted for.
+    """
+    with _tracking_cube(Invoice.objects.filter(student_id__in=list(student_ids))):
+        yield
+
+
+@contextmanager
+def _tracking_cube(invoices):
+    before = cube_cells(invoices)
+    yield
+    after = cube_cells(invoices)
+
+    net = {}
+    for cells, sign in ((before, -1), (after, 1)):
+        for cell, measures in cells:
+            key = tuple(cell[dim] for dim in CUBE_DIMENSIONS)
+            totals = net.setdefault(key, (cell, dict.fromkeys(CUBE_MEASURES, 0)))[1]
+            for measure, value in measures.items():
+                totals[measure] += value * sign
+    _add_cells(net.values())
+
+
+def rebuild_invoice_cube():
+    """Recompute the whole cube from the invoices table"""
+    with transaction.atomic():
+        InvoiceCube.objects.all().delete()
+        created = InvoiceCube.objects.bulk_create(
+            InvoiceCube(**cell, **measures) for cell, measures in cube_cells(Invoice.objects.all())
+        )
+    return len(created)
@@ -1,6 +1,20 @@
 from rest_framework import serializers
 from .models import User
-from .models import StudentProfile, Notification, FeeComponent, FeeTemplate, FeeTemplateComponent, FeeAssignment
+from .models import StudentProfile, Notification, FeeComponent, FeeTemplate, FeeTemplateComponent, FeeAssignment, LedgerEntry
+from .money import parse_paise, to_rupees
+
+class PaiseAmountField(serializers.Field):
+    """Amount kept in paise (a PaiseField or integer math), read and written as rupees"""
+    default_error_messages = {'invalid': 'Enter an amount in rupees.'}
+
+    def to_representation(self, value):
+        return to_rupees(value)
+
+    def to_internal_value(self, data):
+        try:
+            return parse_paise(data)
+        except ValueError:
+            self.fail('invalid')
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -72,3 +86,37 @@ class FeeAssignmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = FeeAssignment
         fields = ('id', 'student', 'template', 'academic_year', 'overrides')
+
+    def validate_overrides(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('Map fee component ids to amounts.')
+        for component_id, amount in value.items():
+            if not str(component_id).isdigit():
+                raise serializers.ValidationError(f'{component_id} is not a fee component id.')
+            try:
+                parse_paise(amount)
+            except ValueError:
+                raise serializers.ValidationError(f'Invalid amount for component {component_id}.')
+        return value
+
+    # Overrides are stored as FeeAssignmentOverride rows, mirrored back into the JSON field
+    def create(self, validated_data):
+        overrides = validated_data.pop('overrides', None)
+        assignment = super().create(validated_data)
+        if overrides:
+            assignment.set_overrides(overrides)
+        return assignment
+
+    def update(self, instance, validated_data):
+        overrides = validated_data.pop('overrides', None)
+        assignment = super().update(instance, validated_data)
+        if overrides is not None:
+            assignment.set_overrides(overrides)
+        return assignment
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    amount = PaiseAmountField()
+
+    class Meta:
+        model = LedgerEntry
+        fields = ('id', 'kind', 'debit_account', 'credit_account', 'amount', 'memo', 'payment', 'posted_by', 'posted_at')
@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import timedelta
+from importlib.util import find_spec
 
 load_dotenv()
 
@@ -48,6 +49,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 # CSRF settings
@@ -74,6 +76,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'backend.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +113,94 @@ DATABASES = {
     }
 }
 
+# Response compression (see backend.middleware.CompressionMiddleware)
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+RESPONSE_COMPRESSION_GZIP_LEVEL = 6
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
+
+# Cache configuration
+# Caches that are invalidated on writes must be shared by every worker, or a
+# write handled by one worker leaves the others serving stale entries. 'file'
+# is shared by the workers of one host; use 'redis' (CACHE_REDIS_URL) or 'db'
+# (after `python manage.py createcachetable`) when running on several hosts.
+# 'locmem' is per process and only suits a single worker, so its entries are
+# kept briefly. Any other Django cache backend can be given by its dotted path.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/1')
+LOCMEM_CACHE_TIMEOUT = 60
+
+
+def cache_config(backend, name, timeout, location=None):
+    """CACHES entry named `name` for one of CACHE_BACKENDS (or a dotted backend path)"""
+    if not location:
+        location = {
+            'file': str(BASE_DIR / 'cache' / name),
+            'db': f'cache_{name}',
+            'redis': CACHE_REDIS_URL,
+        }.get(backend, name)
+    return {
+        'BACKEND': CACHE_BACKENDS.get(backend, backend),
+        'LOCATION': location,
+        'TIMEOUT': min(timeout, LOCMEM_CACHE_TIMEOUT) if backend == 'locmem' else timeout,
+        'KEY_PREFIX': name if backend == 'redis' else '',
+    }
+
+
+FEE_CATALOG_CACHE_BACKEND = os.getenv('FEE_CATALOG_CACHE_BACKEND', 'file')
+DASHBOARD_CACHE_BACKEND = os.getenv('DASHBOARD_CACHE_BACKEND', 'file')
+THROTTLE_CACHE_BACKEND = os.getenv('THROTTLE_CACHE_BACKEND', 'file')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+    'fee_catalog': cache_config(
+        FEE_CATALOG_CACHE_BACKEND, 'fee_catalog', 60 * 60 * 24, os.getenv('FEE_CATALOG_CACHE_LOCATION')
+    ),
+    # Student dashboards, expired on writes by any worker (see backend.caching)
+    'dashboards': {
+        **cache_config(DASHBOARD_CACHE_BACKEND, 'dashboards', 60 * 10, os.getenv('DASHBOARD_CACHE_LOCATION')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+    # Rate limit counters, counted across workers (see backend.throttling)
+    'throttle': {
+        **cache_config(THROTTLE_CACHE_BACKEND, 'throttle', 60 * 60, os.getenv('THROTTLE_CACHE_LOCATION')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+
+# Columnar analytics snapshot (see backend.analytics), rebuilt by refresh_analytics_snapshot
+ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', str(BASE_DIR / 'analytics'))
+ANALYTICS_SNAPSHOTS_KEPT = 2
+
+# How long responses of requests sent with an Idempotency-Key header are replayed
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+
+# Fee ledger snapshots (see backend.ledger), taken by snapshot_ledger
+LEDGER_SNAPSHOTS_KEPT = int(os.getenv('LEDGER_SNAPSHOTS_KEPT', 35))
+LEDGER_SNAPSHOT_LAG_MINUTES = 5
+
+# Bulk student onboarding (see backend.onboarding)
+STUDENT_INVITE_TTL_DAYS = 14
+ONBOARDING_HASH_WORKERS = int(os.getenv('ONBOARDING_HASH_WORKERS', os.cpu_count() or 1))
+
+# Semester rollover (see backend.rollover)
+ROLLOVER_FINAL_SEMESTER = 8  # Students in it graduate instead of being promoted
+ROLLOVER_SKIPPED_STATUSES = ('dropout', 'yearback', 'backlog')  # Neither promoted nor billed
+ROLLOVER_DUE_DAYS = 30
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -141,9 +232,22 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ) + (('backend.renderers.MessagePackRenderer',) if find_spec('msgpack') else ()),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'EXCEPTION_HANDLER': 'backend.throttling.exception_handler',
+    # Sliding-window limits of backend.throttling, counted in the default cache
+    'DEFAULT_THROTTLE_RATES': {
+        'checkout': os.getenv('THROTTLE_CHECKOUT_RATE', '5/5m'),
+        'component_payment': os.getenv('THROTTLE_COMPONENT_PAYMENT_RATE', '5/5m'),
+        'cart_checkout': os.getenv('THROTTLE_CART_CHECKOUT_RATE', '5/5m'),
+        'login': os.getenv('THROTTLE_LOGIN_RATE', '10/15m'),
+        'campus': os.getenv('THROTTLE_CAMPUS_RATE', '120/m'),
+    },
 }
 
 SIMPLE_JWT = {
@@ -153,6 +257,8 @@ SIMPLE_JWT = {
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_CHECKOUT_SESSION_MINUTES = 30  # Stripe allows 30 minutes to 24 hours
+STRIPE_CHECKOUT_REUSE_MIN_MINUTES = 5  # Open sessions closer to expiry are not handed out again
 
 AUTH_USER_MODEL = 'backend.User'
 
@@ -198,9 +304,22 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ) + (('backend.renderers.MessagePackRenderer',) if find_spec('msgpack') else ()),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'EXCEPTION_HANDLER': 'backend.throttling.exception_handler',
+    # Sliding-window limits of backend.throttling, counted in the default cache
+    'DEFAULT_THROTTLE_RATES': {
+        'checkout': os.getenv('THROTTLE_CHECKOUT_RATE', '5/5m'),
+        'component_payment': os.getenv('THROTTLE_COMPONENT_PAYMENT_RATE', '5/5m'),
+        'cart_checkout': os.getenv('THROTTLE_CART_CHECKOUT_RATE', '5/5m'),
+        'login': os.getenv('THROTTLE_LOGIN_RATE', '10/15m'),
+        'campus': os.getenv('THROTTLE_CAMPUS_RATE', '120/m'),
+    },
 }
 
 SIMPLE_JWT = {
@@ -210,6 +329,8 @@ SIMPLE_JWT = {
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_CHECKOUT_SESSION_MINUTES = 30  # Stripe allows 30 minutes to 24 hours
+STRIPE_CHECKOUT_REUSE_MIN_MINUTES = 5  # Open sessions closer to expiry are not handed out again
 
 AUTH_USER_MODEL = 'backend.User'
 
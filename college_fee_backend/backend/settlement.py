@@ -0,0 +1,136 @@
+from django.db import transaction
+from .ledger import post
+from .models import Invoice, InvoiceComponent, Payment, PaymentComponent
+from .money import to_paise, to_rupees
+
+
+# Payments a paid checkout session may still settle
+SETTLEABLE_STATUSES = ('pending', 'expired')
+
+
+def invoice_status(invoice):
+    return 'paid' if invoice.balance_amount <= 0 else 'partial'
+
+
+def apply_paid(row, paise):
+    """Move `paise` of an invoice's or component's balance to its paid amount, in memory"""
+    row.paid_amount = to_rupees(to_paise(row.paid_amount) + paise)
+    row.balance_amount = to_rupees(to_paise(row.balance_amount) - paise)
+
+
+def allocate_in_order(payment, components, amount):
+    """
+    Spread `amount` paise of a payment over the open components in the given order
+
+    Component balances are updated in memory; returns the unsaved
+    PaymentComponent rows and the paise left unallocated.
+    """
+    allocations = []
+    remaining = amount
+    for component in components:
+        if remaining <= 0:
+            break
+        balance = to_paise(component.balance_amount)
+        if balance <= 0:
+            continue
+        allocated = min(remaining, balance)
+        apply_paid(component, allocated)
+        allocations.append(PaymentComponent(
+            payment=payment, invoice_component=component, amount_allocated=to_rupees(allocated)
+        ))
+        remaining -= allocated
+    return allocations, remaining
+
+
+def settle_payments(payments):
+    """
+    Mark pending payments successful and apply them to their invoices and components
+
+    The payments may span several invoices, as with a cart checkout. They are
+    applied in one transaction with the payments, invoices and components
+    locked, and payments that are no longer pending are skipped, so a replayed
+    webhook never applies a payment twice. Expired payments are settled too:
+    the checkout reaper may expire a payment locally whose session was paid
+    before its webhook arrived. Component payments keep the
+    allocations chosen at checkout; other payments are spread over the
+    invoice's open components in order. Returns the payments settled, each
+    with its invoice attached.
+    """
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(pk__in=[payment.pk for payment in payments], status__in=SETTLEABLE_STATUSES)
+            .order_by('id')
+        )
+        if not payments:
+            return []
+        invoice_ids = {payment.invoice_id for payment in payments}
+        invoices = Invoice.objects.select_for_update().in_bulk(invoice_ids)
+        open_components = {}
+        components = {}
+        for component in InvoiceComponent.objects.select_for_update().filter(invoice_id__in=invoice_ids).order_by('id'):
+            components[component.pk] = component
+            open_components.setdefault(component.invoice_id, []).append(component)
+        chosen = {}
+        for allocation in PaymentComponent.objects.filter(payment__in=payments).order_by('id'):
+            chosen.setdefault(allocation.payment_id, []).append(allocation)
+
+        # Amounts are summed in paise and written back to the rupee columns once
+        new_allocations = []
+        paid = dict.fromkeys(invoices, 0)
+        for payment in payments:
+            amount = to_paise(payment.amount)
+            if payment.pk in chosen:
+                remaining = amount
+                for allocation in chosen[payment.pk]:
+                    allocated = min(remaining, to_paise(allocation.amount_allocated))
+                    allocation.amount_allocated = to_rupees(allocated)
+                    apply_paid(components[allocation.invoice_component_id], allocated)
+                    remaining -= allocated
+            else:
+                new_allocations += allocate_in_order(payment, open_components.get(payment.invoice_id, []), amount)[0]
+            paid[payment.invoice_id] += amount
+            payment.invoice = invoices[payment.invoice_id]
+            payment.status = 'success'
+        for invoice_id, amount in paid.items():
+            apply_paid(invoices[invoice_id], amount)
+            invoices[invoice_id].status = invoice_status(invoices[invoice_id])
+
+        InvoiceComponent.objects.bulk_update(components.values(), ['paid_amount', 'balance_amount'])
+        PaymentComponent.objects.bulk_update(
+            [allocation for allocations in chosen.values() for allocation in allocations], ['amount_allocated']
+        )
+        PaymentComponent.objects.bulk_create(new_allocations)
+        # Saved one by one so the signals keep the collection rollup, cube and dashboards in step
+        for payment in payments:
+            payment.save(update_fields=['status'])
+        for invoice in invoices.values():
+            invoice.save()
+    return payments
+
+
+def reverse_payment(payment):
+    """
+    Take a successful payment that is being deleted back out of its invoice and the ledger
+
+    What is left of the payment after partial refunds is posted as a
+    reversing payment entry and returned to the invoice's balance, and its
+    component allocations to the component balances. Called before the
+    payment and its allocations are deleted.
+    """
+    amount = to_paise(payment.amount) - to_paise(payment.refunded_amount)
+    with transaction.atomic():
+        invoice = Invoice.objects.select_for_update().filter(pk=payment.invoice_id).first()
+        if invoice is None:
+            return
+        allocations = list(PaymentComponent.objects.filter(payment_id=payment.pk))
+        components = InvoiceComponent.objects.select_for_update().in_bulk(
+            {allocation.invoice_component_id for allocation in allocations}
+        )
+        for allocation in allocations:
+            apply_paid(components[allocation.invoice_component_id], -to_paise(allocation.amount_allocated))
+        InvoiceComponent.objects.bulk_update(components.values(), ['paid_amount', 'balance_amount'])
+        apply_paid(invoice, -amount)
+        invoice.status = invoice_status(invoice) if to_paise(invoice.paid_amount) > 0 else 'pending'
+        invoice.save()
+        post('payment', invoice, -amount, memo=f"Payment {payment.payment_reference} deleted")
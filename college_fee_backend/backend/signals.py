@@ -0,0 +1,139 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    StudentProfile, FeeComponent, FeeTemplate, FeeTemplateComponent, FeeAssignment,
+    Invoice, Payment, Notification, CustomFeeStructure
+)
+from .caching import invalidate_fee_catalog, invalidate_student_dashboards
+from .ledger import sync_invoice_ledger, sync_payment_ledger
+from .settlement import reverse_payment
+from .rollups import (
+    STUDENT_DIMENSIONS, add_component_collection, sync_payment_collection, sync_invoice_cube, move_student_in_cube,
+    student_cube_dimensions
+)
+
+
+@receiver([post_save, post_delete], sender=FeeComponent)
+@receiver([post_save, post_delete], sender=FeeTemplate)
+@receiver([post_save, post_delete], sender=FeeTemplateComponent)
+def fee_catalog_changed(sender, **kwargs):
+    invalidate_fee_catalog()
+
+
+def _student_user_id(student_id):
+    return StudentProfile.objects.filter(pk=student_id).values_list('user_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=StudentProfile)
+def student_profile_changed(sender, instance, **kwargs):
+    invalidate_student_dashboards([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Notification)
+def notification_changed(sender, instance, **kwargs):
+    invalidate_student_dashboards([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Invoice)
+@receiver([post_save, post_delete], sender=FeeAssignment)
+@receiver([post_save, post_delete], sender=CustomFeeStructure)
+def student_fees_changed(sender, instance, **kwargs):
+    student = instance._state.fields_cache.get('student')
+    user_id = student.user_id if student else _student_user_id(instance.student_id)
+    invalidate_student_dashboards([user_id])
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    user_id = Invoice.objects.filter(pk=instance.invoice_id).values_list('student__user_id', flat=True).first()
+    invalidate_student_dashboards([user_id])
+
+
+@receiver(pre_save, sender=Payment)
+def payment_fetch_stored_state(sender, instance, raw=False, **kwargs):
+    # The stored row, so post_save can move the payment between rollup buckets
+    instance._stored_payment = None
+    if instance.pk and not raw:
+        instance._stored_payment = Payment.objects.filter(pk=instance.pk).only(
+            'invoice_id', 'amount', 'refunded_amount', 'mode', 'status', 'timestamp'
+        ).first()
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved_update_rollups(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_payment_collection(getattr(instance, '_stored_payment', None), instance)
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved_post_ledger(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_payment_ledger(getattr(instance, '_stored_payment', None), instance)
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_deleting_update_component_rollup(sender, instance, **kwargs):
+    # The stored row, since the instance being deleted may be stale; its
+    # allocations are deleted along with it, so they are taken out here
+    instance._stored_payment = Payment.objects.filter(pk=instance.pk).only(
+        'invoice_id', 'amount', 'refunded_amount', 'mode', 'status', 'timestamp', 'payment_reference'
+    ).first()
+    if instance._stored_payment is not None and instance._stored_payment.status == 'success':
+        add_component_collection(instance._stored_payment, -1)
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_deleting_reverse(sender, instance, **kwargs):
+    # The ledger is append-only, so a deleted payment is reversed rather than erased
+    stored = getattr(instance, '_stored_payment', None)
+    if stored is not None and stored.status == 'success':
+        reverse_payment(stored)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted_update_rollups(sender, instance, **kwargs):
+    sync_payment_collection(getattr(instance, '_stored_payment', instance), None)
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_fetch_stored_state(sender, instance, raw=False, **kwargs):
+    instance._stored_invoice = None
+    if instance.pk and not raw:
+        instance._stored_invoice = Invoice.objects.filter(pk=instance.pk).only(
+            'student_id', 'academic_year', 'semester', 'status', 'total_amount', 'paid_amount', 'balance_amount'
+        ).first()
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved_update_cube(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_invoice_cube(getattr(instance, '_stored_invoice', None), instance)
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved_post_ledger(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_invoice_ledger(getattr(instance, '_stored_invoice', None), instance)
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted_update_cube(sender, instance, **kwargs):
+    sync_invoice_cube(instance, None)
+
+
+@receiver(pre_save, sender=StudentProfile)
+def student_fetch_stored_dimensions(sender, instance, raw=False, **kwargs):
+    instance._stored_dimensions = None
+    if instance.pk and not raw:
+        stored = StudentProfile.objects.filter(pk=instance.pk).values(*STUDENT_DIMENSIONS).first()
+        instance._stored_dimensions = student_cube_dimensions(stored) if stored else None
+
+
+@receiver(post_save, sender=StudentProfile)
+def student_saved_update_cube(sender, instance, raw=False, **kwargs):
+    old_dimensions = getattr(instance, '_stored_dimensions', None)
+    if raw or old_dimensions is None:
+        return
+    new_dimensions = student_cube_dimensions({dim: getattr(instance, dim) for dim in STUDENT_DIMENSIONS})
+    move_student_in_cube(instance.pk, old_dimensions, new_dimensions)
@@ -0,0 +1,219 @@
+import time
+import numpy as np
+from .caching import get_fee_components, get_fee_templates
+from .models import FeeAssignment, FeeAssignmentOverride, StudentProfile
+from .money import PAISE_PER_RUPEE
+
+# Student attributes a rule can be restricted to, and the ways it changes a component
+RULE_FILTERS = ('dept', 'admission_mode', 'semester', 'batch')
+RULE_ACTIONS = ('percent', 'amount', 'set')
+
+
+def _as_list(value):
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def _parse_rules(raw_rules, components):
+    """
+    Validate revision rules against the component catalog
+
+    A rule names a component by `component_id` or `component` (its name), or
+    applies to every component when neither is given, and carries exactly one
+    of `percent` (relative change), `amount` (added to the fee) or `set` (new
+    fee). RULE_FILTERS restrict it to matching students. Raises ValueError.
+    """
+    if not isinstance(raw_rules, list) or not raw_rules:
+        raise ValueError('rules must be a non-empty list')
+    by_id = {component['id']: index for index, component in enumerate(components)}
+    by_name = {component['name'].strip().lower(): index for index, component in enumerate(components)}
+
+    rules = []
+    for number, raw in enumerate(raw_rules, start=1):
+        if not isinstance(raw, dict):
+            raise ValueError(f'Rule {number} must be an object')
+        if 'component_id' in raw:
+            try:
+                columns = [by_id[int(raw['component_id'])]]
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Rule {number}: unknown component_id {raw['component_id']}")
+        elif 'component' in raw:
+            name = str(raw['component']).strip().lower()
+            if name not in by_name:
+                raise ValueError(f"Rule {number}: unknown component '{raw['component']}'")
+            columns = [by_name[name]]
+        else:
+            columns = list(range(len(components)))
+
+        actions = [action for action in RULE_ACTIONS if action in raw]
+        if len(actions) != 1:
+            raise ValueError(f"Rule {number}: give exactly one of {', '.join(RULE_ACTIONS)}")
+        try:
+            value = float(raw[actions[0]])
+        except (TypeError, ValueError):
+            raise ValueError(f'Rule {number}: {actions[0]} must be a number')
+
+        filters = {name: _as_list(raw[name]) for name in RULE_FILTERS if raw.get(name) not in (None, '', [])}
+        rules.append({'columns': columns, 'action': actions[0], 'value': value, 'filters': filters})
+    return rules
+
+
+def _resolve_templates(templates, modes, depts, mode_codes, dept_codes):
+    """
+    Template index per student for students without an assignment
+
+    Mirrors bulk assignment: a template for the student's admission mode and
+    department, else one for the admission mode with no department.
+    """
+    resolved = np.full(len(mode_codes), -1, dtype=np.int64)
+    by_mode_dept = {}
+    for index, template in enumerate(templates):
+        key = (template['admission_mode'] or '', template['dept'] or '')
+        by_mode_dept.setdefault(key, index)
+    for mode_index, mode in enumerate(modes):
+        for dept_index, dept in enumerate(depts):
+            index = by_mode_dept.get((mode, dept), by_mode_dept.get((mode, '')))
+            if index is not None:
+                resolved[(mode_codes == mode_index) & (dept_codes == dept_index)] = index
+    return resolved
+
+
+def _grouped(labels, codes, baseline, projected, counts_mask):
+    students = np.bincount(codes, weights=counts_mask, minlength=len(labels))
+    base = np.bincount(codes, weights=baseline, minlength=len(labels))
+    proj = np.bincount(codes, weights=projected, minlength=len(labels))
+    return [
+        dict(label, students=int(count), baseline=round(b, 2), projected=round(p, 2), delta=round(p - b, 2))
+        for label, count, b, p in zip(labels, students.tolist(), base.tolist(), proj.tolist())
+        if count
+    ]
+
+
+def _encode(values):
+    """Category labels and per-row codes of a column"""
+    if not values:
+        return [], np.array([], dtype=np.int64)
+    labels, codes = np.unique(np.array(values), return_inverse=True)
+    return labels.tolist(), codes.reshape(-1)
+
+
+def simulate_fee_revision(raw_rules, academic_year, include_unassigned=True):
+    """
+    Project revenue for active students under revised fee components
+
+    Each student's baseline is their active assignment's template for
+    `academic_year` with its per-component overrides, or with
+    `include_unassigned` the template bulk assignment would pick. Rules are
+    applied in order to the whole student x component fee matrix at once.
+    Raises ValueError for invalid rules.
+    """
+    started = time.perf_counter()
+    components = get_fee_components()
+    rules = _parse_rules(raw_rules, components)
+    column_of = {component['id']: index for index, component in enumerate(components)}
+
+    templates = [
+        template for template in get_fee_templates().values()
+        if template['academic_year'] == academic_year and template['is_active']
+    ]
+    template_of = {template['id']: index for index, template in enumerate(templates)}
+    no_template = len(templates)
+
+    # Template x component fee matrix; the extra last row is "no template"
+    fees = np.zeros((len(templates) + 1, len(components)))
+    present = np.zeros(fees.shape, dtype=bool)
+    for row, template in enumerate(templates):
+        for component in template['components']:
+            fees[row, column_of[component['component_id']]] = float(component['amount'])
+            present[row, column_of[component['component_id']]] = True
+
+    students = list(StudentProfile.objects.filter(is_active=True).order_by('id').values_list('id', *RULE_FILTERS))
+    ids = np.array([student[0] for student in students], dtype=np.int64)
+    attributes = {
+        name: _encode(['' if student[position] is None else str(student[position]) for student in students])
+        for position, name in enumerate(RULE_FILTERS, start=1)
+    }
+
+    # Assigned template and overrides per student
+    template_index = np.full(len(students), no_template, dtype=np.int64)
+    assigned = np.zeros(len(students), dtype=bool)
+    assignments = list(FeeAssignment.objects.filter(
+        academic_year=academic_year, is_active=True, student__is_active=True
+    ).values_list('student_id', 'template_id'))
+    positions = np.searchsorted(ids, np.array([a[0] for a in assignments], dtype=np.int64))
+    if assignments:
+        template_index[positions] = [template_of.get(a[1], no_template) for a in assignments]
+        assigned[positions] = True
+    if include_unassigned:
+        resolved = _resolve_templates(
+            templates, attributes['admission_mode'][0], attributes['dept'][0],
+            attributes['admission_mode'][1], attributes['dept'][1],
+        )
+        fill = ~assigned & (resolved >= 0)
+        template_index[fill] = resolved[fill]
+
+    baseline = fees[template_index]
+    has_component = present[template_index]
+    overrides = list(FeeAssignmentOverride.objects.filter(
+        assignment__academic_year=academic_year, assignment__is_active=True, assignment__student__is_active=True
+    ).values_list('assignment__student_id', 'component_id', 'amount'))
+    if overrides:
+        rows = np.searchsorted(ids, np.array([o[0] for o in overrides], dtype=np.int64))
+        columns = np.array([column_of.get(o[1], -1) for o in overrides], dtype=np.int64)
+        amounts = np.array([o[2] for o in overrides], dtype=np.float64) / PAISE_PER_RUPEE
+        known = columns >= 0
+        baseline[rows[known], columns[known]] = amounts[known]
+        has_component[rows[known], columns[known]] = True
+
+    projected = baseline.copy()
+    for rule in rules:
+        mask = np.ones(len(students), dtype=bool)
+        for name, values in rule['filters'].items():
+            labels, codes = attributes[name]
+            mask &= np.isin(codes, [labels.index(str(v)) for v in values if str(v) in labels])
+        grid = np.ix_(np.flatnonzero(mask), rule['columns'])
+        block, applies = projected[grid], has_component[grid]
+        if rule['action'] == 'percent':
+            changed = block * (1 + rule['value'] / 100)
+        elif rule['action'] == 'amount':
+            changed = block + rule['value']
+        else:
+            changed = np.full(block.shape, rule['value'])
+        projected[grid] = np.where(applies, changed, block)
+    np.maximum(projected, 0, out=projected)
+
+    baseline_totals = baseline.sum(axis=1)
+    projected_totals = projected.sum(axis=1)
+    billed = has_component.any(axis=1).astype(np.float64)
+    dept_labels, dept_codes = attributes['dept']
+    mode_labels, mode_codes = attributes['admission_mode']
+    baseline_revenue = float(baseline_totals.sum())
+    projected_revenue = float(projected_totals.sum())
+
+    return {
+        'academic_year': academic_year,
+        'students': int(billed.sum()),
+        'students_without_template': int(len(students) - billed.sum()),
+        'baseline_revenue': round(baseline_revenue, 2),
+        'projected_revenue': round(projected_revenue, 2),
+        'delta': round(projected_revenue - baseline_revenue, 2),
+        'delta_percent': round((projected_revenue / baseline_revenue - 1) * 100, 2) if baseline_revenue else None,
+        'by_dept': _grouped(
+            [{'dept': dept} for dept in dept_labels], dept_codes, baseline_totals, projected_totals, billed
+        ),
+        'by_admission_mode': _grouped(
+            [{'admission_mode': mode} for mode in mode_labels], mode_codes, baseline_totals, projected_totals, billed
+        ),
+        'by_dept_and_mode': _grouped(
+            [{'dept': dept, 'admission_mode': mode} for dept in dept_labels for mode in mode_labels],
+            dept_codes * len(mode_labels) + mode_codes, baseline_totals, projected_totals, billed
+        ),
+        'by_component': [
+            {
+                'component_id': component['id'], 'name': component['name'],
+                'baseline': round(b, 2), 'projected': round(p, 2), 'delta': round(p - b, 2),
+            }
+            for component, b, p in zip(components, baseline.sum(axis=0).tolist(), projected.sum(axis=0).tolist())
+            if b or p
+        ],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -4,13 +4,39 @@ from django.conf import settings
 import os
 import logging
 import time
+from .money import to_paise
 
 logger = logging.getLogger(__name__)
 
 # Set Stripe API key
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
-def create_checkout_session(invoice_id, amount, student_info=None, description=None, metadata=None):
+def _create_session(session_params, student_info=None, customer_id=None):
+    """Create a checkout session, reusing the student's Stripe customer when known"""
+    # Customer information for better tracking; a known customer is reused
+    # instead of creating a new one on every checkout
+    customer_info = {}
+    if customer_id:
+        customer_info = {'customer': customer_id}
+    elif student_info:
+        customer_info = {
+            'customer_email': student_info.get('email'),
+            'customer_creation': 'always',
+        }
+    try:
+        return stripe.checkout.Session.create(**session_params, **customer_info)
+    except stripe.error.InvalidRequestError as e:
+        if not customer_id or e.param != 'customer':
+            raise
+        # The stored customer was deleted in Stripe; let checkout create a new one
+        logger.warning(f"Stripe customer {customer_id} is no longer valid, creating a new one")
+        return stripe.checkout.Session.create(
+            **session_params,
+            customer_email=student_info.get('email') if student_info else None,
+            customer_creation='always'
+        )
+
+def create_checkout_session(invoice_id, amount, student_info=None, description=None, metadata=None, customer_id=None):
     """
     Create a Stripe checkout session for fee payment
     
@@ -20,6 +46,7 @@ def create_checkout_session(invoice_id, amount, student_info=None, description=N
         student_info: Dictionary containing student information (optional)
         description: Custom description for the payment (optional)
         metadata: Additional metadata dictionary (optional)
+        customer_id: Stripe customer of the student, skipping customer creation (optional)
     
     Returns:
         Stripe checkout session object
@@ -28,18 +55,10 @@ def create_checkout_session(invoice_id, amount, student_info=None, description=N
         # Get frontend URL from environment or use default
         FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:8080')
         
-        # Customer information for better tracking
-        customer_info = {}
-        if student_info:
-            customer_info = {
-                'customer_email': student_info.get('email'),
-                'customer_creation': 'always',
-            }
-        
         # Use custom description if provided, otherwise use default
         payment_description = description or f"Fee payment for {student_info.get('name', 'Student')} - {student_info.get('usn', '')}"
         
-        session = stripe.checkout.Session.create(
+        session = _create_session(dict(
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -53,7 +72,7 @@ def create_checkout_session(invoice_id, amount, student_info=None, description=N
                             'student_name': student_info.get('name', '') if student_info else ''
                         }
                     },
-                    'unit_amount': int(amount * 100),  # Convert to paise
+                    'unit_amount': to_paise(amount),
                 },
                 'quantity': 1,
             }],
@@ -63,15 +82,11 @@ def create_checkout_session(invoice_id, amount, student_info=None, description=N
             metadata={
                 'invoice_id': str(invoice_id),
                 'student_usn': student_info.get('usn', '') if student_info else '',
-                'amount': str(amount)
+                'amount': str(amount),
+                **(metadata or {})
             },
-            expires_at=int((time.time() + 1800)),  # 30 minutes expiry
-            **customer_info
-        )
-        
-        # Add custom metadata if provided
-        if metadata:
-            session.metadata.update(metadata)
+            expires_at=int(time.time() + settings.STRIPE_CHECKOUT_SESSION_MINUTES * 60),
+        ), student_info, customer_id)
         
         logger.info(f"Stripe checkout session created: {session.id} for invoice {invoice_id}")
         return session
@@ -83,6 +98,60 @@ def create_checkout_session(invoice_id, amount, student_info=None, description=N
         logger.error(f"Error creating checkout session: {str(e)}")
         raise Exception(f"Failed to create payment session: {str(e)}")
 
+def create_cart_checkout_session(items, student_info=None, customer_id=None):
+    """
+    Create one Stripe checkout session paying several invoices
+    
+    Args:
+        items: List of dictionaries with invoice_id, invoice_number and amount (rupees)
+        student_info: Dictionary containing student information (optional)
+        customer_id: Stripe customer of the student, skipping customer creation (optional)
+    
+    Returns:
+        Stripe checkout session object
+    """
+    try:
+        FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:8080')
+        invoice_ids = ','.join(str(item['invoice_id']) for item in items)
+        
+        session = _create_session(dict(
+            payment_method_types=['card'],
+            line_items=[{
+                'price_data': {
+                    'currency': 'inr',
+                    'product_data': {
+                        'name': f"College Fee Payment - Invoice {item['invoice_number']}",
+                        'metadata': {
+                            'invoice_id': str(item['invoice_id']),
+                            'student_usn': student_info.get('usn', '') if student_info else '',
+                        }
+                    },
+                    'unit_amount': to_paise(item['amount']),
+                },
+                'quantity': 1,
+            } for item in items],
+            mode='payment',
+            success_url=f'{FRONTEND_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}&invoice_ids={invoice_ids}',
+            cancel_url=f'{FRONTEND_URL}/payment/cancel?invoice_ids={invoice_ids}',
+            metadata={
+                'invoice_ids': invoice_ids,
+                'student_usn': student_info.get('usn', '') if student_info else '',
+                'amount': str(sum(item['amount'] for item in items)),
+                'is_cart': 'true'
+            },
+            expires_at=int(time.time() + settings.STRIPE_CHECKOUT_SESSION_MINUTES * 60),
+        ), student_info, customer_id)
+        
+        logger.info(f"Stripe cart checkout session created: {session.id} for invoices {invoice_ids}")
+        return session
+        
+    except stripe.error.StripeError as e:
+        logger.error(f"Stripe error creating cart checkout session: {str(e)}")
+        raise Exception(f"Payment processing error: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error creating cart checkout session: {str(e)}")
+        raise Exception(f"Failed to create payment session: {str(e)}")
+
 def retrieve_checkout_session(session_id):
     """
     Retrieve a Stripe checkout session
@@ -100,6 +169,27 @@ def retrieve_checkout_session(session_id):
         logger.error(f"Stripe error retrieving session {session_id}: {str(e)}")
         raise Exception(f"Failed to retrieve payment session: {str(e)}")
 
+def iter_checkout_sessions(created_from, created_to=None, page_size=100):
+    """
+    Iterate over the checkout sessions created in a time window
+    
+    Args:
+        created_from: Earliest creation time (datetime)
+        created_to: Creation time to stop before (datetime, optional)
+        page_size: Sessions fetched per API request (at most 100)
+    
+    Returns:
+        Iterator of Stripe session objects, newest first, fetching pages as it goes
+    """
+    created = {'gte': int(created_from.timestamp())}
+    if created_to:
+        created['lt'] = int(created_to.timestamp())
+    try:
+        return stripe.checkout.Session.list(created=created, limit=page_size).auto_paging_iter()
+    except stripe.error.StripeError as e:
+        logger.error(f"Stripe error listing checkout sessions: {str(e)}")
+        raise Exception(f"Failed to list payment sessions: {str(e)}")
+
 def create_payment_intent(amount, currency='inr', metadata=None):
     """
     Create a Stripe payment intent for advanced payment processing
@@ -114,7 +204,7 @@ def create_payment_intent(amount, currency='inr', metadata=None):
     """
     try:
         payment_intent = stripe.PaymentIntent.create(
-            amount=int(amount * 100),  # Convert to paise
+            amount=to_paise(amount),
             currency=currency,
             automatic_payment_methods={'enabled': True},
             metadata=metadata or {}
@@ -170,7 +260,7 @@ def create_refund(payment_intent_id, amount=None, reason=None):
         }
         
         if amount:
-            refund_data['amount'] = int(amount * 100)  # Convert to paise
+            refund_data['amount'] = to_paise(amount)
         
         refund = stripe.Refund.create(**refund_data)
         
@@ -0,0 +1,134 @@
+import math
+import re
+import time
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import Throttled
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from rest_framework.views import exception_handler as drf_exception_handler
+
+# '<requests>/<period>' where the period is a unit (s, m, h or d, or a word
+# starting with one such as 'min' or 'hour') with an optional multiplier:
+# '3/5m' allows three requests per five minutes
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])[a-z]*$')
+RATE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """Parse a rate into (requests, seconds)"""
+    match = RATE_PATTERN.match(rate)
+    if not match:
+        raise ImproperlyConfigured(f'Invalid throttle rate {rate!r}')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * RATE_UNITS[unit]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Sliding-window rate limit kept entirely in the cache
+
+    Requests are counted in fixed windows with an atomic cache increment; the
+    rate is estimated from the current window plus the unexpired share of the
+    previous one. No database work and no per-request history list. Counters
+    live in the 'throttle' cache, which every worker must share for the limits
+    to hold across processes; increments are atomic on Redis, while the file
+    backend may drop the odd concurrent one. Subclasses set
+    `scope`, whose rate is read from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'],
+    and implement get_ident_key().
+    """
+    scope = None
+    cache_alias = 'throttle'
+
+    def __init__(self):
+        self.num_requests, self.duration = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[self.scope])
+        self.cache = caches[self.cache_alias]
+        self._wait = None
+
+    def get_ident_key(self, request, view):
+        """Identify the caller; return None to skip throttling the request"""
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def _increment(self, key):
+        # add() is a no-op when the key exists, and incr() is atomic on Redis;
+        # the retry covers a key evicted between the two
+        self.cache.add(key, 0, self.duration * 2)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 1, self.duration * 2)
+            return 1
+
+    def allow_request(self, request, view):
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+
+        now = time.time()
+        window, offset = divmod(now, self.duration)
+        prefix = f'throttle:{self.scope}:{ident}'
+        current = self._increment(f'{prefix}:{int(window)}')
+        previous = self.cache.get(f'{prefix}:{int(window) - 1}', 0)
+
+        remaining_share = 1 - offset / self.duration
+        if previous * remaining_share + current <= self.num_requests:
+            return True
+        # Wait until the previous window's share has decayed enough, or the window rolls over
+        if previous and current <= self.num_requests:
+            self._wait = (1 - (self.num_requests - current) / previous) * self.duration - offset
+        else:
+            self._wait = self.duration - offset
+        return False
+
+    def wait(self):
+        return math.ceil(self._wait) if self._wait is not None else None
+
+
+class InvoicePaymentThrottle(SlidingWindowThrottle):
+    """Payment attempts per user and invoice (the view's `id` or `invoice_id` argument)"""
+    scope = 'checkout'
+
+    def get_ident_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        invoice_id = view.kwargs.get('id', view.kwargs.get('invoice_id'))
+        return f'{request.user.pk}:{invoice_id}'
+
+
+class ComponentPaymentThrottle(InvoicePaymentThrottle):
+    scope = 'component_payment'
+
+
+class CartCheckoutThrottle(SlidingWindowThrottle):
+    """Cart checkouts per user"""
+    scope = 'cart_checkout'
+
+    def get_ident_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return str(request.user.pk)
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    """Login attempts per client address and email"""
+    scope = 'login'
+
+    def get_ident_key(self, request, view):
+        email = str(request.data.get('email', '')).strip().lower()
+        return f'{self.get_ident(request)}:{email}'
+
+
+class CampusThrottle(SlidingWindowThrottle):
+    """Requests per client address to the unauthenticated Campus integration APIs"""
+    scope = 'campus'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+def exception_handler(exc, context):
+    """DRF's exception handler, with throttled responses in the views' {'error': ...} shape"""
+    response = drf_exception_handler(exc, context)
+    if isinstance(exc, Throttled) and response is not None:
+        response.data = {'error': 'Too many requests. Please wait before trying again.', 'retry_after': exc.wait}
+    return response
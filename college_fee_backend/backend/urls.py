@@ -2,19 +2,21 @@
 from django.contrib import admin
 from django.urls import path
 from .views import (
-    LoginView, RegisterView, LogoutView, MeView,
+    LoginView, RegisterView, AcceptInviteView, LogoutView, MeView,
     StudentDashboardView, StudentInvoicesView, StudentInvoiceDetailView, StudentPaymentsView,
-    AdminStudentsView, AdminStudentDetailView,
+    AdminStudentsView, AdminStudentDetailView, AdminStudentBulkOnboardView, AdminSemesterRolloverView,
     AdminFeeComponentsView, AdminFeeComponentDetailView,
     AdminFeeTemplatesView, AdminFeeTemplateDetailView,
     AdminFeeAssignmentsView, AdminFeeAssignmentDetailView, AdminInvoicesView, AdminInvoiceDetailView,
-    AdminPaymentsView, AdminOfflinePaymentView, HODStudentsView, HODReportsView,
-    CreateCheckoutSessionView, StripeWebhookView, PaymentStatusView, RefundPaymentView,
+    AdminInvoiceLedgerView, AdminLedgerBalancesView,
+    AdminPaymentsView, AdminOfflinePaymentView, AdminOfflinePaymentImportView, HODStudentsView, HODReportsView, AdminInvoiceCubeView,
+    CreateCheckoutSessionView, CartCheckoutSessionView, StripeWebhookView, PaymentStatusView, RefundPaymentView,
     StudentProfileUpdateView, DownloadReceiptView,
-    StudentNotificationsView, StudentMarkNotificationReadView, AdminReportsView,
-    AdminCustomFeeStructureView, AdminStudentFeeProfileView, AdminStudentStatusDashboardView, AdminCollectionsReportView,
+    StudentNotificationsView, StudentMarkNotificationReadView, AdminReportsView, AdminReportExportView, AdminAgingReportView,
+    AdminCustomFeeStructureView, AdminCustomFeeComponentTotalsView, AdminStudentFeeProfileView, AdminStudentStatusDashboardView, AdminCollectionsReportView, AdminCollectionsTimeSeriesView, AdminComponentCollectionsView,
+    AdminAnalyticsQueryView,
     StudentProfileEditView, StudentReceiptsView, AdminIndividualFeeAssignmentView, AdminStudentFeeBreakdownView,
-    AdminBulkFeeAssignmentView,
+    AdminBulkFeeAssignmentView, AdminFeeRevisionSimulationView,
     InvoiceComponentSelectionView, ComponentBasedPaymentView,
     SyncStudentView, StudentFeesView, StudentCompleteFeeDataView
 )
@@ -27,6 +29,7 @@ urlpatterns = [
     # Authentication - Put these first
     path('auth/login/', LoginView.as_view(), name='login'),
     path('auth/register/', RegisterView.as_view(), name='register'),
+    path('auth/invite/accept/', AcceptInviteView.as_view(), name='accept-invite'),
     path('auth/logout/', LogoutView.as_view(), name='logout'),
     path('auth/me/', MeView.as_view(), name='me'),
     path('auth/token/refresh/', LoginView.as_view(), name='token-refresh'),
@@ -46,6 +49,8 @@ urlpatterns = [
     # Admin endpoints
     path('students/', AdminStudentsView.as_view()),
     path('students/<int:id>/', AdminStudentDetailView.as_view()),
+    path('students/bulk/', AdminStudentBulkOnboardView.as_view(), name='student-bulk-onboard'),
+    path('students/rollover/', AdminSemesterRolloverView.as_view(), name='semester-rollover'),
     path('fee/components/', AdminFeeComponentsView.as_view(), name='admin-fee-components'),
     path('fee/components/<int:id>/', AdminFeeComponentDetailView.as_view(), name='admin-fee-component-detail'),
     path('fee/templates/', AdminFeeTemplatesView.as_view(), name='admin-fee-templates'),
@@ -62,12 +67,22 @@ urlpatterns = [
     # Admin Invoices
     path('invoices/', AdminInvoicesView.as_view(), name='admin-invoices'),
     path('invoices/<int:id>/', AdminInvoiceDetailView.as_view()),
+    path('invoices/<int:id>/ledger/', AdminInvoiceLedgerView.as_view(), name='admin-invoice-ledger'),
+    path('ledger/balances/', AdminLedgerBalancesView.as_view(), name='admin-ledger-balances'),
     path('payments/', AdminPaymentsView.as_view()),
     path('payments/offline/', AdminOfflinePaymentView.as_view()),
+    path('payments/offline/import/', AdminOfflinePaymentImportView.as_view(), name='offline-payment-import'),
     
     # Admin Reports
     path('reports/outstanding/', AdminReportsView.as_view(), name='admin-outstanding-reports'),
     path('reports/collections/', AdminCollectionsReportView.as_view(), name='admin-collections-reports'),
+    path('reports/collections/timeseries/', AdminCollectionsTimeSeriesView.as_view(), name='admin-collections-timeseries'),
+    path('reports/collections/components/', AdminComponentCollectionsView.as_view(), name='admin-component-collections'),
+    path('reports/aging/', AdminAgingReportView.as_view(), name='admin-aging-report'),
+    path('reports/cube/', AdminInvoiceCubeView.as_view(), name='admin-invoice-cube'),
+    path('reports/custom-fee-components/', AdminCustomFeeComponentTotalsView.as_view(), name='admin-custom-fee-component-totals'),
+    path('analytics/<str:table>/', AdminAnalyticsQueryView.as_view(), name='admin-analytics-query'),
+    path('reports/<str:report>/export/', AdminReportExportView.as_view(), name='admin-report-export'),
     
     # Admin Student Fee Management
     path('admin/students/<int:student_id>/fee-profile/', AdminStudentFeeProfileView.as_view(), name='admin-student-fee-profile'),
@@ -79,6 +94,7 @@ urlpatterns = [
     path('hod/reports/', HODReportsView.as_view()),
     # Bulk and Auto Assignment endpoints
     path('bulk-fee-assignment/', AdminBulkFeeAssignmentView.as_view(), name='admin-bulk-fee-assignment'),
+    path('fee/simulate/', AdminFeeRevisionSimulationView.as_view(), name='admin-fee-revision-simulation'),
     
     # Component-based payment views
     path('invoices/<int:invoice_id>/components/', InvoiceComponentSelectionView.as_view(), name='invoice-components'),
@@ -86,6 +102,7 @@ urlpatterns = [
     
     # Stripe endpoints
     path('invoices/<int:id>/create-checkout-session/', CreateCheckoutSessionView.as_view(), name='create-checkout-session'),
+    path('invoices/cart/checkout-session/', CartCheckoutSessionView.as_view(), name='cart-checkout-session'),
     path('payments/<str:session_id>/status/', PaymentStatusView.as_view(), name='payment-status'),
     path('payments/<int:payment_id>/refund/', RefundPaymentView.as_view(), name='refund-payment'),
     path('webhooks/stripe/', StripeWebhookView.as_view(), name='stripe-webhook'),
@@ -1,3 +1,6 @@
+import io
+import csv
+import uuid
 import stripe
 from django.conf import settings
 from django.http import JsonResponse, HttpResponse
@@ -6,8 +9,11 @@ from django.contrib.auth import authenticate
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db.models import Sum, Q, F
-from datetime import datetime, date
+from django.db import transaction
+from django.db.models import Count, Sum, Q, F, Value, DecimalField, ProtectedError
+from django.db.models.functions import Coalesce
+from datetime import datetime, date, timezone as dt_timezone
+from decimal import Decimal
 from django.template.loader import get_template
 from django.http import HttpResponse
 from weasyprint import HTML
@@ -18,10 +24,93 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from .models import User, StudentProfile, FeeComponent, FeeTemplate, FeeTemplateComponent, FeeAssignment, Invoice, InvoiceComponent, Payment, PaymentComponent, Notification, CustomFeeStructure, Receipt
-from .serializers import LoginSerializer, UserSerializer, StudentProfileSerializer, NotificationSerializer, FeeComponentSerializer, FeeTemplateSerializer, FeeAssignmentSerializer
+from .models import User, StudentProfile, FeeComponent, FeeTemplate, FeeTemplateComponent, FeeAssignment, Invoice, InvoiceComponent, Payment, PaymentComponent, Notification, CustomFeeStructure, CustomFeeComponent, Receipt, InvoiceCube, LedgerEntry
+from .serializers import LoginSerializer, UserSerializer, StudentProfileSerializer, NotificationSerializer, FeeComponentSerializer, FeeTemplateSerializer, FeeAssignmentSerializer, LedgerEntrySerializer
+from .caching import get_fee_components, get_fee_template, get_serialized_fee_templates, get_student_dashboard
+from .renderers import ORJSONResponse
+from .idempotency import idempotent
+from .settlement import invoice_status, settle_payments
+from .ledger import MEASURES as LEDGER_MEASURES, as_rupees, end_of_day, invoice_balances, post as post_ledger
+from .money import PAISE_PER_RUPEE, parse_paise, to_paise, to_rupees
+from .onboarding import accept_invite, onboard_students, read_student_csv, read_student_records
+from .rollover import rollover_students
+from .bank_import import OFFLINE_MODES, import_offline_payments, read_records, read_statement
+from .throttling import InvoicePaymentThrottle, ComponentPaymentThrottle, CartCheckoutThrottle, LoginThrottle, CampusThrottle
+from .projection import parse_fields, project
+from .reports import (
+    REPORTS, COLLECTION_INTERVALS, COLLECTION_GROUPS,
+    report_rows, daily_collections, collection_breakdown,
+    COMPONENT_COLLECTION_GROUPS, component_collections, component_breakdown,
+    invoice_cube, cube_rollup, cube_totals, AGING_BUCKETS, AGING_GROUPS, aging_report, parse_date
+)
+from .rollups import CUBE_DIMENSIONS
+from .analytics import get_snapshot
+from .simulator import simulate_fee_revision
+from .exports import EXPORT_CHUNK_SIZE, ExportContentNegotiation, Workbook, streaming_csv_response, xlsx_response
 from django.utils.decorators import method_decorator
 
+# Most invoices one cart checkout may pay
+MAX_CART_INVOICES = 10
+
+# Invoices keep their fee ledger history, so their assignment cannot be deleted
+ASSIGNMENT_PROTECTED_ERROR = 'Assignment has invoices with fee ledger history; deactivate it instead'
+
+# Fields available to ?fields= on the list endpoints, mapped to their ORM paths.
+# The *_DEFAULT tuples are returned when no fields are requested.
+STUDENT_LIST_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'usn': 'usn',
+    'dept': 'dept',
+    'semester': 'semester',
+    'batch': 'batch',
+    'section': 'section',
+    'admission_mode': 'admission_mode',
+    'status': 'status',
+    'is_active': 'is_active',
+    'date_of_admission': 'date_of_admission',
+    'email': 'user__email',
+}
+STUDENT_LIST_DEFAULT = ('id', 'name', 'usn', 'dept', 'semester', 'admission_mode', 'status')
+
+INVOICE_LIST_FIELDS = {
+    'id': 'id',
+    'invoice_number': 'invoice_number',
+    'student_id': 'student_id',
+    'student_name': 'student__name',
+    'student_usn': 'student__usn',
+    'department': 'student__dept',
+    'invoice_type': 'invoice_type',
+    'academic_year': 'academic_year',
+    'semester': 'semester',
+    'total_amount': 'total_amount',
+    'paid_amount': 'paid_amount',
+    'balance_amount': 'balance_amount',
+    'status': 'status',
+    'due_date': 'due_date',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+INVOICE_LIST_DEFAULT = ('id', 'student_id', 'semester', 'total_amount', 'paid_amount', 'balance_amount', 'status', 'due_date')
+STUDENT_INVOICE_LIST_DEFAULT = ('id', 'semester', 'total_amount', 'paid_amount', 'balance_amount', 'status', 'due_date')
+
+PAYMENT_LIST_FIELDS = {
+    'id': 'id',
+    'invoice_id': 'invoice_id',
+    'invoice_number': 'invoice__invoice_number',
+    'student_id': 'invoice__student_id',
+    'student_name': 'invoice__student__name',
+    'student_usn': 'invoice__student__usn',
+    'department': 'invoice__student__dept',
+    'amount': 'amount',
+    'mode': 'mode',
+    'status': 'status',
+    'transaction_id': 'transaction_id',
+    'payment_reference': 'payment_reference',
+    'timestamp': 'timestamp',
+}
+PAYMENT_LIST_DEFAULT = ('id', 'invoice_id', 'amount', 'mode', 'status', 'timestamp')
+
 
 # Custom permissions
 class IsStudentUser(IsAuthenticated):
@@ -42,6 +131,7 @@ from django.utils.decorators import method_decorator
 @method_decorator(csrf_exempt, name='dispatch')
 class LoginView(generics.GenericAPIView):
     permission_classes = []
+    throttle_classes = [LoginThrottle]
     serializer_class = LoginSerializer
 
     def post(self, request, *args, **kwargs):
@@ -97,6 +187,23 @@ class RegisterView(APIView):
         except ValueError as e:
             return JsonResponse({'error': str(e)}, status=400)
 
+@method_decorator(csrf_exempt, name='dispatch')
+class AcceptInviteView(APIView):
+    """Let a bulk-onboarded student set their first password with the invite token"""
+    permission_classes = []
+    throttle_classes = [LoginThrottle]
+
+    def post(self, request):
+        token = request.data.get('token')
+        password = request.data.get('password')
+        if not token or not password:
+            return JsonResponse({'error': 'Please provide both token and password'}, status=400)
+        try:
+            user = accept_invite(token, password)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'message': 'Password set successfully', 'email': user.email})
+
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -200,105 +307,85 @@ class StudentDashboardView(APIView):
 
     def get(self, request):
         try:
-            student = StudentProfile.objects.get(user=request.user)
-            
-            # Get custom fee structure if exists
-            custom_fees = CustomFeeStructure.objects.filter(student=student).first()
-            
-            # Get all invoices for the student
-            invoices = Invoice.objects.filter(student=student)
-            total_fee = sum(float(inv.total_amount) for inv in invoices)
-            paid_amount = sum(float(inv.paid_amount) for inv in invoices)
-            balance_amount = sum(float(inv.balance_amount) for inv in invoices)
-            
-            # Calculate progress percentage
-            progress_percentage = (paid_amount / total_fee * 100) if total_fee > 0 else 0
-            
-            # Get recent payments
-            recent_payments = Payment.objects.filter(
-                invoice__student=student
-            ).order_by('-timestamp')[:5]
-            
-            # Get recent notifications
-            recent_notifications = Notification.objects.filter(
-                user=request.user
-            ).order_by('-created_at')[:3]
-            
-            # Fee breakdown
-            fee_breakdown = {}
-            if custom_fees:
-                fee_breakdown = custom_fees.components
-            else:
-                # Fallback to template-based fees
-                fee_assignments = FeeAssignment.objects.filter(student=student)
-                for assignment in fee_assignments:
-                    template = assignment.template
-                    for ft_component in template.feetemplatecomponent_set.all():
-                        component_name = ft_component.component.name
-                        amount = ft_component.amount_override if ft_component.amount_override else ft_component.component.amount
-                        fee_breakdown[component_name] = str(amount)
-            
-            return JsonResponse({
-                'student': {
-                    'name': student.name,
-                    'usn': student.usn,
-                    'dept': student.dept,
-                    'semester': student.semester,
-                    'admission_mode': student.admission_mode,
-                    'status': student.status
-                },
-                'fee_overview': {
-                    'total_fee': total_fee,
-                    'paid_amount': paid_amount,
-                    'balance_amount': balance_amount,
-                    'progress_percentage': round(progress_percentage, 2)
-                },
-                'fee_breakdown': fee_breakdown,
-                'recent_payments': [{
-                    'id': p.id,
-                    'amount': float(p.amount),
-                    'mode': p.mode,
-                    'status': p.status,
-                    'timestamp': p.timestamp.isoformat(),
-                    'invoice_id': p.invoice.id
-                } for p in recent_payments],
-                'recent_notifications': [{
-                    'id': n.id,
-                    'message': n.message,
-                    'is_read': n.is_read,
-                    'created_at': n.created_at.isoformat()
-                } for n in recent_notifications],
-                'invoices': [{
-                    'id': inv.id,
-                    'semester': inv.semester,
-                    'total_amount': float(inv.total_amount),
-                    'paid_amount': float(inv.paid_amount),
-                    'balance_amount': float(inv.balance_amount),
-                    'status': inv.status,
-                    'due_date': inv.due_date.isoformat() if inv.due_date else None
-                } for inv in invoices]
-            })
+            # Served from the per-student cache; writes to the student's invoices,
+            # payments, notifications and custom fees expire it (see signals.py)
+            return ORJSONResponse(get_student_dashboard(request.user.id, lambda: self.build_dashboard(request.user)))
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student profile not found'}, status=404)
 
+    def build_dashboard(self, user):
+        student = StudentProfile.objects.get(user=user)
+
+        # Get custom fee structure if exists
+        custom_fees = CustomFeeStructure.objects.filter(student=student).first()
+
+        # Get all invoices for the student
+        invoices = list(Invoice.objects.filter(student=student).values(
+            'id', 'semester', 'total_amount', 'paid_amount', 'balance_amount', 'status', 'due_date'
+        ))
+        total_fee = sum(inv['total_amount'] for inv in invoices)
+        paid_amount = sum(inv['paid_amount'] for inv in invoices)
+        balance_amount = sum(inv['balance_amount'] for inv in invoices)
+
+        # Calculate progress percentage
+        progress_percentage = float(paid_amount / total_fee * 100) if total_fee > 0 else 0
+
+        # Get recent payments
+        recent_payments = Payment.objects.filter(
+            invoice__student=student
+        ).order_by('-timestamp').values('id', 'amount', 'mode', 'status', 'timestamp', 'invoice_id')[:5]
+
+        # Get recent notifications
+        recent_notifications = Notification.objects.filter(
+            user=user
+        ).order_by('-created_at').values('id', 'message', 'is_read', 'created_at')[:3]
+
+        # Fee breakdown
+        fee_breakdown = {}
+        if custom_fees:
+            fee_breakdown = custom_fees.components
+        else:
+            # Fallback to template-based fees, read from the cached fee catalog
+            template_ids = FeeAssignment.objects.filter(student=student).values_list('template_id', flat=True)
+            for template_id in template_ids:
+                template = get_fee_template(template_id)
+                if not template:
+                    continue
+                for component in template['components']:
+                    fee_breakdown[component['name']] = str(component['amount'])
+
+        return {
+            'student': {
+                'name': student.name,
+                'usn': student.usn,
+                'dept': student.dept,
+                'semester': student.semester,
+                'admission_mode': student.admission_mode,
+                'status': student.status
+            },
+            'fee_overview': {
+                'total_fee': total_fee,
+                'paid_amount': paid_amount,
+                'balance_amount': balance_amount,
+                'progress_percentage': round(progress_percentage, 2)
+            },
+            'fee_breakdown': fee_breakdown,
+            'recent_payments': list(recent_payments),
+            'recent_notifications': list(recent_notifications),
+            'invoices': invoices
+        }
+
 class StudentInvoicesView(APIView):
     permission_classes = [IsStudentUser]
 
     def get(self, request):
         try:
+            fields = parse_fields(request, INVOICE_LIST_FIELDS, STUDENT_INVOICE_LIST_DEFAULT)
             student = StudentProfile.objects.get(user=request.user)
-            invoices = Invoice.objects.filter(student=student)
-            return JsonResponse({
-                'invoices': [{
-                    'id': inv.id,
-                    'semester': inv.semester,
-                    'total_amount': float(inv.total_amount),
-                    'paid_amount': float(inv.paid_amount),
-                    'balance_amount': float(inv.balance_amount),
-                    'status': inv.status,
-                    'due_date': inv.due_date.isoformat() if inv.due_date else None
-                } for inv in invoices]
-            })
+            invoices = project(Invoice.objects.filter(student=student), INVOICE_LIST_FIELDS, fields)
+            return ORJSONResponse({'invoices': list(invoices)})
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student profile not found'}, status=404)
 
@@ -334,18 +421,12 @@ class StudentPaymentsView(APIView):
 
     def get(self, request):
         try:
+            fields = parse_fields(request, PAYMENT_LIST_FIELDS, PAYMENT_LIST_DEFAULT)
             student = StudentProfile.objects.get(user=request.user)
-            payments = Payment.objects.filter(invoice__student=student)
-            return JsonResponse({
-                'payments': [{
-                    'id': p.id,
-                    'invoice_id': p.invoice.id if p.invoice else None,
-                    'amount': float(p.amount),
-                    'mode': p.mode,
-                    'status': p.status,
-                    'timestamp': p.timestamp.isoformat()
-                } for p in payments]
-            })
+            payments = project(Payment.objects.filter(invoice__student=student), PAYMENT_LIST_FIELDS, fields)
+            return ORJSONResponse({'payments': list(payments)})
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student profile not found'}, status=404)
 
@@ -447,21 +528,16 @@ class StudentReceiptsView(APIView):
     def get(self, request):
         try:
             student = StudentProfile.objects.get(user=request.user)
-            receipts = Receipt.objects.filter(payment__invoice__student=student).order_by('-generated_at')
-            
-            return JsonResponse({
-                'receipts': [{
-                    'id': r.id,
-                    'receipt_number': r.receipt_number,
-                    'amount': float(r.amount),
-                    'payment_date': r.payment.timestamp.isoformat(),
-                    'payment_mode': r.payment.mode,
-                    'transaction_id': r.payment.transaction_id,
-                    'invoice_id': r.payment.invoice.id if r.payment.invoice else None,
-                    'semester': r.payment.invoice.semester if r.payment.invoice else None,
-                    'generated_at': r.generated_at.isoformat()
-                } for r in receipts]
-            })
+            receipts = Receipt.objects.filter(payment__invoice__student=student).order_by('-generated_at').values(
+                'id', 'receipt_number', 'amount', 'generated_at',
+                payment_date=F('payment__timestamp'),
+                payment_mode=F('payment__mode'),
+                transaction_id=F('payment__transaction_id'),
+                invoice_id=F('payment__invoice_id'),
+                semester=F('payment__invoice__semester'),
+            )
+
+            return ORJSONResponse({'receipts': list(receipts)})
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student profile not found'}, status=404)
 
@@ -570,21 +646,16 @@ class AdminStudentsView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
+        try:
+            fields = parse_fields(request, STUDENT_LIST_FIELDS, STUDENT_LIST_DEFAULT)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         query = request.GET.get('query')
         students = StudentProfile.objects.all()
         if query:
             students = students.filter(Q(name__icontains=query) | Q(usn__icontains=query))
-        return JsonResponse({
-            'students': [{
-                'id': s.id,
-                'name': s.name,
-                'usn': s.usn,
-                'dept': s.dept,
-                'semester': s.semester,
-                'admission_mode': s.admission_mode,
-                'status': s.status
-            } for s in students]
-        })
+        students = project(students, STUDENT_LIST_FIELDS, fields)
+        return ORJSONResponse({'students': list(students)})
 
     def post(self, request):
         try:
@@ -645,9 +716,59 @@ class AdminStudentDetailView(APIView):
             return JsonResponse({'message': 'Student and associated user deleted successfully'}, status=204)
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student not found'}, status=404)
+        except ProtectedError:
+            return JsonResponse({'error': 'Student has fee ledger history and cannot be deleted; deactivate them instead'}, status=409)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
+class AdminStudentBulkOnboardView(APIView):
+    """Admin view creating students in bulk from a CSV file or a JSON list, with results per row"""
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        invite_only = str(request.data.get('invite', False)).lower() in ('true', '1', 'yes')
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('true', '1', 'yes')
+
+        upload = request.FILES.get('file')
+        if upload:
+            rows = read_student_csv(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''))
+        elif isinstance(request.data.get('students'), list):
+            rows = read_student_records(request.data['students'])
+        else:
+            return JsonResponse({'error': 'Upload a CSV as file or send a students list'}, status=400)
+
+        try:
+            summary, results = onboard_students(rows, invite_only, dry_run)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return JsonResponse({'error': f'Could not read the file: {e}'}, status=400)
+        logger.info(
+            f"Bulk onboarding by user {request.user.id}: {summary['created']} of {summary['rows']} students created, "
+            f"{summary['invited']} invited, {summary['failed']} failed, dry_run={dry_run}"
+        )
+        return ORJSONResponse({**summary, 'results': results}, status=200 if dry_run or not summary['created'] else 201)
+
+class AdminSemesterRolloverView(APIView):
+    """Admin view promoting active students into the next term and issuing its invoices"""
+    permission_classes = [IsAdminUser]
+
+    @idempotent
+    def post(self, request):
+        academic_year = request.data.get('academic_year')
+        if not academic_year:
+            return JsonResponse({'error': 'academic_year is required'}, status=400)
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('true', '1', 'yes')
+        force = str(request.data.get('force', False)).lower() in ('true', '1', 'yes')
+        try:
+            due_date = parse_date(request.data['due_date'], 'due_date') if request.data.get('due_date') else None
+            summary = rollover_students(academic_year, request.data.get('term'), due_date, dry_run, force)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        logger.info(
+            f"Semester rollover by user {request.user.id} into {academic_year} {summary['term']}: "
+            f"{summary['promoted']} promoted, {summary['invoices_created']} invoices, dry_run={dry_run}"
+        )
+        return ORJSONResponse(summary, status=201 if summary['invoices_created'] and not dry_run else 200)
+
 class AdminFeeComponentsView(generics.ListCreateAPIView):
     queryset = FeeComponent.objects.all()
     serializer_class = FeeComponentSerializer
@@ -660,12 +781,16 @@ class AdminFeeComponentDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'id'
 
 class AdminFeeTemplatesView(generics.ListCreateAPIView):
-    queryset = FeeTemplate.objects.all()
+    queryset = FeeTemplate.objects.prefetch_related('feetemplatecomponent_set__component')
     serializer_class = FeeTemplateSerializer
     permission_classes = [IsAdminUser]
 
+    def list(self, request, *args, **kwargs):
+        # Templates rarely change, so the serialized list is served from the fee catalog cache
+        return Response(get_serialized_fee_templates())
+
 class AdminFeeTemplateDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = FeeTemplate.objects.all()
+    queryset = FeeTemplate.objects.prefetch_related('feetemplatecomponent_set__component')
     serializer_class = FeeTemplateSerializer
     permission_classes = [IsAdminUser]
     lookup_field = 'id'
@@ -706,28 +831,15 @@ class AdminFeeAssignmentsView(APIView):
                     logger.error(f"No template found for assignment {assignment.id}")
                     return Response({"error": "Template is required for invoice creation"}, status=status.HTTP_400_BAD_REQUEST)
 
-                overrides = assignment.overrides or {}
-
-                total_amount = 0
-                for ft_component in template.feetemplatecomponent_set.all():
-                    component_amount = ft_component.amount_override if ft_component.amount_override is not None else ft_component.component.amount
-                    total_amount += component_amount
-                
-                # Apply overrides
-                for component_id, override_amount in overrides.items():
-                    try:
-                        component = FeeComponent.objects.get(id=int(component_id))
-                        # Find original amount for this component
-                        original_amount = 0
-                        for ft_comp in template.feetemplatecomponent_set.all():
-                            if ft_comp.component.id == int(component_id):
-                                original_amount = ft_comp.amount_override if ft_comp.amount_override else ft_comp.component.amount
-                                break
-                        # Replace original with override
-                        total_amount = total_amount - original_amount + float(override_amount)
-                    except (FeeComponent.DoesNotExist, ValueError) as e:
-                        logger.warning(f"Invalid component override in assignment {assignment.id}: {component_id}")
-                        continue
+                # Template fees in paise, with the assignment's override rows replacing (or adding) components
+                fees = {
+                    ft_component.component_id: to_paise(
+                        ft_component.amount_override if ft_component.amount_override is not None else ft_component.component.amount
+                    )
+                    for ft_component in template.feetemplatecomponent_set.select_related('component')
+                }
+                fees.update(assignment.override_rows.values_list('component_id', 'amount'))
+                total_amount = to_rupees(sum(fees.values()))
                 
                 # Create invoice
                 invoice = Invoice.objects.create(
@@ -773,7 +885,10 @@ class AdminFeeAssignmentsView(APIView):
             assignment = FeeAssignment.objects.get(pk=pk)
         except FeeAssignment.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        assignment.delete()
+        try:
+            assignment.delete()
+        except ProtectedError:
+            return Response({'error': ASSIGNMENT_PROTECTED_ERROR}, status=status.HTTP_409_CONFLICT)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class AdminFeeAssignmentDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -782,10 +897,20 @@ class AdminFeeAssignmentDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminUser]
     lookup_field = 'id'
 
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response({'error': ASSIGNMENT_PROTECTED_ERROR}, status=status.HTTP_409_CONFLICT)
+
 class AdminInvoicesView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
+        try:
+            fields = parse_fields(request, INVOICE_LIST_FIELDS, INVOICE_LIST_DEFAULT)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         student_id = request.GET.get('student_id')
         sem = request.GET.get('sem')
         invoices = Invoice.objects.all()
@@ -793,18 +918,8 @@ class AdminInvoicesView(APIView):
             invoices = invoices.filter(student_id=student_id)
         if sem:
             invoices = invoices.filter(semester=sem)
-        return JsonResponse({
-            'invoices': [{
-                'id': inv.id,
-                'student_id': inv.student.id if inv.student else None,
-                'semester': inv.semester,
-                'total_amount': float(inv.total_amount),
-                'paid_amount': float(inv.paid_amount),
-                'balance_amount': float(inv.balance_amount),
-                'status': inv.status,
-                'due_date': inv.due_date.isoformat() if inv.due_date else None
-            } for inv in invoices]
-        })
+        invoices = project(invoices, INVOICE_LIST_FIELDS, fields)
+        return ORJSONResponse({'invoices': list(invoices)})
 
 class AdminInvoiceDetailView(APIView):
     permission_classes = [IsAdminUser]
@@ -812,12 +927,22 @@ class AdminInvoiceDetailView(APIView):
     def patch(self, request, id):
         try:
             invoice = Invoice.objects.get(id=id)
+            stored_total, stored_balance = invoice.total_amount, invoice.balance_amount
             for key, value in request.data.items():
                 if key in ['semester', 'total_amount', 'paid_amount', 'balance_amount', 'status', 'due_date']:
                     if key == 'due_date':
                         value = datetime.strptime(value, '%Y-%m-%d').date()
                     setattr(invoice, key, value)
-            invoice.save()
+            invoice._ledger_user = request.user
+            with transaction.atomic():
+                invoice.save()
+                # The ledger gets the total change from the save; a balance edited
+                # beyond that is posted as a correction
+                correction = (
+                    (to_paise(invoice.balance_amount) - to_paise(stored_balance))
+                    - (to_paise(invoice.total_amount) - to_paise(stored_total))
+                )
+                post_ledger('adjustment', invoice, correction, memo='Balance corrected by admin', user=request.user)
             return JsonResponse({
                 'id': invoice.id,
                 'student_id': invoice.student.id if invoice.student else None,
@@ -831,42 +956,122 @@ class AdminInvoiceDetailView(APIView):
         except Invoice.DoesNotExist:
             return JsonResponse({'error': 'Invoice not found'}, status=404)
 
+def _ledger_as_of(request):
+    """The `as_of` date parameter as the end of that day, or None for now"""
+    as_of = request.GET.get('as_of')
+    return end_of_day(parse_date(as_of, 'as_of')) if as_of else None
+
+class AdminInvoiceLedgerView(APIView):
+    """Admin view listing an invoice's ledger entries and posting adjustments and concessions"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, id):
+        if not Invoice.objects.filter(pk=id).exists():
+            return JsonResponse({'error': 'Invoice not found'}, status=404)
+        try:
+            as_of = _ledger_as_of(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        entries = LedgerEntry.objects.filter(invoice_id=id).order_by('posted_at', 'id')
+        if as_of:
+            entries = entries.filter(posted_at__lte=as_of)
+        balance = invoice_balances([id], as_of).get(id, dict.fromkeys(LEDGER_MEASURES, 0))
+        return ORJSONResponse({
+            'invoice_id': id,
+            'as_of': as_of,
+            **as_rupees(balance),
+            'entries': LedgerEntrySerializer(entries, many=True).data,
+        })
+
+    def post(self, request, id):
+        kind = request.data.get('kind')
+        if kind not in ('adjustment', 'concession'):
+            return JsonResponse({'error': 'kind must be adjustment or concession'}, status=400)
+        try:
+            amount = parse_paise(request.data.get('amount'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if not amount or (kind == 'concession' and amount < 0):
+            return JsonResponse({'error': 'amount must be non-zero, and positive for a concession'}, status=400)
+
+        with transaction.atomic():
+            invoice = Invoice.objects.select_for_update().filter(pk=id).first()
+            if invoice is None:
+                return JsonResponse({'error': 'Invoice not found'}, status=404)
+            # A concession lowers what the student owes; an adjustment moves it either way
+            change = -amount if kind == 'concession' else amount
+            if to_paise(invoice.balance_amount) + change < 0:
+                return JsonResponse({'error': 'The change exceeds the outstanding balance'}, status=400)
+            invoice.total_amount = to_rupees(to_paise(invoice.total_amount) + change)
+            invoice.balance_amount = to_rupees(to_paise(invoice.balance_amount) + change)
+            invoice.status = invoice_status(invoice)
+            invoice._ledger_kind = kind
+            invoice._ledger_memo = request.data.get('memo') or kind.capitalize()
+            invoice._ledger_user = request.user
+            invoice.save()
+        return JsonResponse({
+            'id': invoice.id,
+            'total_amount': float(invoice.total_amount),
+            'paid_amount': float(invoice.paid_amount),
+            'balance_amount': float(invoice.balance_amount),
+            'status': invoice.status,
+        }, status=201)
+
+class AdminLedgerBalancesView(APIView):
+    """Admin view of invoice balances from the ledger, optionally as of a past date"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            as_of = _ledger_as_of(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        invoice_ids = None
+        if request.GET.get('student_id'):
+            invoice_ids = list(Invoice.objects.filter(student_id=request.GET['student_id']).values_list('id', flat=True))
+        balances = invoice_balances(invoice_ids, as_of)
+        totals = {measure: sum(row[measure] for row in balances.values()) for measure in LEDGER_MEASURES}
+        return ORJSONResponse({
+            'as_of': as_of,
+            **as_rupees(totals),
+            'invoices': [{'invoice_id': invoice_id, **as_rupees(row)} for invoice_id, row in sorted(balances.items())],
+        })
+
 class AdminPaymentsView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
+        try:
+            fields = parse_fields(request, PAYMENT_LIST_FIELDS, PAYMENT_LIST_DEFAULT)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         student_id = request.GET.get('student_id')
         payments = Payment.objects.all()
         if student_id:
             payments = payments.filter(invoice__student_id=student_id)
-        return JsonResponse({
-            'payments': [{
-                'id': p.id,
-                'invoice_id': p.invoice.id if p.invoice else None,
-                'amount': float(p.amount),
-                'mode': p.mode,
-                'status': p.status,
-                'timestamp': p.timestamp.isoformat()
-            } for p in payments]
-        })
+        payments = project(payments, PAYMENT_LIST_FIELDS, fields)
+        return ORJSONResponse({'payments': list(payments)})
 
 class AdminOfflinePaymentView(APIView):
     permission_classes = [IsAdminUser]
 
+    @idempotent
     def post(self, request):
         try:
             invoice = Invoice.objects.get(id=request.data.get('invoice_id'))
-            payment = Payment.objects.create(
-                invoice=invoice,
-                amount=request.data.get('amount'),
-                mode=request.data.get('mode'),
-                status='success',
-                transaction_id=request.data.get('transaction_id', '')
-            )
-            invoice.paid_amount += payment.amount
-            invoice.balance_amount -= payment.amount
-            invoice.status = 'paid' if invoice.balance_amount <= 0 else 'partial'
-            invoice.save()
+            amount = Decimal(str(request.data.get('amount')))
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    invoice=invoice,
+                    amount=amount,
+                    mode=request.data.get('mode'),
+                    status='success',
+                    transaction_id=request.data.get('transaction_id', '')
+                )
+                invoice.paid_amount += amount
+                invoice.balance_amount -= amount
+                invoice.status = 'paid' if invoice.balance_amount <= 0 else 'partial'
+                invoice.save()
             return JsonResponse({
                 'id': payment.id,
                 'invoice_id': payment.invoice.id if payment.invoice else None,
@@ -878,6 +1083,35 @@ class AdminOfflinePaymentView(APIView):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
+class AdminOfflinePaymentImportView(APIView):
+    """Admin view posting offline payments in bulk from a bank statement CSV or a JSON list"""
+    permission_classes = [IsAdminUser]
+
+    @idempotent
+    def post(self, request):
+        default_mode = request.data.get('mode') or 'neft'
+        if default_mode not in OFFLINE_MODES:
+            return JsonResponse({'error': f"mode must be one of: {', '.join(OFFLINE_MODES)}"}, status=400)
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('true', '1', 'yes')
+
+        upload = request.FILES.get('file')
+        if upload:
+            rows = read_statement(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''))
+        elif isinstance(request.data.get('payments'), list):
+            rows = read_records(request.data['payments'])
+        else:
+            return JsonResponse({'error': 'Upload a statement as file or send a payments list'}, status=400)
+
+        try:
+            result = import_offline_payments(rows, default_mode, dry_run)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return JsonResponse({'error': f'Could not read the statement: {e}'}, status=400)
+        logger.info(
+            f"Offline payment import by user {request.user.id}: {result['posted']} of {result['rows']} rows posted, "
+            f"{len(result['unmatched'])} unmatched, {len(result['duplicates'])} duplicates, dry_run={dry_run}"
+        )
+        return ORJSONResponse(result)
+
 # Admin Reports
 class AdminReportsView(APIView):
     permission_classes = [IsAdminUser]
@@ -886,35 +1120,66 @@ class AdminReportsView(APIView):
         dept = request.GET.get('dept')
         semester = request.GET.get('semester')
 
-        outstanding_invoices = Invoice.objects.filter(balance_amount__gt=0)
-        if dept:
-            outstanding_invoices = outstanding_invoices.filter(student__dept=dept)
-        if semester:
-            outstanding_invoices = outstanding_invoices.filter(semester=semester)
-        
-        outstanding_report = []
-        for invoice in outstanding_invoices:
-            if invoice.student:  # Only include invoices with valid students
-                outstanding_report.append({
-                    'invoice_id': invoice.id,
-                    'student_name': invoice.student.name,
-                    'student_usn': invoice.student.usn,
-                    'department': invoice.student.dept,
-                    'semester': invoice.semester,
-                    'total_amount': float(invoice.total_amount),
-                    'paid_amount': float(invoice.paid_amount),
-                    'balance_amount': float(invoice.balance_amount),
-                    'due_date': invoice.due_date.isoformat() if invoice.due_date else None,
-                    'status': invoice.status,
-                })
-        
-        total_outstanding = outstanding_invoices.aggregate(Sum('balance_amount'))['balance_amount__sum'] or 0
-        
-        return Response({
-            'outstanding_invoices': outstanding_report,
+        outstanding_report = report_rows('outstanding', request.GET, [
+            'invoice_id', 'student_name', 'student_usn', 'department', 'semester',
+            'total_amount', 'paid_amount', 'balance_amount', 'due_date', 'status',
+        ])
+        cells = invoice_cube({'dept': dept, 'invoice_semester': semester}).exclude(status='paid')
+        total_outstanding = cube_totals(cells)['total_balance']
+
+        return ORJSONResponse({
+            'outstanding_invoices': list(outstanding_report),
             'total_outstanding_amount': float(total_outstanding),
         })
 
+class AdminAgingReportView(APIView):
+    """Admin view bucketing outstanding balances by days past due"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        group_by = [name for name in request.GET.get('group_by', 'dept,semester').split(',') if name]
+        unknown = [name for name in group_by if name not in AGING_GROUPS]
+        if unknown:
+            return JsonResponse({'error': f"group_by must be made of: {', '.join(AGING_GROUPS)}"}, status=400)
+        try:
+            as_of, rows = aging_report(request.GET, group_by)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return ORJSONResponse({
+            'as_of': as_of,
+            'buckets': [name for name, first_day, last_day in AGING_BUCKETS],
+            'group_by': group_by,
+            'rows': rows,
+        })
+
+class AdminReportExportView(APIView):
+    """Admin view exporting the outstanding, collections and payments reports as CSV or XLSX"""
+    permission_classes = [IsAdminUser]
+    content_negotiation_class = ExportContentNegotiation
+
+    def get(self, request, report):
+        if report not in REPORTS:
+            return JsonResponse({'error': f"Unknown report. Available reports: {', '.join(REPORTS)}"}, status=404)
+        file_type = request.GET.get('file_type', 'csv')
+        if file_type not in ('csv', 'xlsx'):
+            return JsonResponse({'error': 'file_type must be csv or xlsx'}, status=400)
+        if file_type == 'xlsx' and Workbook is None:
+            return JsonResponse({'error': 'XLSX export requires openpyxl to be installed'}, status=501)
+
+        columns = REPORTS[report].columns
+        try:
+            fields = parse_fields(request, columns, columns)
+            rows = report_rows(report, request.GET, fields)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        filename = f"{report}-{timezone.localdate():%Y%m%d}.{file_type}"
+        rows = rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        if file_type == 'xlsx':
+            return xlsx_response(filename, fields, rows)
+        return streaming_csv_response(filename, fields, rows)
+
 # HOD views
 class HODStudentsView(APIView):
     permission_classes = [IsHODUser]
@@ -927,14 +1192,10 @@ class HODStudentsView(APIView):
             students = students.filter(dept=dept)
         if sem:
             students = students.filter(semester=sem)
-        balances = []
-        for student in students:
-            balance = Invoice.objects.filter(student=student).aggregate(Sum('balance_amount'))['balance_amount__sum'] or 0
-            balances.append({
-                'student': student.usn,
-                'balance': float(balance)
-            })
-        return JsonResponse({'balances': balances})
+        balances = students.annotate(
+            balance=Coalesce(Sum('invoice__balance_amount'), Value(0, output_field=DecimalField()))
+        ).values('balance', student=F('usn'))
+        return ORJSONResponse({'balances': list(balances)})
 
 class HODReportsView(APIView):
     permission_classes = [IsHODUser]
@@ -942,49 +1203,40 @@ class HODReportsView(APIView):
     def get(self, request):
         dept = request.GET.get('dept')
         sem = request.GET.get('sem')
-        collections = Payment.objects.filter(
-            status='success',
-            invoice__student__dept=dept,
-            invoice__student__semester=sem
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-        outstanding = Invoice.objects.filter(
-            student__dept=dept,
-            student__semester=sem
-        ).aggregate(Sum('balance_amount'))['balance_amount__sum'] or 0
+        totals = cube_totals(InvoiceCube.objects.filter(dept=dept, semester=sem))
         return JsonResponse({
-            'collections': float(collections),
-            'outstanding': float(outstanding)
+            'collections': float(totals['total_paid']),
+            'outstanding': float(totals['total_balance'])
+        })
+
+class AdminInvoiceCubeView(APIView):
+    """Admin view rolling the invoice cube up or drilling it down by any set of dimensions"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        group_by = [name.strip() for name in request.GET.get('group_by', '').split(',') if name.strip()]
+        unknown = [name for name in group_by if name not in CUBE_DIMENSIONS]
+        if unknown:
+            return JsonResponse({
+                'error': f"Unknown dimensions: {', '.join(unknown)}. Available dimensions: {', '.join(CUBE_DIMENSIONS)}"
+            }, status=400)
+
+        cells = invoice_cube(request.GET)
+        return ORJSONResponse({
+            'group_by': group_by,
+            'rows': list(cube_rollup(cells, group_by)),
+            'totals': cube_totals(cells),
         })
 
 # Stripe views
 class CreateCheckoutSessionView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [InvoicePaymentThrottle]
     
+    @idempotent
     def post(self, request, id):
         from .stripe_service import create_checkout_session
         
-        # Cancel stale pending payments older than 1 minute for this invoice and amount
-        stale_time = timezone.now() - timezone.timedelta(minutes=1)
-        stale_payments = Payment.objects.filter(
-            invoice_id=id,
-            status='pending',
-            timestamp__lt=stale_time
-        )
-        for payment in stale_payments:
-            payment.status = 'cancelled'
-            payment.save()
-
-        # Rate limiting check (basic implementation)
-        recent_payments = Payment.objects.filter(
-            invoice_id=id,
-            timestamp__gte=timezone.now() - timezone.timedelta(minutes=5),
-            status='pending'
-        ).count()
-        if recent_payments >= 3:
-            return JsonResponse({
-                'error': 'Too many payment attempts. Please wait before trying again.'
-            }, status=429)
-
         try:
             invoice = Invoice.objects.get(id=id)
             student = StudentProfile.objects.get(user=request.user)
@@ -994,30 +1246,46 @@ class CreateCheckoutSessionView(APIView):
                 logger.warning(f"Unauthorized payment attempt by user {request.user.id} for invoice {id}")
                 return JsonResponse({'error': 'Unauthorized access to invoice'}, status=403)
 
-            # Get payment amount (default to balance amount)
-            amount = request.data.get('amount', float(invoice.balance_amount))
+            # Get payment amount (default to balance amount), compared in paise
+            try:
+                amount_paise = parse_paise(request.data.get('amount', invoice.balance_amount))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
 
             # Enhanced validation
-            if amount <= 0:
+            if amount_paise <= 0:
                 return JsonResponse({'error': 'Amount must be greater than 0'}, status=400)
-            if amount > float(invoice.balance_amount):
+            if amount_paise > to_paise(invoice.balance_amount):
                 return JsonResponse({'error': 'Amount cannot exceed balance amount'}, status=400)
-            if amount < 1:  # Minimum payment amount
+            if amount_paise < PAISE_PER_RUPEE:  # Minimum payment amount
                 return JsonResponse({'error': 'Minimum payment amount is ₹1'}, status=400)
+            amount = to_rupees(amount_paise)
 
-            # Check for duplicate payments (only those within last 1 minute)
-            existing_payment = Payment.objects.filter(
+            # Hand out the still-open session of an earlier click for the same amount
+            # instead of creating another one; abandoned checkouts are expired in
+            # bulk by the expire_abandoned_checkouts command
+            open_payment = Payment.objects.filter(
                 invoice=invoice,
-                amount=amount,
                 status='pending',
-                timestamp__gte=timezone.now() - timezone.timedelta(minutes=1)
-            ).first()
-
-            if existing_payment:
+                amount=amount,
+                checkout_url__isnull=False,
+                checkout_expires_at__gt=timezone.now() + timezone.timedelta(
+                    minutes=settings.STRIPE_CHECKOUT_REUSE_MIN_MINUTES
+                ),
+                component_allocations__isnull=True
+            ).order_by('-checkout_expires_at').first()
+
+            if open_payment:
+                logger.info(f"Reusing payment session {open_payment.transaction_id} for user {request.user.id}, invoice {id}")
                 return JsonResponse({
-                    'error': 'A similar payment is already in progress. Please complete or cancel it first.',
-                    'existing_payment_id': existing_payment.id
-                }, status=409)
+                    'checkout_url': open_payment.checkout_url,
+                    'session_id': open_payment.transaction_id,
+                    'payment_id': open_payment.id,
+                    'amount': float(amount),
+                    'expires_at': int(open_payment.checkout_expires_at.timestamp()),
+                    'payment_reference': open_payment.payment_reference,
+                    'reused': True
+                })
 
             # Prepare student info for Stripe
             student_info = {
@@ -1030,7 +1298,7 @@ class CreateCheckoutSessionView(APIView):
 
             # Create Stripe checkout session
             try:
-                session = create_checkout_session(id, amount, student_info)
+                session = create_checkout_session(id, amount, student_info, customer_id=student.stripe_customer_id)
             except Exception as e:
                 logger.error(f"Stripe configuration error: {str(e)}")
                 return JsonResponse({'error': 'Stripe configuration error. Please contact admin.'}, status=500)
@@ -1042,7 +1310,10 @@ class CreateCheckoutSessionView(APIView):
                 mode='stripe',
                 transaction_id=session.id,
                 status='pending',
-                payment_reference=f"PAY-{timezone.now().strftime('%Y%m%d%H%M%S')}-{id}"
+                # Unique without reading the last payment, so concurrent checkouts cannot collide
+                payment_reference=f"PAY-{timezone.now().strftime('%Y%m%d%H%M%S')}-{id}-{uuid.uuid4().hex[:8].upper()}",
+                checkout_url=session.url,
+                checkout_expires_at=datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc)
             )
 
             # Create notification about payment initiation
@@ -1058,9 +1329,10 @@ class CreateCheckoutSessionView(APIView):
                 'checkout_url': session.url,
                 'session_id': session.id,
                 'payment_id': payment.id,
-                'amount': amount,
+                'amount': float(amount),
                 'expires_at': session.expires_at,
-                'payment_reference': payment.payment_reference
+                'payment_reference': payment.payment_reference,
+                'reused': False
             })
 
         except Invoice.DoesNotExist:
@@ -1124,7 +1396,9 @@ class InvoiceComponentSelectionView(APIView):
 class ComponentBasedPaymentView(APIView):
     """View for creating payments for selected components"""
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ComponentPaymentThrottle]
 
+    @idempotent
     def post(self, request, invoice_id):
         """Create payment session for selected components"""
         from .stripe_service import create_checkout_session
@@ -1142,14 +1416,17 @@ class ComponentBasedPaymentView(APIView):
                 return JsonResponse({'error': 'No components selected for payment'}, status=400)
 
             # Validate and calculate total payment amount
-            total_payment_amount = 0
+            total_payment_paise = 0
             validated_components = []
 
             for comp_payment in component_payments:
                 component_id = comp_payment.get('component_id')
-                payment_amount = float(comp_payment.get('amount', 0))
+                try:
+                    payment_paise = parse_paise(comp_payment.get('amount', 0))
+                except ValueError as e:
+                    return JsonResponse({'error': str(e)}, status=400)
 
-                if payment_amount <= 0:
+                if payment_paise <= 0:
                     continue
 
                 try:
@@ -1160,24 +1437,25 @@ class ComponentBasedPaymentView(APIView):
                     )
 
                     # Validate payment amount doesn't exceed balance
-                    if payment_amount > float(component.balance_amount):
+                    if payment_paise > to_paise(component.balance_amount):
                         return JsonResponse({
                             'error': f'Payment amount for {component.component_name} exceeds balance'
                         }, status=400)
 
                     validated_components.append({
                         'component': component,
-                        'amount': payment_amount
+                        'amount': to_rupees(payment_paise)
                     })
-                    total_payment_amount += payment_amount
+                    total_payment_paise += payment_paise
 
                 except InvoiceComponent.DoesNotExist:
                     return JsonResponse({
                         'error': f'Invalid component or component has no balance: {component_id}'
                     }, status=400)
 
-            if total_payment_amount <= 0:
+            if total_payment_paise <= 0:
                 return JsonResponse({'error': 'Total payment amount must be greater than 0'}, status=400)
+            total_payment_amount = to_rupees(total_payment_paise)
 
             # Create payment record
             payment = Payment.objects.create(
@@ -1216,17 +1494,25 @@ class ComponentBasedPaymentView(APIView):
                 description += f" and {len(component_descriptions) - 3} more"
 
             # Create Stripe checkout session with component details
-            session = create_checkout_session(
-                invoice_id,
-                total_payment_amount,
-                student_info,
-                description=description,
-                metadata={
-                    'payment_id': str(payment.id),
-                    'component_count': str(len(validated_components)),
-                    'is_partial_payment': 'true'
-                }
-            )
+            try:
+                session = create_checkout_session(
+                    invoice_id,
+                    total_payment_amount,
+                    student_info,
+                    customer_id=student.stripe_customer_id,
+                    description=description,
+                    metadata={
+                        'payment_id': str(payment.id),
+                        'component_count': str(len(validated_components)),
+                        'is_partial_payment': 'true'
+                    }
+                )
+            except Exception as e:
+                # A server error, so an Idempotency-Key retry runs again instead of replaying it
+                logger.error(f"Stripe configuration error: {str(e)}")
+                payment.status = 'failed'
+                payment.save()
+                return JsonResponse({'error': 'Stripe configuration error. Please contact admin.'}, status=500)
 
             # Update payment with transaction ID
             payment.transaction_id = session.id
@@ -1243,7 +1529,7 @@ class ComponentBasedPaymentView(APIView):
                 'checkout_url': session.url,
                 'session_id': session.id,
                 'payment_id': payment.id,
-                'amount': total_payment_amount,
+                'amount': float(total_payment_amount),
                 'components_selected': len(validated_components),
                 'expires_at': session.expires_at,
                 'is_partial_payment': True
@@ -1254,7 +1540,99 @@ class ComponentBasedPaymentView(APIView):
         except StudentProfile.DoesNotExist:
             return JsonResponse({'error': 'Student profile not found'}, status=404)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
+            logger.error(f"Error creating component payment session: {str(e)}")
+            return JsonResponse({'error': 'Payment processing error. Please try again.'}, status=500)
+
+class CartCheckoutSessionView(APIView):
+    """View for paying several outstanding invoices in one Stripe checkout"""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [CartCheckoutThrottle]
+
+    @idempotent
+    def post(self, request):
+        """Create one payment session with a line item per invoice"""
+        from .stripe_service import create_cart_checkout_session
+        try:
+            student = StudentProfile.objects.get(user=request.user)
+        except StudentProfile.DoesNotExist:
+            return JsonResponse({'error': 'Student profile not found'}, status=404)
+
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'error': 'items must be a non-empty list of {invoice_id, amount}'}, status=400)
+        if len(items) > MAX_CART_INVOICES:
+            return JsonResponse({'error': f'A cart can pay at most {MAX_CART_INVOICES} invoices'}, status=400)
+        try:
+            invoice_ids = [int(item['invoice_id']) for item in items]
+        except (KeyError, TypeError, ValueError):
+            return JsonResponse({'error': 'Every item needs a numeric invoice_id'}, status=400)
+        if len(set(invoice_ids)) != len(invoice_ids):
+            return JsonResponse({'error': 'Each invoice can appear only once in a cart'}, status=400)
+
+        invoices = Invoice.objects.filter(student=student).in_bulk(invoice_ids)
+        missing = [invoice_id for invoice_id in invoice_ids if invoice_id not in invoices]
+        if missing:
+            return JsonResponse({'error': f'Invoices not found: {missing}'}, status=404)
+
+        lines = []
+        for item, invoice_id in zip(items, invoice_ids):
+            invoice = invoices[invoice_id]
+            try:
+                amount_paise = parse_paise(item.get('amount', invoice.balance_amount))
+            except ValueError:
+                return JsonResponse({'error': f'Invalid amount for invoice {invoice.invoice_number}'}, status=400)
+            if amount_paise < PAISE_PER_RUPEE:
+                return JsonResponse({'error': f'Minimum payment amount is ₹1 (invoice {invoice.invoice_number})'}, status=400)
+            if amount_paise > to_paise(invoice.balance_amount):
+                return JsonResponse({'error': f'Amount cannot exceed balance of invoice {invoice.invoice_number}'}, status=400)
+            lines.append({'invoice_id': invoice.id, 'invoice_number': invoice.invoice_number, 'amount': to_rupees(amount_paise)})
+
+        student_info = {
+            'name': student.name,
+            'usn': student.usn,
+            'email': request.user.email,
+            'dept': student.dept,
+            'semester': student.semester
+        }
+        try:
+            session = create_cart_checkout_session(lines, student_info, customer_id=student.stripe_customer_id)
+        except Exception as e:
+            logger.error(f"Stripe configuration error: {str(e)}")
+            return JsonResponse({'error': 'Stripe configuration error. Please contact admin.'}, status=500)
+
+        # One pending payment per invoice, tied together by the session id; no
+        # checkout_url, so a single-invoice checkout never hands out the cart session
+        expires_at = datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc)
+        with transaction.atomic():
+            payments = [
+                Payment.objects.create(
+                    invoice_id=line['invoice_id'],
+                    amount=line['amount'],
+                    mode='stripe',
+                    transaction_id=session.id,
+                    status='pending',
+                    checkout_expires_at=expires_at
+                )
+                for line in lines
+            ]
+        total = sum(line['amount'] for line in lines)
+        Notification.objects.create(
+            user=request.user,
+            message=f"Payment session created for ₹{total} covering {len(lines)} invoices. Complete the payment within {settings.STRIPE_CHECKOUT_SESSION_MINUTES} minutes.",
+            is_read=False
+        )
+        logger.info(f"Cart payment session created: {session.id} for user {request.user.id}, invoices {invoice_ids}, amount {total}")
+
+        return JsonResponse({
+            'checkout_url': session.url,
+            'session_id': session.id,
+            'amount': float(total),
+            'expires_at': session.expires_at,
+            'payments': [
+                {'payment_id': payment.id, 'invoice_id': payment.invoice_id, 'amount': float(payment.amount)}
+                for payment in payments
+            ]
+        })
 
 class PaymentStatusView(APIView):
     """View to check payment status"""
@@ -1311,7 +1689,7 @@ class PaymentStatusView(APIView):
             response_data = {
                 'session_id': session_id,
                 'payment_status': session.payment_status,
-                'amount_total': session.amount_total / 100,  # Convert from paise to rupees
+                'amount_total': float(to_rupees(session.amount_total)),
                 'currency': session.currency,
                 'customer_email': session.customer_details.email if session.customer_details else None,
                 'created': session.created,
@@ -1382,6 +1760,10 @@ class StripeWebhookView(APIView):
                 session = event['data']['object']
                 self.handle_checkout_session_completed(session)
                 
+            elif event['type'] == 'checkout.session.expired':
+                session = event['data']['object']
+                self.handle_checkout_session_expired(session)
+
             elif event['type'] == 'payment_intent.succeeded':
                 payment_intent = event['data']['object']
                 self.handle_payment_intent_succeeded(payment_intent)
@@ -1405,38 +1787,40 @@ class StripeWebhookView(APIView):
         return HttpResponse(status=200)
     
     def handle_checkout_session_completed(self, session):
-        """Handle successful checkout session completion"""
+        """Handle successful checkout session completion, returning the payments settled"""
+        settled = []
         try:
-            payment = Payment.objects.get(transaction_id=session['id'])
-            payment.status = 'success'
-            payment.save()
-            
-            # Check if this is a component-based payment
-            is_partial_payment = session.get('metadata', {}).get('is_partial_payment') == 'true'
-            
-            if is_partial_payment:
-                # Handle component-based payment allocation
-                self.allocate_payment_to_selected_components(payment, float(payment.amount))
-            else:
-                # Handle full payment allocation (existing logic)
-                self.allocate_payment_to_components(payment, float(payment.amount))
-            
-            # Update invoice
+            # One payment per invoice; a cart checkout pays several invoices at once
+            payments = list(Payment.objects.filter(transaction_id=session['id']))
+            if not payments:
+                print(f"Payment not found for session {session['id']}")
+                return []
+
+            settled = settle_payments(payments)
+            if not settled:
+                print(f"Payments for session {session['id']} were already settled")
+                return []
+            student = settled[0].invoice.student
+
+            # Remember the customer Stripe created, so later checkouts reuse it
+            if session.get('customer') and not student.stripe_customer_id:
+                StudentProfile.objects.filter(
+                    pk=student.pk, stripe_customer_id__isnull=True
+                ).update(stripe_customer_id=session['customer'])
+
+            if len(settled) > 1:
+                self.notify_cart_settled(student, settled)
+                return settled
+
+            payment = settled[0]
             invoice = payment.invoice
-            if not invoice:
-                print(f"Payment {payment.id} has no associated invoice")
-                return
-                
-            invoice.paid_amount += payment.amount
-            invoice.balance_amount -= payment.amount
-            invoice.status = 'paid' if invoice.balance_amount <= 0 else 'partial'
-            invoice.save()
-            
+            is_partial_payment = session.get('metadata', {}).get('is_partial_payment') == 'true'
+
             # Create success notification for student
-            if invoice.student and invoice.student.user:
+            if student.user:
                 payment_type = "partial" if is_partial_payment else "full"
                 Notification.objects.create(
-                    user=invoice.student.user,
+                    user=student.user,
                     message=f"{payment_type.title()} payment of ₹{payment.amount} received successfully on {payment.timestamp.strftime('%d-%b-%Y')}. Pending amount: ₹{invoice.balance_amount}",
                     is_read=False
                 )
@@ -1444,11 +1828,37 @@ class StripeWebhookView(APIView):
             # Generate and send receipt automatically
             self.generate_and_send_receipt(payment)
             
-        except Payment.DoesNotExist:
-            print(f"Payment not found for session {session.id}")
         except Exception as e:
+            # Payments settled before a failed notification or receipt stay settled
             print(f"Error handling checkout session completed: {str(e)}")
+        return settled
+
+    def notify_cart_settled(self, student, payments):
+        """Create the receipts of a cart checkout and send the student one notification"""
+        Receipt.objects.bulk_create([
+            Receipt(
+                payment=payment,
+                receipt_number=f"RCPT-{payment.id:06d}",
+                amount=payment.amount,
+                generated_at=timezone.now()
+            )
+            for payment in payments
+        ])
+        # Receipt PDFs of cart payments are rendered on download
+        total = sum(payment.amount for payment in payments)
+        invoices = ', '.join(payment.invoice.invoice_number for payment in payments)
+        Notification.objects.create(
+            user=student.user,
+            message=f"Payment of ₹{total} received successfully for invoices {invoices}. Receipts: {', '.join(f'RCPT-{payment.id:06d}' for payment in payments)}",
+            is_read=False
+        )
     
+    def handle_checkout_session_expired(self, session):
+        """Mark the checkout's pending payments expired as soon as Stripe expires the session"""
+        for payment in Payment.objects.filter(transaction_id=session['id'], status='pending'):
+            payment.status = 'expired'
+            payment.save()
+
     def handle_payment_intent_succeeded(self, payment_intent):
         """Handle successful payment intent"""
         try:
@@ -1562,87 +1972,6 @@ class StripeWebhookView(APIView):
         except Exception as e:
             print(f"Error generating receipt: {e}")
 
-    def allocate_payment_to_components(self, payment, amount):
-        """Allocate payment amount to invoice components"""
-        try:
-            invoice = payment.invoice
-            if not invoice:
-                print(f"Payment {payment.id} has no associated invoice")
-                return False
-                
-            components = InvoiceComponent.objects.filter(invoice=invoice, balance_amount__gt=0).order_by('id')
-            
-            remaining_amount = amount
-            
-            for component in components:
-                if remaining_amount <= 0:
-                    break
-                    
-                # Calculate how much to allocate to this component
-                allocation = min(remaining_amount, float(component.balance_amount))
-                
-                # Update component payment status
-                component.paid_amount += allocation
-                component.balance_amount -= allocation
-                component.save()
-                
-                # Create payment component allocation record
-                PaymentComponent.objects.create(
-                    payment=payment,
-                    invoice_component=component,
-                    amount_allocated=allocation
-                )
-                
-                remaining_amount -= allocation
-                
-            return True
-            
-        except Exception as e:
-            print(f"Error allocating payment to components: {e}")
-            return False
-    
-    def allocate_payment_to_selected_components(self, payment, amount):
-        """Allocate payment amount to pre-selected components"""
-        try:
-            # Get pre-allocated components for this payment
-            component_allocations = PaymentComponent.objects.filter(
-                payment=payment,
-                amount_allocated__gt=0
-            ).select_related('invoice_component')
-            
-            if not component_allocations:
-                print(f"No component allocations found for payment {payment.id}, falling back to standard allocation")
-                return self.allocate_payment_to_components(payment, amount)
-            
-            remaining_amount = amount
-            
-            for allocation in component_allocations:
-                if remaining_amount <= 0:
-                    break
-                    
-                component = allocation.invoice_component
-                allocated_amount = float(allocation.amount_allocated)
-                
-                # Allocate to this component
-                actual_allocation = min(remaining_amount, allocated_amount)
-                
-                # Update component payment status
-                component.paid_amount += actual_allocation
-                component.balance_amount -= actual_allocation
-                component.save()
-                
-                # Update the allocation record with actual amount allocated
-                allocation.amount_allocated = actual_allocation
-                allocation.save()
-                
-                remaining_amount -= actual_allocation
-                
-            return True
-            
-        except Exception as e:
-            print(f"Error allocating payment to selected components: {e}")
-            return False
-    
     def save_receipt_pdf(self, receipt, receipt_data):
         """Save receipt PDF to receipts folder"""
         try:
@@ -1695,6 +2024,7 @@ class RefundPaymentView(APIView):
     """Admin view to create refunds"""
     permission_classes = [IsAdminUser]
     
+    @idempotent
     def post(self, request, payment_id):
         from .stripe_service import create_refund
         try:
@@ -1703,30 +2033,46 @@ class RefundPaymentView(APIView):
             if payment.status != 'success':
                 return JsonResponse({'error': 'Only successful payments can be refunded'}, status=400)
             
-            refund_amount = request.data.get('amount', float(payment.amount))
+            # Defaults to what is left of the payment after earlier partial refunds
+            refundable_paise = to_paise(payment.amount) - to_paise(payment.refunded_amount)
+            try:
+                refund_paise = parse_paise(request.data.get('amount', to_rupees(refundable_paise)))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
             reason = request.data.get('reason', 'Admin initiated refund')
             
             # Validate refund amount
-            if refund_amount <= 0 or refund_amount > float(payment.amount):
+            if refund_paise <= 0 or refund_paise > refundable_paise:
                 return JsonResponse({'error': 'Invalid refund amount'}, status=400)
+            refund_amount = to_rupees(refund_paise)
             
-            # Create refund in Stripe
-            refund = create_refund(
-                payment.transaction_id,
-                refund_amount,
-                reason
-            )
-            
-            # Update payment status
-            payment.status = 'refunded'
-            payment.save()
-            
-            # Update invoice amounts
-            invoice = payment.invoice
-            invoice.paid_amount -= refund_amount
-            invoice.balance_amount += refund_amount
-            invoice.status = 'partial' if invoice.balance_amount > 0 else 'paid'
-            invoice.save()
+            # Create refund in Stripe; a failure is a server error, so an
+            # Idempotency-Key retry runs again instead of replaying it
+            try:
+                refund = create_refund(
+                    payment.transaction_id,
+                    refund_amount,
+                    reason
+                )
+            except Exception as e:
+                logger.error(f"Refund of payment {payment.id} failed: {str(e)}")
+                return JsonResponse({'error': 'Refund could not be processed by Stripe. Please try again.'}, status=500)
+            
+            with transaction.atomic():
+                # Only a refund of the whole payment marks it refunded; the collection
+                # rollups take out just the amount refunded (see sync_payment_collection)
+                payment.refunded_amount = to_rupees(to_paise(payment.refunded_amount) + refund_paise)
+                if refund_paise == refundable_paise:
+                    payment.status = 'refunded'
+                payment.save()
+                
+                # Update invoice amounts
+                invoice = payment.invoice
+                invoice.paid_amount -= refund_amount
+                invoice.balance_amount += refund_amount
+                invoice.status = 'partial' if invoice.balance_amount > 0 else 'paid'
+                invoice.save()
+                post_ledger('refund', invoice, refund_paise, payment=payment, memo=reason, user=request.user)
             
             # Create notification
             if invoice.student and invoice.student.user:
@@ -1738,7 +2084,7 @@ class RefundPaymentView(APIView):
             
             return JsonResponse({
                 'refund_id': refund.id,
-                'amount': refund_amount,
+                'amount': float(refund_amount),
                 'status': refund.status,
                 'reason': reason
             })
@@ -1746,7 +2092,8 @@ class RefundPaymentView(APIView):
         except Payment.DoesNotExist:
             return JsonResponse({'error': 'Payment not found'}, status=404)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
+            logger.error(f"Error refunding payment {payment_id}: {str(e)}")
+            return JsonResponse({'error': str(e)}, status=500)
 
 class AdminCustomFeeStructureView(APIView):
     permission_classes = [IsAdminUser]
@@ -1777,17 +2124,11 @@ class AdminCustomFeeStructureView(APIView):
                 return JsonResponse({'error': 'Components are required'}, status=400)
             
             # Create or update custom fee structure
-            custom_fees, created = CustomFeeStructure.objects.get_or_create(
-                student=student,
-                defaults={'components': components}
-            )
-            
-            if not created:
-                custom_fees.components = components
-                custom_fees.save()
+            custom_fees = CustomFeeStructure.objects.filter(student=student).first() or CustomFeeStructure(student=student)
+            custom_fees.set_components(components)
             
             # Generate invoice
-            total_amount = sum(float(amount) for amount in components.values())
+            total_amount = custom_fees.total_amount
             invoice, inv_created = Invoice.objects.get_or_create(
                 student=student,
                 semester=student.semester,
@@ -1801,7 +2142,7 @@ class AdminCustomFeeStructureView(APIView):
             
             if not inv_created:
                 invoice.total_amount = total_amount
-                invoice.balance_amount = float(invoice.total_amount) - float(invoice.paid_amount)
+                invoice.balance_amount = total_amount - invoice.paid_amount
                 invoice.save()
             
             return JsonResponse({
@@ -1816,43 +2157,45 @@ class AdminCustomFeeStructureView(APIView):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
+class AdminCustomFeeComponentTotalsView(APIView):
+    """Admin view totalling custom fee components per component name and department"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        components = CustomFeeComponent.objects.all()
+        if request.GET.get('dept'):
+            components = components.filter(student__dept=request.GET['dept'])
+        if request.GET.get('component'):
+            components = components.filter(component_name=request.GET['component'])
+        rows = components.values('component_name', dept=F('student__dept')).annotate(
+            students=Count('student_id'), amount=Sum('amount')
+        ).order_by('component_name', 'dept')
+        return ORJSONResponse({'rows': [dict(row, amount=to_rupees(row['amount'])) for row in rows]})
+
 class AdminStudentFeeProfileView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request, student_id):
         try:
             student = StudentProfile.objects.get(id=student_id)
-            invoices = Invoice.objects.filter(student=student)
-            payments = Payment.objects.filter(invoice__student=student)
             custom_fees = CustomFeeStructure.objects.filter(student=student).first()
-            
-            # Calculate totals
-            total_fee = sum(float(inv.total_amount) for inv in invoices)
-            total_paid = sum(float(inv.paid_amount) for inv in invoices)
-            total_pending = sum(float(inv.balance_amount) for inv in invoices)
-            
-            # Payment history
-            payment_history = [{
-                'id': p.id,
-                'amount': float(p.amount),
-                'mode': p.mode,
-                'status': p.status,
-                'timestamp': p.timestamp.isoformat(),
-                'invoice_id': p.invoice.id
-            } for p in payments]
-            
+
             # Invoice details
-            invoice_details = [{
-                'id': inv.id,
-                'semester': inv.semester,
-                'total_amount': float(inv.total_amount),
-                'paid_amount': float(inv.paid_amount),
-                'balance_amount': float(inv.balance_amount),
-                'status': inv.status,
-                'due_date': inv.due_date.isoformat() if inv.due_date else None
-            } for inv in invoices]
-            
-            return JsonResponse({
+            invoice_details = list(Invoice.objects.filter(student=student).values(
+                'id', 'semester', 'total_amount', 'paid_amount', 'balance_amount', 'status', 'due_date'
+            ))
+
+            # Payment history
+            payment_history = list(Payment.objects.filter(invoice__student=student).values(
+                'id', 'amount', 'mode', 'status', 'timestamp', 'invoice_id'
+            ))
+
+            # Calculate totals
+            total_fee = sum(inv['total_amount'] for inv in invoice_details)
+            total_paid = sum(inv['paid_amount'] for inv in invoice_details)
+            total_pending = sum(inv['balance_amount'] for inv in invoice_details)
+
+            return ORJSONResponse({
                 'student': {
                     'id': student.id,
                     'name': student.name,
@@ -1892,38 +2235,37 @@ class AdminStudentStatusDashboardView(APIView):
             'partial_payment': [],
             'unpaid': []
         }
-        
-        for student in students:
-            invoices = Invoice.objects.filter(student=student)
-            total_fee = sum(float(inv.total_amount) for inv in invoices)
-            total_paid = sum(float(inv.paid_amount) for inv in invoices)
-            total_pending = sum(float(inv.balance_amount) for inv in invoices)
-            
-            student_data = {
-                'id': student.id,
-                'name': student.name,
-                'usn': student.usn,
-                'dept': student.dept,
-                'semester': student.semester,
-                'total_fee': total_fee,
-                'total_paid': total_paid,
-                'total_pending': total_pending
-            }
-            
+
+        zero = Value(0, output_field=DecimalField())
+        students = list(students.annotate(
+            total_fee=Coalesce(Sum('invoice__total_amount'), zero),
+            total_paid=Coalesce(Sum('invoice__paid_amount'), zero),
+            total_pending=Coalesce(Sum('invoice__balance_amount'), zero),
+        ).values('id', 'name', 'usn', 'dept', 'semester', 'total_fee', 'total_paid', 'total_pending'))
+
+        for student_data in students:
+            total_fee = student_data['total_fee']
+            total_paid = student_data['total_paid']
+            total_pending = student_data['total_pending']
+
             if total_pending <= 0 and total_fee > 0:
                 status_cards['fully_paid'].append(student_data)
             elif total_paid > 0 and total_pending > 0:
                 status_cards['partial_payment'].append(student_data)
             elif total_paid == 0:
                 status_cards['unpaid'].append(student_data)
-        
-        return JsonResponse({
+
+        totals = cube_totals(invoice_cube({'dept': dept, 'semester': semester}))
+        return ORJSONResponse({
             'status_cards': status_cards,
             'summary': {
                 'total_students': len(students),
                 'fully_paid_count': len(status_cards['fully_paid']),
                 'partial_payment_count': len(status_cards['partial_payment']),
-                'unpaid_count': len(status_cards['unpaid'])
+                'unpaid_count': len(status_cards['unpaid']),
+                'total_fee': totals['total_fees'],
+                'total_paid': totals['total_paid'],
+                'total_pending': totals['total_balance'],
             }
         })
 
@@ -1931,34 +2273,106 @@ class AdminCollectionsReportView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
-        month = request.GET.get('month')
-        semester = request.GET.get('semester')
-        dept = request.GET.get('dept')
-        
-        payments = Payment.objects.filter(status='success')
-        
-        if month:
-            # Filter by month (implement date filtering logic)
-            pass
-        if semester:
-            payments = payments.filter(invoice__student__semester=semester)
-        if dept:
-            payments = payments.filter(invoice__student__dept=dept)
-        
-        total_collections = payments.aggregate(Sum('amount'))['amount__sum'] or 0
-        
-        # Group by payment mode
-        mode_breakdown = {}
-        for payment in payments:
-            mode = payment.mode
-            if mode not in mode_breakdown:
-                mode_breakdown[mode] = 0
-            mode_breakdown[mode] += float(payment.amount)
-        
+        try:
+            rows = daily_collections(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        totals = rows.aggregate(amount=Sum('amount'), payment_count=Sum('payment_count'))
+        mode_breakdown = {
+            row['mode']: float(row['amount']) for row in collection_breakdown(rows, 'mode')
+        }
+        month_breakdown = [
+            {'month': row['period'].strftime('%Y-%m'), 'amount': float(row['amount']), 'payment_count': row['payment_count']}
+            for row in collection_breakdown(rows, interval='month')
+        ]
+        term_breakdown = [
+            {'semester': row['semester'] or None, 'amount': float(row['amount']), 'payment_count': row['payment_count']}
+            for row in collection_breakdown(rows, 'semester')
+        ]
+
         return JsonResponse({
-            'total_collections': float(total_collections),
+            'total_collections': float(totals['amount'] or 0),
             'mode_breakdown': mode_breakdown,
-            'payment_count': len(payments)
+            'payment_count': totals['payment_count'] or 0,
+            'month_breakdown': month_breakdown,
+            'term_breakdown': term_breakdown,
+        })
+
+class AdminCollectionsTimeSeriesView(APIView):
+    """Admin view returning collections per day or month, optionally split by mode, dept or semester"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        interval = request.GET.get('interval', 'day')
+        if interval not in COLLECTION_INTERVALS:
+            return JsonResponse({'error': f"interval must be one of: {', '.join(COLLECTION_INTERVALS)}"}, status=400)
+        group_by = request.GET.get('group_by')
+        if group_by and group_by not in COLLECTION_GROUPS:
+            return JsonResponse({'error': f"group_by must be one of: {', '.join(COLLECTION_GROUPS)}"}, status=400)
+        try:
+            rows = daily_collections(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        series = collection_breakdown(rows, *([group_by] if group_by else []), interval=interval)
+        return ORJSONResponse({'interval': interval, 'group_by': group_by, 'series': list(series)})
+
+class AdminComponentCollectionsView(APIView):
+    """Admin view returning collections per fee component, optionally per day or month and split by dept or mode"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        interval = request.GET.get('interval')
+        if interval and interval not in COLLECTION_INTERVALS:
+            return JsonResponse({'error': f"interval must be one of: {', '.join(COLLECTION_INTERVALS)}"}, status=400)
+        group_by = [name.strip() for name in request.GET.get('group_by', '').split(',') if name.strip()]
+        unknown = [name for name in group_by if name not in COMPONENT_COLLECTION_GROUPS]
+        if unknown:
+            return JsonResponse({
+                'error': f"Unknown groups: {', '.join(unknown)}. Available groups: {', '.join(COMPONENT_COLLECTION_GROUPS)}"
+            }, status=400)
+        try:
+            rows = component_collections(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return ORJSONResponse({
+            'interval': interval,
+            'group_by': group_by,
+            'rows': [
+                dict(row, amount=to_rupees(row['amount']))
+                for row in component_breakdown(rows, *group_by, interval=interval)
+            ],
+            'totals': [dict(row, amount=to_rupees(row['amount'])) for row in component_breakdown(rows)],
+        })
+
+class AdminAnalyticsQueryView(APIView):
+    """Admin view answering filter/group/aggregate queries from the analytics snapshot"""
+    permission_classes = [IsAdminUser]
+    reserved_params = ('group_by', 'metrics', 'format', 'fields')
+
+    def get(self, request, table):
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return JsonResponse({'error': 'Analytics snapshot has not been built yet'}, status=503)
+        if table not in snapshot.tables:
+            return JsonResponse({'error': f"Unknown table. Available tables: {', '.join(snapshot.tables)}"}, status=404)
+
+        data = snapshot.tables[table]
+        group_by = [name for name in request.GET.get('group_by', '').split(',') if name]
+        metrics = [name for name in request.GET.get('metrics', 'count').split(',') if name]
+        filters = {key: value for key, value in request.GET.items() if key not in self.reserved_params}
+        try:
+            matched, rows = data.aggregate(group_by, metrics, data.mask(filters))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return ORJSONResponse({
+            'snapshot': snapshot.created_at,
+            'table': table,
+            'matched': matched,
+            'rows': rows,
         })
 
 class AdminIndividualFeeAssignmentView(APIView):
@@ -1972,7 +2386,7 @@ class AdminIndividualFeeAssignmentView(APIView):
             invoices = Invoice.objects.filter(student=student)
             
             # Get existing fee components for reference
-            fee_components = FeeComponent.objects.all()
+            fee_components = get_fee_components()
             
             return JsonResponse({
                 'student': {
@@ -1985,9 +2399,9 @@ class AdminIndividualFeeAssignmentView(APIView):
                 'custom_fee_structure': custom_fees.components if custom_fees else None,
                 'total_amount': float(custom_fees.total_amount) if custom_fees else 0,
                 'available_components': [{
-                    'id': comp.id,
-                    'name': comp.name,
-                    'amount': float(comp.amount)
+                    'id': comp['id'],
+                    'name': comp['name'],
+                    'amount': float(comp['amount'])
                 } for comp in fee_components],
                 'invoices': [{
                     'id': inv.id,
@@ -2012,21 +2426,16 @@ class AdminIndividualFeeAssignmentView(APIView):
                 return JsonResponse({'error': 'Components are required'}, status=400)
             
             # Validate components
-            total_amount = 0
+            total_paise = 0
             for component_name, amount in components.items():
                 if not isinstance(amount, (int, float)) or amount < 0:
                     return JsonResponse({'error': f'Invalid amount for {component_name}'}, status=400)
-                total_amount += float(amount)
+                total_paise += to_paise(amount)
+            total_amount = to_rupees(total_paise)
             
             # Create or update custom fee structure
-            custom_fees, created = CustomFeeStructure.objects.get_or_create(
-                student=student,
-                defaults={'components': components}
-            )
-            
-            if not created:
-                custom_fees.components = components
-                custom_fees.save()
+            custom_fees = CustomFeeStructure.objects.filter(student=student).first() or CustomFeeStructure(student=student)
+            custom_fees.set_components(components)
             
             # Create or update invoice with component breakdown
             invoice, inv_created = Invoice.objects.get_or_create(
@@ -2042,9 +2451,9 @@ class AdminIndividualFeeAssignmentView(APIView):
             
             if not inv_created:
                 # Update existing invoice
-                old_total = float(invoice.total_amount)
+                old_total = invoice.total_amount
                 invoice.total_amount = total_amount
-                invoice.balance_amount = float(invoice.balance_amount) + (total_amount - old_total)
+                invoice.balance_amount = invoice.balance_amount + (total_amount - old_total)
                 invoice.save()
             
             # Create or update invoice components
@@ -2183,7 +2592,7 @@ class AdminBulkFeeAssignmentView(APIView):
         department = data.get('department')
         template_id = data.get('template_id')
         academic_year = data.get('academic_year', '2024-25')
-        dry_run = data.get('dry_run', False)  # Default to False for safety
+        dry_run = str(data.get('dry_run', False)).lower() in ('true', '1', 'yes')  # Default to False for safety
 
         # Normalize and validate inputs
         if template_id is not None:
@@ -2226,67 +2635,102 @@ class AdminBulkFeeAssignmentView(APIView):
         # Exclude students who already have an assignment for this academic year
         students = students_qs.exclude(feeassignment__academic_year=academic_year)
 
-        if not students:
+        if not students.exists():
             return JsonResponse({
                 'error': 'No eligible students found matching the criteria'
             }, status=400)
 
+        template_components = get_fee_template(template.id)['components']
+
+        if dry_run:
+            # Preview with counts and template totals, without touching any student
+            by_department = list(students.values('dept').annotate(students=Count('id')).order_by('dept'))
+            student_count = sum(row['students'] for row in by_department)
+            return ORJSONResponse({
+                'message': 'Preview bulk assignment',
+                'assignments_created': student_count,
+                'invoices_created': student_count,
+                'projected_revenue': template.total_amount * student_count,
+                'by_department': [
+                    dict(row, projected_revenue=template.total_amount * row['students']) for row in by_department
+                ],
+                'components': [{
+                    'name': component['name'],
+                    'amount_per_student': component['amount'],
+                    'projected_revenue': component['amount'] * student_count,
+                } for component in template_components],
+                'dry_run': True
+            })
+
         assignments_created = 0
         invoices_created = 0
         admin_user = request.user
 
         for student in students:
-            if not dry_run:
-                # Create fee assignment
-                assignment = FeeAssignment.objects.create(
-                    student=student,
-                    template=template,
-                    assignment_type='bulk',
-                    academic_year=academic_year,
-                    assigned_by=admin_user,
-                    is_active=True
-                )
+            # Create fee assignment
+            assignment = FeeAssignment.objects.create(
+                student=student,
+                template=template,
+                assignment_type='bulk',
+                academic_year=academic_year,
+                assigned_by=admin_user,
+                is_active=True
+            )
 
-                # Create invoice
-                invoice = Invoice.objects.create(
-                    student=student,
-                    assignment=assignment,
-                    invoice_type=template.fee_type,
-                    academic_year=academic_year,
-                    total_amount=template.total_amount,
+            # Create invoice
+            invoice = Invoice.objects.create(
+                student=student,
+                assignment=assignment,
+                invoice_type=template.fee_type,
+                academic_year=academic_year,
+                total_amount=template.total_amount,
+                paid_amount=0,
+                balance_amount=template.total_amount,
+                due_date=date.today(),
+                status='pending'
+            )
+
+            # Create invoice components from template
+            for component in template_components:
+                InvoiceComponent.objects.create(
+                    invoice=invoice,
+                    component_name=component['name'],
+                    component_amount=component['amount'],
                     paid_amount=0,
-                    balance_amount=template.total_amount,
-                    due_date=date.today(),
-                    status='pending'
+                    balance_amount=component['amount']
                 )
 
-                # Create invoice components from template
-                for ft_component in template.feetemplatecomponent_set.all():
-                    InvoiceComponent.objects.create(
-                        invoice=invoice,
-                        component_name=ft_component.component.name,
-                        component_amount=ft_component.amount_override or ft_component.component.amount,
-                        paid_amount=0,
-                        balance_amount=ft_component.amount_override or ft_component.component.amount
-                    )
-
             assignments_created += 1
             invoices_created += 1
 
-        action = "simulated" if dry_run else "assigned"
         return JsonResponse({
-            'message': f'{"Preview" if dry_run else "Executed"} bulk assignment',
+            'message': 'Executed bulk assignment',
             'assignments_created': assignments_created,
             'invoices_created': invoices_created,
-            'dry_run': dry_run
+            'dry_run': False
         })
 
 
+class AdminFeeRevisionSimulationView(APIView):
+    """Admin view projecting revenue under proposed fee component changes"""
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        academic_year = request.data.get('academic_year', '2024-25')
+        include_unassigned = str(request.data.get('include_unassigned', True)).lower() in ('true', '1', 'yes')
+        try:
+            result = simulate_fee_revision(request.data.get('rules'), academic_year, include_unassigned)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return ORJSONResponse(result)
+
+
 # New APIs for Campus integration
 
 @method_decorator(csrf_exempt, name='dispatch')
 class SyncStudentView(APIView):
     permission_classes = []  # No auth for internal API
+    throttle_classes = [CampusThrottle]
 
     def post(self, request):
         data = request.data
@@ -2335,6 +2779,7 @@ class SyncStudentView(APIView):
 
 class StudentFeesView(APIView):
     permission_classes = []  # No auth for internal API
+    throttle_classes = [CampusThrottle]
 
     def get(self, request, usn):
         try:
@@ -2381,6 +2826,7 @@ class StudentFeesView(APIView):
 
 class StudentCompleteFeeDataView(APIView):
     permission_classes = []  # No auth for external API access
+    throttle_classes = [CampusThrottle]
 
     def get(self, request, usn):
         try:
@@ -2450,66 +2896,37 @@ class StudentCompleteFeeDataView(APIView):
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         # Get all invoices for the student
-        invoices = Invoice.objects.filter(student=student).order_by('-id')
-        invoice_data = []
-        for inv in invoices:
-            invoice_data.append({
-                'id': inv.id,
-                'invoice_number': inv.invoice_number,
-                'semester': inv.semester,
-                'academic_year': inv.academic_year,
-                'total_amount': float(inv.total_amount),
-                'paid_amount': float(inv.paid_amount),
-                'balance_amount': float(inv.balance_amount),
-                'status': inv.status,
-                'due_date': inv.due_date.isoformat() if inv.due_date else None,
-                'created_at': inv.created_at.isoformat() if inv.created_at else None,
-                'invoice_type': inv.invoice_type,
-            })
+        invoices = list(Invoice.objects.filter(student=student).order_by('-id').values(
+            'id', 'invoice_number', 'semester', 'academic_year', 'total_amount', 'paid_amount',
+            'balance_amount', 'status', 'due_date', 'created_at', 'invoice_type'
+        ))
 
         # Get all payments for the student
-        payments = Payment.objects.filter(invoice__student=student).order_by('-timestamp')
-        payment_data = []
-        for pay in payments:
-            payment_data.append({
-                'id': pay.id,
-                'invoice_id': pay.invoice.id if pay.invoice else None,
-                'amount': float(pay.amount),
-                'mode': pay.mode,
-                'status': pay.status,
-                'timestamp': pay.timestamp.isoformat(),
-                'transaction_id': pay.transaction_id,
-                'payment_reference': getattr(pay, 'payment_reference', None),
-            })
+        payments = list(Payment.objects.filter(invoice__student=student).order_by('-timestamp').values(
+            'id', 'invoice_id', 'amount', 'mode', 'status', 'timestamp', 'transaction_id', 'payment_reference'
+        ))
 
         # Get all receipts for the student
-        receipts = Receipt.objects.filter(payment__invoice__student=student).order_by('-generated_at')
-        receipt_data = []
-        for rec in receipts:
-            receipt_data.append({
-                'id': rec.id,
-                'receipt_number': rec.receipt_number,
-                'amount': float(rec.amount),
-                'payment_id': rec.payment.id,
-                'payment_date': rec.payment.timestamp.isoformat(),
-                'payment_mode': rec.payment.mode,
-                'transaction_id': rec.payment.transaction_id,
-                'invoice_id': rec.payment.invoice.id if rec.payment.invoice else None,
-                'semester': rec.payment.invoice.semester if rec.payment.invoice else None,
-                'generated_at': rec.generated_at.isoformat(),
-            })
+        receipts = list(Receipt.objects.filter(payment__invoice__student=student).order_by('-generated_at').values(
+            'id', 'receipt_number', 'amount', 'payment_id', 'generated_at',
+            payment_date=F('payment__timestamp'),
+            payment_mode=F('payment__mode'),
+            transaction_id=F('payment__transaction_id'),
+            invoice_id=F('payment__invoice_id'),
+            semester=F('payment__invoice__semester'),
+        ))
 
         # Calculate summary statistics
-        total_fees = sum(float(inv.total_amount) for inv in invoices)
-        amount_paid = sum(float(pay.amount) for pay in payments if pay.status == 'success')
+        total_fees = sum(inv['total_amount'] for inv in invoices)
+        amount_paid = sum(pay['amount'] for pay in payments if pay['status'] == 'success')
         remaining_fees = total_fees - amount_paid
 
         # Get earliest due date from unpaid invoices
-        unpaid_invoices = [inv for inv in invoices if inv.balance_amount > 0]
+        unpaid_invoices = [inv for inv in invoices if inv['balance_amount'] > 0]
         due_date = None
         if unpaid_invoices:
-            unpaid_invoices.sort(key=lambda x: x.due_date if x.due_date else date.max)
-            due_date = unpaid_invoices[0].due_date.isoformat() if unpaid_invoices[0].due_date else None
+            unpaid_invoices.sort(key=lambda x: x['due_date'] if x['due_date'] else date.max)
+            due_date = unpaid_invoices[0]['due_date']
 
         # Get custom fee structure if exists
         custom_fees = CustomFeeStructure.objects.filter(student=student).first()
@@ -2534,15 +2951,15 @@ class StudentCompleteFeeDataView(APIView):
                 'payment_status': 'paid' if remaining_fees <= 0 else ('partial' if amount_paid > 0 else 'unpaid'),
             },
             'fee_breakdown': fee_breakdown,
-            'invoices': invoice_data,
-            'payments': payment_data,
-            'receipts': receipt_data,
+            'invoices': invoices,
+            'payments': payments,
+            'receipts': receipts,
             'statistics': {
                 'total_invoices': len(invoices),
                 'total_payments': len(payments),
                 'total_receipts': len(receipts),
-                'successful_payments': len([p for p in payments if p.status == 'success']),
-                'pending_payments': len([p for p in payments if p.status == 'pending']),
-                'failed_payments': len([p for p in payments if p.status == 'failed']),
+                'successful_payments': len([p for p in payments if p['status'] == 'success']),
+                'pending_payments': len([p for p in payments if p['status'] == 'pending']),
+                'failed_payments': len([p for p in payments if p['status'] == 'failed']),
             }
         }, status=status.HTTP_200_OK)